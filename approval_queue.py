@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from database import connect, run_db
+from persona_index import persona_names
+from shared import apply_persona_request, invalidate_persona_cache
+
+log = logging.getLogger(__name__)
+
+APPROVAL_TTL = float(os.getenv('APPROVAL_TTL', '604800')) # Seconds a request waits for the admin (7 days)
+APPROVAL_SWEEP_INTERVAL = float(os.getenv('APPROVAL_SWEEP_INTERVAL', '3600'))
+
+# Persona approval requests live in SQLite so they survive restarts and never pile up in memory.
+# Only the fields needed to apply the change and notify the requester are stored.
+# All functions here are blocking; call them through run_db/run_db_read from async code.
+
+_COLUMNS = ("request_id", "type", "user_id", "name", "content", "text_to_append", "approval_message_id", "created_at")
+
+def _row_to_request(row):
+    # Omit NULL columns so callers' request_data.get(key, default) fallbacks keep working
+    return {key: value for key, value in zip(_COLUMNS, row) if value is not None}
+
+def add_approval_request(request_id, request_type, user_id, name=None, content=None, text_to_append=None):
+    now = time.time()
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT INTO approval_requests (request_id, type, user_id, name, content, text_to_append, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (request_id, request_type, user_id, name, content, text_to_append, now, now + APPROVAL_TTL)
+        )
+
+def set_approval_message(request_id, message_id):
+    """Record which admin DM carries the Approve/Reject buttons for a request."""
+    conn = connect()
+    with conn:
+        conn.execute("UPDATE approval_requests SET approval_message_id = ? WHERE request_id = ?", (message_id, request_id))
+
+def get_request_id_for_message(message_id):
+    row = connect().execute(
+        "SELECT request_id FROM approval_requests WHERE approval_message_id = ? AND expires_at > ?",
+        (message_id, time.time())
+    ).fetchone()
+    return row[0] if row else None
+
+def get_approval_request(request_id):
+    row = connect().execute(
+        f"SELECT {', '.join(_COLUMNS)} FROM approval_requests WHERE request_id = ? AND expires_at > ?",
+        (request_id, time.time())
+    ).fetchone()
+    return _row_to_request(row) if row else None
+
+def claim_approval_request(request_id):
+    """Remove a pending request and return it, or None if it's gone. Only one caller can win."""
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE") # Hold the write lock across the read so other processes can't claim it too
+        row = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM approval_requests WHERE request_id = ? AND expires_at > ?",
+            (request_id, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM approval_requests WHERE request_id = ?", (request_id,))
+    return _row_to_request(row)
+
+def unclaim_approval_request(request):
+    """Put a claimed request back in the queue (e.g. applying it failed), keeping its approval message and expiry."""
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO approval_requests "
+            "(request_id, type, user_id, name, content, text_to_append, approval_message_id, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (request['request_id'], request['type'], request['user_id'], request.get('name'), request.get('content'),
+             request.get('text_to_append'), request.get('approval_message_id'), request['created_at'],
+             request['created_at'] + APPROVAL_TTL)
+        )
+
+def remove_approval_request(request_id):
+    conn = connect()
+    with conn:
+        conn.execute("DELETE FROM approval_requests WHERE request_id = ?", (request_id,))
+
+def count_approval_requests() -> int:
+    return connect().execute("SELECT COUNT(*) FROM approval_requests WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+def list_approval_requests(offset=0, limit=10):
+    """Return one page of pending requests, oldest first."""
+    rows = connect().execute(
+        f"SELECT {', '.join(_COLUMNS)} FROM approval_requests WHERE expires_at > ? ORDER BY created_at, request_id LIMIT ? OFFSET ?",
+        (time.time(), limit, offset)
+    ).fetchall()
+    return [_row_to_request(row) for row in rows]
+
+def apply_approval_batch(request_ids, approve: bool):
+    """Claim several requests and, when approving, apply them all in a single transaction.
+
+    Each request is applied under its own savepoint so one failure (e.g. a duplicate name)
+    doesn't undo the rest. Returns [(request, error message or None)] for every request that
+    was still pending; requests already handled elsewhere are skipped.
+    """
+    results = []
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for request_id in request_ids:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM approval_requests WHERE request_id = ? AND expires_at > ?",
+                (request_id, time.time())
+            ).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM approval_requests WHERE request_id = ?", (request_id,))
+            request = _row_to_request(row)
+            error = None
+            if approve:
+                conn.execute("SAVEPOINT apply_request")
+                try:
+                    apply_persona_request(conn, request)
+                except sqlite3.IntegrityError:
+                    error = f"Persona '{request.get('name')}' already exists."
+                except Exception as e:
+                    error = str(e)
+                if error:
+                    conn.execute("ROLLBACK TO SAVEPOINT apply_request")
+                conn.execute("RELEASE SAVEPOINT apply_request")
+            results.append((request, error))
+    if approve and results:
+        invalidate_persona_cache()
+        for request, error in results:
+            if request['type'] == 'create' and not error:
+                persona_names.add(request['name'])
+    return results
+
+def expire_approval_requests() -> int:
+    conn = connect()
+    with conn:
+        return conn.execute("DELETE FROM approval_requests WHERE expires_at <= ?", (time.time(),)).rowcount
+
+async def run_approval_sweeper(interval=APPROVAL_SWEEP_INTERVAL):
+    """Background task: periodically delete requests the admin never answered."""
+    while True:
+        try:
+            expired = await run_db(expire_approval_requests)
+            if expired:
+                log.info("Expired %d unanswered persona approval request(s).", expired)
+        except Exception as e:
+            log.error("Error expiring approval requests: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,380 @@
+"""Offline end-to-end benchmark: drives bot.on_message and the persona slash commands with fake Discord objects and a fake Gemini model.
+
+Run from the repository root:
+    python -m benchmarks.e2e_bench --concurrency 1,4,16,64 --messages 200 --output results.json
+
+Nothing connects to Discord or Gemini. The bot runs against a throwaway personas.db in a
+temporary directory. For each concurrency level the harness reports p50/p95/p99 latency per
+stage, throughput and peak traced memory, and --output writes the same numbers as JSON so runs
+from different commits can be compared.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.fakes import FakeModel, percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_USER_ID = 1000
+ADMIN_ID = 1001
+FIRST_USER_ID = 2000
+
+_ids = itertools.count(10**15) # Snowflake-sized, increasing like real message IDs
+
+# --- Fake Discord objects (only what the bot touches) ---
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+        self.bot = bot
+        self.dm_channel = None
+
+    def mentioned_in(self, message):
+        return self in message.mentions
+
+    async def create_dm(self):
+        self.dm_channel = FakeChannel(next(_ids), guild=None)
+        return self.dm_channel
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.shard_id = 0
+
+class FakeMessage:
+    def __init__(self, channel, author, content, mentions=()):
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, send_latency=0.0, backlog=None):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel-{channel_id}"
+        self.send_latency = send_latency
+        self.backlog = backlog or [] # Older messages served by history()
+        self.sent = 0
+
+    def is_nsfw(self):
+        return False
+
+    def typing(self):
+        return _NullAsyncContext()
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.send_latency) # Stands in for the REST round trip
+        self.sent += 1
+        return FakeMessage(self, _bot_user, content or "")
+
+    async def history(self, limit=100, before=None):
+        await asyncio.sleep(self.send_latency)
+        before_id = before.id if before is not None else None
+        older = [msg for msg in self.backlog if before_id is None or msg.id < before_id]
+        for msg in reversed(older[-limit:]): # Newest first, like discord.py
+            yield msg
+
+class _NullAsyncContext:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeResponse:
+    def __init__(self):
+        self.sent = []
+        self.done = False
+
+    async def send_message(self, content=None, **kwargs):
+        self.sent.append(content)
+        self.done = True
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def edit_message(self, content=None, **kwargs):
+        self.sent.append(content)
+        self.done = True
+
+    def is_done(self):
+        return self.done
+
+class FakeInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.response = FakeResponse()
+
+    async def edit_original_response(self, content=None, **kwargs):
+        self.response.sent.append(content)
+
+class FakeClient:
+    """Replaces bot.client for the handlers; no gateway connection."""
+
+    def __init__(self, users):
+        self.user = _bot_user
+        self.shard_count = None
+        self.latency = 0.0
+        self._users = {user.id: user for user in users}
+
+    def get_user(self, user_id):
+        return self._users.get(user_id)
+
+    async def fetch_user(self, user_id):
+        return self._users[user_id]
+
+_bot_user = FakeUser(BOT_USER_ID, "Bot", bot=True)
+
+# --- Stage timing ---
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, stage, func):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - started)
+        return timed
+
+    def wrap_sync(self, stage, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - started)
+        return timed
+
+    def summary(self):
+        return {
+            stage: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 0.50) * 1000,
+                "p95_ms": percentile(samples, 0.95) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+            }
+            for stage, samples in sorted(self.samples.items())
+        }
+
+class TimedModel:
+    def __init__(self, model, timer):
+        self.model = model
+        self.timer = timer
+
+    async def generate_content_async(self, content, stream=False):
+        started = time.perf_counter()
+        try:
+            return await self.model.generate_content_async(content, stream=stream)
+        finally:
+            self.timer.samples["gemini"].append(time.perf_counter() - started)
+
+# --- Benchmark ---
+
+def _import_bot(workdir):
+    """Import bot.py against a scratch database without connecting anywhere."""
+    os.environ.setdefault("DISCORD_TOKEN", "benchmark")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ["ADMIN_USER_ID"] = str(ADMIN_ID)
+    os.environ["GENERATION_WORKERS"] = "0"
+    os.environ["SHARDING_ENABLED"] = "0"
+    os.environ["SHARD_COUNT"] = "0"
+    shutil.copy(os.path.join(REPO_ROOT, "system_message.txt"), workdir)
+    os.chdir(workdir) # database.DB_FILE is relative to the working directory
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        import bot
+    return bot
+
+def _seed_personas(count, creator_id):
+    from database import connect
+    from shared import invalidate_persona_cache
+    from persona_index import persona_names
+    conn = connect()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO personas (name, content, creator_id, is_default) VALUES (?, ?, ?, 0)",
+            ((f"persona-{i:05d}", f"You are benchmark persona {i}.", creator_id) for i in range(count))
+        )
+    invalidate_persona_cache()
+    persona_names.load(name for (name,) in conn.execute("SELECT name FROM personas"))
+
+async def _run_level(bot, commands, args, concurrency, users, channels, timer):
+    from scheduler import GenerationScheduler
+    from history import ChannelHistoryCache
+    from sharding import ShardPartitioned
+    from coalescer import MentionCoalescer
+
+    model = TimedModel(FakeModel(latency=args.latency, jitter=args.latency / 5, output_chars=args.output_chars, seed=1), timer)
+    # Fresh per-level state so levels don't warm each other's caches; rate limits out of the way
+    bot.generation_scheduler = GenerationScheduler(max_in_flight=concurrency, requests_per_minute=10**9,
+                                                   tokens_per_minute=10**12, max_queue=10**6)
+    bot.history_caches = ShardPartitioned(ChannelHistoryCache)
+    bot.mention_coalescers = ShardPartitioned(MentionCoalescer)
+
+    async def get_model_async(system_instruction, safety_profile):
+        return model
+    bot.get_model_async = get_model_async
+
+    semaphore = asyncio.Semaphore(concurrency)
+    completed = 0
+
+    async def one_message(i):
+        nonlocal completed
+        channel = channels[i % len(channels)]
+        user = users[i % len(users)]
+        persona = f' -type "persona-{i % args.personas:05d}"' if args.personas and i % 3 == 0 else ""
+        message = FakeMessage(channel, user, f"<@{BOT_USER_ID}>{persona} benchmark question number {i}?", mentions=[_bot_user])
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.on_message(message)
+            timer.samples["on_message"].append(time.perf_counter() - started)
+            completed += 1
+
+    async def one_command(i):
+        nonlocal completed
+        user = users[i % len(users)]
+        async with semaphore:
+            kind = i % 3
+            started = time.perf_counter()
+            if kind == 0:
+                await commands["list-personas"](FakeInteraction(user), search="persona-0" if i % 2 else None)
+                stage = "cmd_list_personas"
+            elif kind == 1:
+                # Non-admin create: queued for approval and DMed to the admin
+                await commands["create-type"](FakeInteraction(user), name=f"bench-{concurrency}-{i}", content="Benchmark persona.")
+                stage = "cmd_create_type"
+            else:
+                # The user created these personas, so the change applies directly
+                await commands["modify-type"](FakeInteraction(user), name=f"persona-{i % max(1, args.personas):05d}", new_content=f"Revised {i}.")
+                stage = "cmd_modify_type"
+            timer.samples[stage].append(time.perf_counter() - started)
+            completed += 1
+
+    jobs = [one_message(i) for i in range(args.messages)] + [one_command(i) for i in range(args.commands)]
+    tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, "w")): # The handlers log every step
+        await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "concurrency": concurrency,
+        "operations": completed,
+        "elapsed_s": elapsed,
+        "throughput_ops_s": completed / elapsed if elapsed else 0.0,
+        "peak_traced_mb": peak / (1024 * 1024),
+        "stages": timer.summary(),
+        "scheduler": bot.generation_scheduler.get_stats(),
+    }
+
+async def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="e2e-bench-")
+    bot = _import_bot(workdir)
+    users = [FakeUser(FIRST_USER_ID + i, f"user{i}") for i in range(args.users)]
+    admin = FakeUser(ADMIN_ID, "admin")
+    guild = FakeGuild(1)
+    channels = []
+    for i in range(args.channels):
+        channel = FakeChannel(5000 + i, guild, send_latency=args.discord_latency)
+        channel.backlog = [FakeMessage(channel, users[j % len(users)], f"earlier message {j}") for j in range(args.backlog)]
+        channels.append(channel)
+
+    fake_client = FakeClient(users + [admin])
+    bot.client = fake_client
+    bot.user_cache.bind(fake_client)
+    # The seeded personas belong to the first user: their modify-type applies directly, everyone
+    # else's goes through the approval queue
+    _seed_personas(args.personas, users[0].id)
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        await bot.setup_persona_commands(bot.tree, fake_client)
+    commands = {name: bot.tree.get_command(name).callback for name in ("list-personas", "create-type", "modify-type")}
+
+    from history import ChannelHistoryCache
+    originals = {stage: getattr(bot, stage) for stage in ("get_persona_async", "build_prompt", "send_response", "send_chunks")}
+    original_get_lines = ChannelHistoryCache.get_lines
+
+    results = []
+    for concurrency in args.concurrency:
+        # Instrument the on_message stages through bot's module globals, which the handler looks up per call
+        timer = StageTimer()
+        for stage, original in originals.items():
+            setattr(bot, stage, timer.wrap_sync(stage, original) if stage == "build_prompt" else timer.wrap(stage, original))
+        ChannelHistoryCache.get_lines = timer.wrap("history", original_get_lines)
+        level_result = await _run_level(bot, commands, args, concurrency, users, channels, timer)
+        results.append(level_result)
+        _print_level(level_result)
+
+    ChannelHistoryCache.get_lines = original_get_lines
+    for stage, original in originals.items():
+        setattr(bot, stage, original)
+    return {
+        "benchmark": "e2e",
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "levels": results,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _print_level(result):
+    print(f"\nconcurrency={result['concurrency']} ops={result['operations']} elapsed={result['elapsed_s']:.2f}s "
+          f"throughput={result['throughput_ops_s']:.1f} ops/s peak_mem={result['peak_traced_mb']:.1f}MB")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<20} n={stats['count']:<5} p50={stats['p50_ms']:8.2f}ms "
+              f"p95={stats['p95_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=lambda raw: [int(part) for part in raw.split(",")], default=[1, 4, 16, 64],
+                        help="Comma-separated concurrency levels")
+    parser.add_argument("--messages", type=int, default=200, help="Mentions per level")
+    parser.add_argument("--commands", type=int, default=60, help="Slash command invocations per level")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--users", type=int, default=25)
+    parser.add_argument("--personas", type=int, default=500, help="Extra personas seeded into the database")
+    parser.add_argument("--backlog", type=int, default=50, help="Older messages per channel for history backfill")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake Gemini latency in seconds")
+    parser.add_argument("--output-chars", type=int, default=1500, help="Fake Gemini response size")
+    parser.add_argument("--discord-latency", type=float, default=0.02, help="Fake Discord REST latency in seconds")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None # The harness chdirs to a scratch directory
+    results = asyncio.run(run_benchmark(args))
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import random
+from collections import deque
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeStream:
+    def __init__(self, text, chunk_chars, chunk_delay):
+        self.text = text
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+
+    async def __aiter__(self):
+        for start in range(0, len(self.text), self.chunk_chars):
+            await asyncio.sleep(self.chunk_delay)
+            yield FakeChunk(self.text[start:start + self.chunk_chars])
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel: sleeps for a configurable latency and returns filler text."""
+
+    def __init__(self, latency=0.5, jitter=0.1, output_chars=400, chunk_chars=100, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.output_chars = output_chars
+        self.chunk_chars = chunk_chars
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def _text(self):
+        line = "The quick brown fox jumps over the lazy dog.\n"
+        return (line * (self.output_chars // len(line) + 1))[:self.output_chars]
+
+    async def generate_content_async(self, content, stream=False):
+        self.calls += 1
+        if stream:
+            chunks = max(1, self.output_chars // self.chunk_chars)
+            return FakeStream(self._text(), self.chunk_chars, self._delay() / chunks)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self._delay())
+        finally:
+            self.in_flight -= 1
+        return FakeResponse(self._text())
+
+class FakeServiceError(Exception):
+    """Looks like a google.api_core error to resilience.is_retryable: the HTTP status is in .code."""
+
+    def __init__(self, code=503, message="Service unavailable"):
+        super().__init__(message)
+        self.code = code
+
+class ScriptedModel(FakeModel):
+    """A FakeModel that injects latency spikes and errors.
+
+    Calls first consume `script`, a list of (latency, error or None) steps; after that each call
+    is slow (`slow_latency`) with probability `slow_rate` and raises FakeServiceError with
+    probability `error_rate`. Both rates can be changed between calls to simulate an outage.
+    """
+
+    def __init__(self, script=(), error_rate=0.0, slow_rate=0.0, slow_latency=5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.script = deque(script)
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.errors = 0
+
+    def _next_step(self):
+        if self.script:
+            return self.script.popleft()
+        latency = self.slow_latency if self.random.random() < self.slow_rate else self._delay()
+        error = FakeServiceError() if self.random.random() < self.error_rate else None
+        return latency, error
+
+    async def generate_content_async(self, content, stream=False):
+        latency, error = self._next_step()
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            self.in_flight -= 1
+        if error is not None:
+            self.errors += 1
+            raise error
+        if stream:
+            return FakeStream(self._text(), self.chunk_chars, 0.0)
+        return FakeResponse(self._text())
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
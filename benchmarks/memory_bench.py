@@ -0,0 +1,89 @@
+"""Indexing and search benchmark for the per-channel vector memory (memory.py) with the offline hashing embedder.
+
+Run from the repository root (needs numpy):
+    python -m benchmarks.memory_bench --sizes 1000,10000,50000 --queries 200
+
+For each size, one channel is filled with random chatter plus --facts planted messages, then
+each fact is asked about with different wording. Reports indexing throughput (embedding,
+memmap append and SQLite insert), search latency and recall@k of the planted facts.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.e2e_bench import FakeChannel, FakeGuild, FakeMessage, FakeUser
+from benchmarks.fakes import percentile
+
+BOT_USER_ID = 1000
+
+async def run_size(args, size, channel_id, rng, vocabulary):
+    from memory import MEMORY_TOP_K, HashingEmbedder, MemoryIndex
+
+    memory = MemoryIndex(enabled=True, embedder=HashingEmbedder(args.dim), directory="memory")
+    channel = FakeChannel(channel_id, FakeGuild(1))
+    memory.note_reply(channel_id) # Only channels the bot replies in are indexed
+    users = [FakeUser(2000 + i, f"user{i}") for i in range(10)]
+    fact_positions = set(rng.sample(range(size), args.facts))
+    facts = {}
+    started = time.perf_counter()
+    for i in range(size):
+        if i in fact_positions:
+            codename = "".join(rng.choice("bcdfghjklmnpqrstvwxz") for _ in range(8))
+            number = rng.randint(1000, 9999)
+            message = FakeMessage(channel, users[i % len(users)], f"remember that the launch code for project {codename} is {number}")
+            facts[codename] = message.id
+        else:
+            message = FakeMessage(channel, users[i % len(users)], " ".join(rng.choice(vocabulary) for _ in range(args.words)))
+        memory.add(message)
+        if len(memory._pending) >= 1000:
+            while memory._pending:
+                await memory.flush()
+    while memory._pending:
+        await memory.flush()
+    index_seconds = time.perf_counter() - started
+
+    latencies = []
+    hits = 0
+    queries = [rng.choice(list(facts)) for _ in range(args.queries)]
+    for codename in queries:
+        started = time.perf_counter()
+        lines = await memory.search(channel_id, f"what was the launch code for project {codename} again?", BOT_USER_ID)
+        latencies.append(time.perf_counter() - started)
+        hits += any(codename in line for line in lines)
+    memory._flusher.cancel()
+    print(f"  rows={size:<7} index={size / index_seconds:8.0f} msg/s  search p50={percentile(latencies, 0.5) * 1000:6.2f}ms "
+          f"p95={percentile(latencies, 0.95) * 1000:6.2f}ms  recall@{MEMORY_TOP_K}={hits / len(queries):.0%}")
+
+async def run_benchmark(args):
+    from database import connect, migrate
+    migrate(connect())
+    rng = random.Random(1)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(args.vocabulary)]
+    print(f"dim={args.dim}, {args.words} words per message from a {args.vocabulary}-word vocabulary, {args.facts} planted facts")
+    for index, size in enumerate(args.sizes):
+        await run_size(args, size, 5000 + index, rng, vocabulary)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=lambda raw: [int(part) for part in raw.split(",")], default=[1000, 10000, 50000],
+                        help="Comma-separated numbers of indexed messages")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--facts", type=int, default=50, help="Planted messages the queries ask about")
+    parser.add_argument("--words", type=int, default=20, help="Words per filler message")
+    parser.add_argument("--vocabulary", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="memory-bench-")
+    os.chdir(workdir) # database.DB_FILE and MEMORY_DIR are relative to the working directory
+    try:
+        asyncio.run(run_benchmark(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
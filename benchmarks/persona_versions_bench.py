@@ -0,0 +1,102 @@
+"""Storage and latency benchmark for persona version history (persona_versions.py).
+
+Run from the repository root:
+    python -m benchmarks.persona_versions_bench --edits 5000 --reads 500
+
+Applies --edits random changes to the default persona through the real shared.py helpers
+(mostly appends, some small in-place modifications, an occasional full rewrite and a few
+multi-step undos), then checks that random versions rebuild to exactly the content they had.
+Reports history size against storing a full copy per version, and edit, read and revert latency.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.fakes import percentile
+
+WORDS = ("alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike november oscar papa "
+         "quebec romeo sierra tango uniform victor whiskey xray yankee zulu").split()
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def run_benchmark(args):
+    from database import connect
+    from persona_versions import PERSONA_SNAPSHOT_EVERY, get_version_content
+    import shared
+
+    with open("system_message.txt", "w", encoding="utf-8") as f:
+        f.write("You are a helpful assistant.")
+    shared.initialize_database()
+    conn = connect()
+    persona_id = conn.execute("SELECT id FROM personas WHERE is_default = 1").fetchone()[0]
+    rng = random.Random(1)
+    expected = {1: conn.execute("SELECT content FROM personas WHERE id = ?", (persona_id,)).fetchone()[0]}
+    edit_seconds, revert_seconds = [], []
+
+    for _ in range(args.edits):
+        content = conn.execute("SELECT content FROM personas WHERE id = ?", (persona_id,)).fetchone()[0]
+        roll = rng.random()
+        started = time.perf_counter()
+        if roll < args.revert_rate:
+            version = shared.revert_default_persona(rng.randint(1, 5))
+            if version is None:
+                continue
+            revert_seconds.append(time.perf_counter() - started)
+        else:
+            if roll >= 1 - args.rewrite_rate:
+                shared.update_persona_content(shared.DEFAULT_PERSONA_NAME, _sentence(rng, args.words * 4))
+            elif roll < 0.75:
+                shared.append_to_default_persona(_sentence(rng, args.words))
+            else:
+                paragraphs = content.split("\n\n")
+                index = rng.randrange(len(paragraphs))
+                paragraphs[index] = paragraphs[index].replace(rng.choice(WORDS), rng.choice(WORDS), 1) + " " + _sentence(rng, 3)
+                shared.update_persona_content(shared.DEFAULT_PERSONA_NAME, "\n\n".join(paragraphs))
+            edit_seconds.append(time.perf_counter() - started)
+        version = conn.execute("SELECT MAX(version) FROM persona_versions WHERE persona_id = ?", (persona_id,)).fetchone()[0]
+        expected[version] = conn.execute("SELECT content FROM personas WHERE id = ?", (persona_id,)).fetchone()[0]
+
+    read_seconds = []
+    versions = list(expected)
+    for version in (rng.choice(versions) for _ in range(args.reads)):
+        started = time.perf_counter()
+        content = get_version_content(conn, persona_id, version)
+        read_seconds.append(time.perf_counter() - started)
+        assert content == expected[version], f"version {version} rebuilt incorrectly"
+
+    stored, snapshots = conn.execute(
+        "SELECT SUM(LENGTH(data)), SUM(is_snapshot) FROM persona_versions WHERE persona_id = ?", (persona_id,)
+    ).fetchone()
+    full_copies = sum(len(content.encode("utf-8")) for content in expected.values())
+    print(f"{len(expected)} versions, snapshot at least every {PERSONA_SNAPSHOT_EVERY}; "
+          f"final content {len(expected[max(expected)])} chars")
+    print(f"  history size={stored / 1024:8.1f} KiB  full copies={full_copies / 1024:9.1f} KiB  "
+          f"ratio={full_copies / stored:5.1f}x  snapshots={snapshots}")
+    for name, samples in (("edit", edit_seconds), ("read version", read_seconds), ("revert", revert_seconds)):
+        if samples:
+            print(f"  {name:<13} p50={percentile(samples, 0.5) * 1000:6.2f}ms p95={percentile(samples, 0.95) * 1000:6.2f}ms "
+                  f"max={max(samples) * 1000:6.2f}ms  n={len(samples)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edits", type=int, default=5000)
+    parser.add_argument("--reads", type=int, default=500, help="Random versions rebuilt and checked")
+    parser.add_argument("--words", type=int, default=12, help="Words per appended sentence")
+    parser.add_argument("--rewrite-rate", type=float, default=0.002, help="Share of edits that replace the whole content")
+    parser.add_argument("--revert-rate", type=float, default=0.05, help="Share of edits that are multi-step undos")
+    args = parser.parse_args()
+
+    os.environ["ADMIN_USER_ID"] = "1001" # The default persona needs a creator
+    workdir = tempfile.mkdtemp(prefix="persona-versions-bench-")
+    os.chdir(workdir) # database.DB_FILE and system_message.txt are relative to the working directory
+    try:
+        run_benchmark(args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
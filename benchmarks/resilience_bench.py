@@ -0,0 +1,109 @@
+"""Tail-latency and outage benchmark for resilience.ResilientGenerator against a scripted fake backend.
+
+Run from the repository root:
+    python -m benchmarks.resilience_bench --requests 400 --latency 0.1 --slow-rate 0.03 --error-rate 0.02
+
+The "tail" scenario sends the same traffic (occasional latency spikes and 503s) through a bare
+model, retries only, and retries plus hedging, and reports latency percentiles, success rate
+and how many backend calls each needed. The "outage" scenario fails every call for a while and
+compares failing fast with falling back to a second model while the breaker is open.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import ScriptedModel, percentile
+from resilience import CircuitBreaker, CircuitOpen, GenerationTimeout, ResilientGenerator, ResilientModel
+
+async def _drive(model, args, on_request=None):
+    """Send args.requests requests arriving at args.rate per second, at most args.concurrency at a time."""
+    latencies = []
+    outcomes = {"ok": 0, "error": 0, "timeout": 0, "rejected": 0}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one_request(i):
+        await asyncio.sleep(i / args.rate) # Open loop: fast failures don't speed up arrivals
+        async with slots:
+            if on_request:
+                on_request(i)
+            started = time.perf_counter()
+            try:
+                await model.generate_content_async("prompt")
+                outcomes["ok"] += 1
+            except GenerationTimeout:
+                outcomes["timeout"] += 1
+            except CircuitOpen:
+                outcomes["rejected"] += 1
+            except Exception:
+                outcomes["error"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one_request(i) for i in range(args.requests)))
+    return latencies, outcomes
+
+def _report(name, latencies, outcomes, requests, calls, extra=""):
+    print(f"  {name:<16} p50={percentile(latencies, 0.50) * 1000:7.1f}ms p95={percentile(latencies, 0.95) * 1000:7.1f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:7.1f}ms ok={outcomes['ok'] / requests:6.1%} "
+          f"failed={requests - outcomes['ok']:3d} calls={calls:4d} {extra}")
+
+def _backend(args, seed):
+    return ScriptedModel(latency=args.latency, jitter=args.latency / 5, error_rate=args.error_rate,
+                         slow_rate=args.slow_rate, slow_latency=args.latency * args.slow_factor, seed=seed)
+
+async def run_tail(args):
+    print(f"Tail: {args.slow_rate:.0%} of calls {args.slow_factor:.0f}x slower, {args.error_rate:.0%} fail with 503")
+    configs = [
+        ("bare", None),
+        ("retries", dict(hedge=False)),
+        ("retries+hedge", dict(hedge=True)),
+    ]
+    for name, options in configs:
+        backend = _backend(args, seed=1) # Same fault sequence for every config
+        if options is None:
+            model = backend
+        else:
+            generator = ResilientGenerator(base_delay=args.latency / 2, deadline=args.deadline,
+                                           hedge_min_delay=args.latency, seed=1, **options)
+            model = ResilientModel(generator, backend)
+        latencies, outcomes = await _drive(model, args)
+        extra = ""
+        if options is not None:
+            stats = generator.get_stats()
+            extra = f"retries={stats['retries']} hedges={stats['hedges']} hedge_wins={stats['hedge_wins']}"
+        _report(name, latencies, outcomes, args.requests, backend.calls, extra)
+
+async def run_outage(args):
+    start, end = args.requests // 4, args.requests // 2
+    print(f"Outage: requests {start}-{end} all fail; breaker cooldown {args.cooldown}s")
+    for name, with_fallback in (("fail fast", False), ("fallback", True)):
+        backend = _backend(args, seed=2)
+        lighter = ScriptedModel(latency=args.latency / 2, jitter=args.latency / 10, seed=3)
+
+        def on_request(i):
+            backend.error_rate = 1.0 if start <= i < end else args.error_rate
+
+        breaker = CircuitBreaker(min_requests=10, window=60, cooldown=args.cooldown)
+        generator = ResilientGenerator(base_delay=args.latency / 2, deadline=args.deadline, breaker=breaker, seed=1)
+        model = ResilientModel(generator, backend, (lambda: lighter) if with_fallback else None)
+        latencies, outcomes = await _drive(model, args, on_request)
+        stats = generator.get_stats()
+        _report(name, latencies, outcomes, args.requests, backend.calls + lighter.calls,
+                f"rejected={stats['rejected']} fallbacks={stats['fallbacks']} primary_calls={backend.calls}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=50, help="Request arrivals per second")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="Typical fake Gemini latency in seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Share of calls hit by a latency spike")
+    parser.add_argument("--slow-factor", type=float, default=10, help="How much slower a spiked call is")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Share of calls failing with a retryable 503")
+    parser.add_argument("--deadline", type=float, default=5.0, help="Per-request deadline in seconds")
+    parser.add_argument("--cooldown", type=float, default=1.0, help="Breaker cooldown in the outage scenario")
+    args = parser.parse_args()
+    asyncio.run(run_tail(args))
+    asyncio.run(run_outage(args))
+
+if __name__ == "__main__":
+    main()
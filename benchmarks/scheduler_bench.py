@@ -0,0 +1,65 @@
+"""Throughput/latency benchmark for GenerationScheduler against a fake model.
+
+Run from the repository root:
+    python -m benchmarks.scheduler_bench --requests 200 --channels 10 --max-in-flight 8
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fakes import FakeModel, percentile
+from scheduler import GenerationScheduler, QueueFull, RequestExpired
+
+async def run_benchmark(args):
+    model = FakeModel(latency=args.latency, jitter=args.latency / 5, seed=1)
+    scheduler = GenerationScheduler(
+        max_in_flight=args.max_in_flight,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        max_queue=args.max_queue,
+        deadline=args.deadline,
+    )
+    latencies = []
+    outcomes = {"ok": 0, "rejected": 0, "expired": 0}
+
+    async def one_request(i):
+        started = time.perf_counter()
+        try:
+            # Skew traffic so channel 0 is much busier than the rest, to exercise fairness
+            channel_id = 0 if i % 2 == 0 else i % args.channels
+            await scheduler.run(channel_id, i % args.users, lambda: model.generate_content_async("prompt"), tokens=500)
+        except QueueFull:
+            outcomes["rejected"] += 1
+            return
+        except RequestExpired:
+            outcomes["expired"] += 1
+            return
+        outcomes["ok"] += 1
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    print(f"requests={args.requests} max_in_flight={args.max_in_flight} rpm={args.rpm}")
+    print(f"completed={outcomes['ok']} rejected={outcomes['rejected']} expired={outcomes['expired']}")
+    print(f"elapsed={elapsed:.2f}s throughput={outcomes['ok'] / elapsed:.1f} req/s")
+    print(f"latency p50={percentile(latencies, 0.5) * 1000:.0f}ms p95={percentile(latencies, 0.95) * 1000:.0f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.0f}ms")
+    print(f"model max concurrency={model.max_in_flight} scheduler={scheduler.get_stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--users", type=int, default=25)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=6000)
+    parser.add_argument("--tpm", type=int, default=10_000_000)
+    parser.add_argument("--max-queue", type=int, default=1000)
+    parser.add_argument("--deadline", type=float, default=60.0)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake model latency in seconds")
+    asyncio.run(run_benchmark(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
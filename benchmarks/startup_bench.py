@@ -0,0 +1,132 @@
+"""Startup and reconnect benchmark: times importing bot.py, the first on_ready and repeated on_ready reconnects.
+
+Run from the repository root:
+    python -m benchmarks.startup_bench --runs 3 --reconnects 20 --sync-latency 0.5
+
+Each run is a fresh Python process against the same scratch personas.db, like a bot restart.
+Nothing connects to Discord: bot.client is replaced with a fake and tree.sync() with a sleep of
+--sync-latency seconds. The first run has to sync; later runs should find the command schema
+hash unchanged and skip it. --force-sync adds a run with COMMAND_SYNC_FORCE=1 for comparison.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def _measure(args, import_seconds, sdk_at_import):
+    import bot
+    from benchmarks.e2e_bench import ADMIN_ID, BOT_USER_ID, FakeClient, FakeUser
+
+    fake_client = FakeClient([FakeUser(ADMIN_ID, "admin")])
+    fake_client.application_id = BOT_USER_ID
+    fake_client.add_view = lambda view: None
+    bot.client = fake_client
+    bot.user_cache.bind(fake_client)
+    syncs = 0
+
+    async def fake_sync():
+        nonlocal syncs
+        syncs += 1
+        await asyncio.sleep(args.sync_latency)
+        return []
+    bot.tree.sync = fake_sync
+
+    started = time.perf_counter()
+    await bot.on_ready()
+    first_ready = time.perf_counter() - started
+    import_to_ready = time.perf_counter() - bot._process_started
+    reconnects = []
+    for _ in range(args.reconnects):
+        started = time.perf_counter()
+        await bot.on_ready()
+        reconnects.append(time.perf_counter() - started)
+    if bot.gemini_sdk_loader is not None:
+        await bot.gemini_sdk_loader # Let the background import finish before the process exits
+    bot.shutdown_db()
+    return {
+        "import_seconds": round(import_seconds, 4),
+        "first_ready_seconds": round(first_ready, 4),
+        "import_to_ready_seconds": round(import_to_ready, 4),
+        "reconnect_p50_ms": round(percentile(reconnects, 0.5) * 1000, 3) if reconnects else None,
+        "reconnect_max_ms": round(max(reconnects) * 1000, 3) if reconnects else None,
+        "syncs": syncs,
+        "sdk_imported_at_import": sdk_at_import,
+    }
+
+def _child(args):
+    started = time.perf_counter()
+    import bot # noqa: F401  (timed: this is the whole module-level startup path)
+    import_seconds = time.perf_counter() - started
+    sdk_at_import = "google.generativeai" in sys.modules
+    result = asyncio.run(_measure(args, import_seconds, sdk_at_import))
+    print(json.dumps(result))
+
+def _run_child(args, workdir, force_sync=False):
+    env = dict(os.environ)
+    env.update({
+        "DISCORD_TOKEN": env.get("DISCORD_TOKEN", "benchmark"),
+        "GEMINI_API_KEY": env.get("GEMINI_API_KEY", "benchmark"),
+        "ADMIN_USER_ID": "1001",
+        "GENERATION_WORKERS": "0",
+        "SHARDING_ENABLED": "0",
+        "SHARD_COUNT": "0",
+        "METRICS_PORT": "0",
+        "LOG_LEVEL": "WARNING",
+        "COMMAND_SYNC_FORCE": "1" if force_sync else "0",
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    command = [sys.executable, "-m", "benchmarks.startup_bench", "--child",
+               "--reconnects", str(args.reconnects), "--sync-latency", str(args.sync_latency)]
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="startup-bench-")
+    shutil.copy(os.path.join(REPO_ROOT, "system_message.txt"), workdir)
+    runs = []
+    try:
+        for index in range(args.runs):
+            runs.append({"run": index + 1, "force_sync": False, **_run_child(args, workdir)})
+        if args.force_sync:
+            runs.append({"run": len(runs) + 1, "force_sync": True, **_run_child(args, workdir, force_sync=True)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'run':>3} {'import s':>9} {'on_ready s':>10} {'to ready s':>10} {'reconnect p50 ms':>16} {'syncs':>5} {'sdk at import':>13}")
+    for run in runs:
+        label = f"{run['run']}{'*' if run['force_sync'] else ''}"
+        print(f"{label:>3} {run['import_seconds']:>9.3f} {run['first_ready_seconds']:>10.3f} {run['import_to_ready_seconds']:>10.3f} "
+              f"{run['reconnect_p50_ms'] if run['reconnect_p50_ms'] is not None else '-':>16} {run['syncs']:>5} {str(run['sdk_imported_at_import']):>13}")
+    if args.force_sync:
+        print("* COMMAND_SYNC_FORCE=1")
+    return {"sync_latency": args.sync_latency, "reconnects": args.reconnects, "runs": runs}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Bot restarts against the same database")
+    parser.add_argument("--reconnects", type=int, default=20, help="Extra on_ready calls per run")
+    parser.add_argument("--sync-latency", type=float, default=0.5, help="Fake tree.sync() latency in seconds")
+    parser.add_argument("--force-sync", action="store_true", help="Add a run with COMMAND_SYNC_FORCE=1")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args)
+        return
+    results = run_benchmark(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Prompt size benchmark for rolling channel summaries: replays one long conversation and builds a reply prompt every few messages.
+
+Run from the repository root:
+    python -m benchmarks.summary_bench --messages 400 --words 40 --mention-every 10
+
+Each prompt is built twice from the same history buffer: raw history only (the token budget
+decides how much fits), and summary plus the raw messages newer than it. Summaries come from a
+fake model that returns --summary-tokens of text after --latency seconds, through the real
+ChannelSummarizer, so refreshes run in the background exactly as in the bot. Reports prompt
+tokens and how many earlier messages each prompt still covers (raw or summarized).
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.e2e_bench import FakeChannel, FakeGuild, FakeMessage, FakeUser
+from benchmarks.fakes import percentile
+
+BOT_USER_ID = 1000
+WORDS = ("alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike november oscar papa "
+         "quebec romeo sierra tango uniform victor whiskey xray yankee zulu").split()
+
+async def run_benchmark(args):
+    from database import connect, migrate
+    from history import ChannelHistoryCache
+    from prompt import PROMPT_MAX_HISTORY_MESSAGES, build_prompt
+    from summaries import ChannelSummarizer
+
+    migrate(connect())
+    summary_calls = 0
+
+    async def fake_generate(channel_id, system_instruction, content):
+        nonlocal summary_calls
+        summary_calls += 1
+        await asyncio.sleep(args.latency)
+        return ("Summary so far: " + "x" * (args.summary_tokens * 4))[:args.summary_tokens * 4]
+
+    history_cache = ChannelHistoryCache()
+    summarizer = ChannelSummarizer(fake_generate, enabled=True, every=args.summary_every, tail=args.tail)
+    channel = FakeChannel(5000, FakeGuild(1))
+    users = [FakeUser(2000 + i, f"user{i}") for i in range(args.users)]
+    rng = random.Random(1)
+    message_index = {} # message ID -> position in the conversation
+    results = {"raw": {"tokens": [], "covered": []}, "summary": {"tokens": [], "covered": [], "build_ms": []}}
+
+    for i in range(args.messages):
+        text = " ".join(rng.choice(WORDS) for _ in range(args.words))
+        message = FakeMessage(channel, users[i % len(users)], text)
+        message_index[message.id] = i
+        history_cache.record(message)
+        await asyncio.sleep(args.message_interval) # Lets background refreshes make progress
+        if i % args.mention_every or i == 0:
+            continue
+        current_section = f"## Current Message (Respond to this):\n{message.author.display_name}: {text}"
+
+        lines = await history_cache.get_lines(message, BOT_USER_ID, PROMPT_MAX_HISTORY_MESSAGES)
+        prompt = build_prompt("You are a helpful assistant.", lines, current_section)
+        results["raw"]["tokens"].append(prompt.total_tokens)
+        results["raw"]["covered"].append(prompt.history_used)
+
+        started = time.perf_counter()
+        summary = await summarizer.get(channel.id)
+        after_id = summary.last_message_id if summary else 0
+        lines = await history_cache.get_lines(message, BOT_USER_ID, PROMPT_MAX_HISTORY_MESSAGES, after_id=after_id)
+        summarizer.maybe_refresh(channel.id, history_cache, BOT_USER_ID, after_id)
+        prompt = build_prompt("You are a helpful assistant.", lines, current_section, summary=summary.text if summary else None)
+        results["summary"]["build_ms"].append((time.perf_counter() - started) * 1000)
+        results["summary"]["tokens"].append(prompt.total_tokens)
+        summarized = message_index[after_id] + 1 if summary else 0 # Every message up to the summary's last one
+        results["summary"]["covered"].append(summarized + prompt.history_used)
+
+    await asyncio.gather(*summarizer._tasks)
+    print(f"{args.messages} messages of ~{args.words} words, prompt every {args.mention_every}; "
+          f"summary every {args.summary_every} messages, raw tail >= {args.tail}, {summary_calls} summary call(s)")
+    for name, samples in results.items():
+        tokens, covered = samples["tokens"], samples["covered"]
+        print(f"  {name:<8} prompt tokens mean={sum(tokens) / len(tokens):7.0f} p95={percentile(tokens, 0.95):6d}  "
+              f"earlier messages covered mean={sum(covered) / len(covered):6.1f} last={covered[-1]}")
+    build_ms = results["summary"]["build_ms"]
+    print(f"  summary lookup + prompt build p50={percentile(build_ms, 0.5):.3f}ms p95={percentile(build_ms, 0.95):.3f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--words", type=int, default=40, help="Words per message")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--mention-every", type=int, default=10, help="Build a reply prompt every N messages")
+    parser.add_argument("--summary-every", type=int, default=20)
+    parser.add_argument("--tail", type=int, default=10, help="Newest messages always kept raw")
+    parser.add_argument("--summary-tokens", type=int, default=300, help="Size of the fake summaries")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake summary generation latency in seconds")
+    parser.add_argument("--message-interval", type=float, default=0.02, help="Seconds between messages")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="summary-bench-")
+    os.chdir(workdir) # database.DB_FILE is relative to the working directory
+    try:
+        asyncio.run(run_benchmark(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
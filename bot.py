@@ -1,24 +1,55 @@
+import time
+_process_started = time.perf_counter() # Import-to-ready time is logged in on_ready
+import asyncio
 import discord
 from discord import app_commands # Import app_commands
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
+import hashlib
+import json
+import logging
 import re # Import re for parsing
-from commands.persona import setup_persona_commands, set_gemini_globals, ApprovalView # Import ApprovalView if needed for on_ready handling (optional for now)
-from shared import DB_FILE, ADMIN_USER_ID, is_admin_or_creator, get_persona, initialize_database, DISCORD_TOKEN, GEMINI_API_KEY
 
-# Load environment variables from .env file
+# Load environment variables from .env file. This must happen before importing our own modules,
+# which read their settings from the environment at import time.
 load_dotenv()
+from log import setup_logging
+from commands.persona import setup_persona_commands, set_gemini_globals, ApprovalView # Import ApprovalView if needed for on_ready handling (optional for now)
+from database import run_db, run_db_read, shutdown_db
+from approval_queue import run_approval_sweeper
+from history import ChannelHistoryCache
+from persona_index import persona_names
+from user_cache import user_cache
+from sharding import SHARDING_ENABLED, SHARD_STATS_INTERVAL, create_client, shard_for_guild, ShardPartitioned, ShardStats, run_shard_stats_logger
+from prompt import PROMPT_MAX_HISTORY_MESSAGES, build_prompt
+from response_cache import ResponseCache, prune_response_cache
+from coalescer import MentionCoalescer
+from summaries import ChannelSummarizer
+from memory import MemoryIndex
+from scheduler import GenerationScheduler, QueueFull, RequestExpired
+from replies import STREAMING_ENABLED, get_streaming_stats, send_chunks, send_response, stream_response
+from generation_workers import GenerationWorkerPool
+from resilience import CircuitOpen, GenerationTimeout, ResilientGenerator, ResilientModel
+from metrics import Gauge, add_stats_collector, errors_total, requests_total, span, stage_seconds, start_metrics_server, tokens_total
+from prompt import estimate_tokens
+from gemini import generation_config, default_safety_settings, safety_profile_for, get_model_async, get_fallback_model, get_model_cache_stats, load_sdk
+from gemini import configure as configure_gemini
+from shared import ADMIN_USER_ID, get_persona_async, get_persona_cache_stats, initialize_database, get_bot_state, set_bot_state, DISCORD_TOKEN, GEMINI_API_KEY
+
+setup_logging()
+log = logging.getLogger("bot")
 
 # --- Basic Input Validation ---
 if not DISCORD_TOKEN:
-    print("Error: DISCORD_TOKEN not found in .env file.")
+    log.critical("DISCORD_TOKEN not found in .env file.")
     exit()
 if not GEMINI_API_KEY:
-    print("Error: GEMINI_API_KEY not found in .env file.")
+    log.critical("GEMINI_API_KEY not found in .env file.")
     exit()
 
-# Initialize DB before anything else that might need it
+COMMAND_SYNC_FORCE = os.getenv('COMMAND_SYNC_FORCE', '0') == '1' # Sync even if the command schema hash is unchanged
+
+# Initialize DB before anything else that might need it (the only call; it is idempotent anyway)
 initialize_database()
 
 # --- Configure Discord Bot ---
@@ -27,70 +58,221 @@ intents.messages = True
 intents.message_content = True # Enable message content intent
 
 # Use Client instead of Bot for simplicity here, but Bot is often preferred for commands
-client = discord.Client(intents=intents)
+# (an AutoShardedClient when SHARDING_ENABLED/SHARD_COUNT is set, see sharding.py)
+client = create_client(intents)
 tree = app_commands.CommandTree(client) # Create a command tree
+# Per-channel state is kept per shard; a channel's events always arrive on its guild's shard
+history_caches = ShardPartitioned(ChannelHistoryCache)
+mention_coalescers = ShardPartitioned(MentionCoalescer)
+# One scheduler per process: its limits model the Gemini API quota, which all shards share
+generation_scheduler = GenerationScheduler()
+# GENERATION_WORKERS > 0 moves Gemini calls and reply chunking into worker processes
+generation_workers = GenerationWorkerPool()
+# Retries, per-request deadline, hedging and circuit breaker for in-process Gemini calls (workers have their own)
+generation_client = ResilientGenerator()
+streaming_enabled = STREAMING_ENABLED and not generation_workers.enabled # Workers return whole replies
+if STREAMING_ENABLED and generation_workers.enabled:
+    log.warning("GEMINI_STREAMING is ignored while GENERATION_WORKERS is set.")
+shard_stats = ShardStats()
+shard_stats_logger = None
+metrics_server = None
+response_cache = ResponseCache()
+approval_sweeper = None # Background task expiring unanswered approval requests
+memory_index = MemoryIndex() # Vector recall of older messages (MEMORY_ENABLED); one per process, files are per channel
+gemini_sdk_loader = None # Background import of google.generativeai, started once connected
+startup_done = False # on_ready also fires after gateway reconnects; per-process setup runs once
+commands_synced = False
+user_cache.bind(client)
+
+# Scraped from the local metrics endpoint (METRICS_PORT); lambdas so replaced objects are picked up
+Gauge("bot_queue_depth", "Requests waiting in the generation scheduler.", lambda: generation_scheduler.get_stats()["queued"])
+add_stats_collector("bot_scheduler", lambda: generation_scheduler.get_stats())
+add_stats_collector("bot_response_cache", lambda: response_cache.get_stats())
+add_stats_collector("bot_user_cache", user_cache.get_stats)
+add_stats_collector("bot_generation_workers", lambda: generation_workers.get_stats())
+add_stats_collector("bot_gemini_client", lambda: generation_client.get_stats())
+add_stats_collector("bot_memory", memory_index.get_stats)
+add_stats_collector("bot_streaming", get_streaming_stats) # TTFT of streamed replies
+add_stats_collector("bot_persona_cache", get_persona_cache_stats)
+add_stats_collector("bot_model_cache", get_model_cache_stats) # Only models built in this process (not generation workers)
 
 # --- Configure Google Gemini ---
 try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Store config and safety settings globally for reuse
-    generation_config = {
-      "temperature": 0.9,
-      "top_p": 1,
-      "top_k": 1,
-      "max_output_tokens": 2048,
-    }
-    # Default safety settings (will be adjusted per message based on channel)
-    default_safety_settings = [
-      {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-      {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-      {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"}, # Base default
-      {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}, # Base default
-    ]
+    configure_gemini(GEMINI_API_KEY) # The SDK itself is imported lazily, see gemini.load_sdk
     # Pass necessary globals to the persona module
     # Note: model and chat are no longer created globally here
     set_gemini_globals(generation_config, default_safety_settings, client) # Pass client instance (Now defined)
-    print("Gemini API configured. Model will be created per message.")
+    log.info("Gemini API key set. Models are cached per persona and safety profile.")
 except Exception as e:
-    print(f"Error configuring Gemini: {e}")
+    log.critical("Error configuring Gemini: %s", e)
     exit()
 
-# Register persona commands
-import asyncio
+def command_schema_hash() -> str:
+    """Hash of the global command payload that tree.sync() would upload."""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: command["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def sync_commands() -> bool:
+    """Upload the command tree unless Discord already has this exact schema. Returns whether it synced."""
+    if not tree.get_commands():
+        # Syncing an empty tree would delete every global command (and record that as synced)
+        raise RuntimeError("Refusing to sync an empty command tree")
+    # Keyed by application so pointing the same database at another bot still syncs
+    key = f"command_schema_hash:{client.application_id}"
+    schema_hash = command_schema_hash()
+    if not COMMAND_SYNC_FORCE and await run_db_read(get_bot_state, key) == schema_hash:
+        return False
+    await tree.sync()
+    await run_db(set_bot_state, key, schema_hash)
+    return True
+
+async def generate_summary(channel_id, system_instruction, content):
+    """Summary refreshes share the scheduler (and so the Gemini quota and fairness) with replies."""
+    async def generate():
+        if generation_workers.enabled:
+            text, _, _ = await generation_workers.generate(system_instruction, "sfw", content)
+            return text
+        model = ResilientModel(generation_client, await get_model_async(system_instruction, "sfw"))
+        return (await model.generate_content_async(content)).text
+    return await generation_scheduler.run(channel_id, client.user.id, generate, estimate_tokens(system_instruction) + estimate_tokens(content))
+
+# Rolling per-channel summaries of older history (SUMMARY_ENABLED), refreshed in the background
+summarizer = ChannelSummarizer(generate_summary)
+add_stats_collector("bot_summaries", lambda: summarizer.get_stats())
+
+async def warm_gemini_sdk():
+    try:
+        await asyncio.to_thread(load_sdk)
+    except Exception as e:
+        log.error("Could not load the Gemini SDK (the first message will retry): %s", e)
 
 # --- Discord Event Handlers ---
 
+def _shard_id(guild_id):
+    shard_id = shard_for_guild(guild_id, client.shard_count)
+    shard_stats.record_event(shard_id)
+    return shard_id
+
+@client.event
+async def on_raw_message_edit(payload):
+    # Raw events fire even for messages outside discord.py's message cache
+    shard_id = _shard_id(payload.guild_id)
+    if "content" in payload.data:
+        history_caches.get(shard_id).edit(payload.channel_id, payload.message_id, payload.data["content"])
+
+@client.event
+async def on_raw_message_delete(payload):
+    history_caches.get(_shard_id(payload.guild_id)).delete(payload.channel_id, [payload.message_id])
+    await memory_index.forget(payload.channel_id, [payload.message_id]) # Deleted messages must not be recalled
+
+@client.event
+async def on_raw_bulk_message_delete(payload):
+    history_caches.get(_shard_id(payload.guild_id)).delete(payload.channel_id, payload.message_ids)
+    await memory_index.forget(payload.channel_id, payload.message_ids)
+
+@client.event
+async def on_shard_ready(shard_id):
+    # A fresh session (not a resume) may have missed events, so rebuild this shard's history over REST
+    history_caches.drop(shard_id)
+    shard_stats.set_status(shard_id, "ready")
+    log.info("Shard %s ready.", shard_id)
+
+@client.event
+async def on_shard_disconnect(shard_id):
+    shard_stats.set_status(shard_id, "disconnected")
+    log.warning("Shard %s disconnected.", shard_id)
+
+@client.event
+async def on_shard_resumed(shard_id):
+    shard_stats.set_status(shard_id, "resumed")
+    log.info("Shard %s resumed.", shard_id)
+
 @client.event
 async def on_ready():
-    # If using persistent views across restarts, you might re-add them here.
-    # For now, we rely on the view timeout set in ApprovalView.
-    # client.add_view(ApprovalView(request_id="*")) # This approach needs refinement for dynamic request_ids
+    global approval_sweeper, shard_stats_logger, metrics_server, gemini_sdk_loader, startup_done, commands_synced
+    if not SHARDING_ENABLED:
+        # A plain Client never dispatches on_shard_ready, and on_ready only fires for a fresh
+        # session (resumes fire on_resumed), which may have missed events: rebuild history over REST
+        history_caches.clear()
+        shard_stats.set_status(0, "ready")
+    if startup_done and commands_synced:
+        # A new gateway session after a reconnect: everything below already ran in this process
+        log.info("Reconnected as %s.", client.user.name)
+        return
 
-    await setup_persona_commands(tree, client) # Pass client instance
-    await tree.sync()
-    print(f'Logged in as {client.user.name} ({client.user.id})')
-    print(f'Command tree synced. Ready.')
-    print('------')
+    if not startup_done:
+        # Each step is skipped once it has succeeded, so a failure part way through is retried on
+        # the next on_ready; startup_done is only set when all of them went through.
+        if metrics_server is None:
+            try:
+                metrics_server = await start_metrics_server()
+            except OSError as e: # e.g. METRICS_PORT already in use; metrics are optional
+                log.error("Could not start the metrics endpoint: %s", e)
+        if SHARDING_ENABLED and SHARD_STATS_INTERVAL > 0 and shard_stats_logger is None:
+            shard_stats_logger = asyncio.create_task(run_shard_stats_logger(client, shard_stats))
+        await generation_workers.start()
+        if not generation_workers.enabled and gemini_sdk_loader is None:
+            # Import the Gemini SDK off the event loop now, rather than inside the first on_message
+            gemini_sdk_loader = asyncio.create_task(warm_gemini_sdk())
+        if approval_sweeper is None:
+            # One persistent ApprovalView handles the buttons on every approval DM, including ones
+            # sent before a restart; it looks requests up by message ID in the approval queue.
+            client.add_view(ApprovalView())
+            approval_sweeper = asyncio.create_task(run_approval_sweeper())
+
+        if ADMIN_USER_ID:
+            try:
+                # Every approval request DMs the admin, so resolve them once up front
+                await user_cache.warm(ADMIN_USER_ID)
+            except Exception as e:
+                log.warning("Could not pre-warm admin user %s: %s", ADMIN_USER_ID, e)
+
+        if not tree.get_commands():
+            await setup_persona_commands(tree, client) # Pass client instance
+        if response_cache.enabled:
+            await run_db(prune_response_cache) # Drop expired cached responses left from previous runs
+        startup_done = True
+
+    # Retried on the next on_ready if it fails
+    synced = await sync_commands()
+    commands_synced = True
+    ready_seconds = time.perf_counter() - _process_started
+    stage_seconds.observe(ready_seconds, "startup")
+    log.info("Logged in as %s (%s). Command tree %s. Ready %.2fs after start.", client.user.name, client.user.id,
+             "synced" if synced else "unchanged, sync skipped", ready_seconds)
 
 @client.event
 async def on_message(message):
     """Event handler for when a message is sent."""
+    # Every message we can see (including our own replies) feeds the history buffer
+    shard_id = _shard_id(message.guild.id if message.guild else None)
+    history_cache = history_caches.get(shard_id)
+    history_cache.record(message)
     if message.author == client.user or message.author.bot:
+        memory_index.add(message)
         return
 
     is_mentioned = client.user.mentioned_in(message)
     is_dm = isinstance(message.channel, discord.DMChannel)
+    if is_mentioned or is_dm:
+        memory_index.note_reply(message.channel.id) # Only channels the bot replies in are indexed
+    memory_index.add(message)
 
     if is_mentioned or is_dm:
+        requests_total.inc(1, "mention")
+        trace = {"channel_id": message.channel.id, "message_id": message.id} # Lets log lines be sampled per channel
+        started = time.perf_counter()
         async with message.channel.typing():
             try:
                 raw_content = message.content
                 persona_name_override = None
                 persona_content_override = None
+                persona_key = None # Which persona answers; only mentions sharing it are coalesced
                 # Dynamically load the default persona
-                default_persona_data = get_persona()
+                with span("get_persona"):
+                    default_persona_data = await get_persona_async()
                 if not default_persona_data:
-                    print("CRITICAL ERROR: Could not load default persona during message processing.")
+                    log.critical("Could not load default persona during message processing.", extra=trace)
                     await message.channel.send("Sorry, I couldn't load my default personality.")
                     return
                 system_instruction_to_use = default_persona_data[0]
@@ -108,137 +290,174 @@ async def on_message(message):
                     persona_name_override = type_match.group(1)
                     # Remove the argument from the base content
                     base_content = (base_content[:type_match.start()] + base_content[type_match.end():]).strip()
-                    print(f"Detected type override: '{persona_name_override}'")
+                    log.debug("Detected type override: '%s'", persona_name_override, extra=trace)
                     # Fetch the specified persona content
-                    persona_data = get_persona(persona_name_override)
+                    with span("get_persona"):
+                        persona_data = await get_persona_async(persona_name_override)
                     if persona_data:
                         persona_content_override = persona_data[0]
                         system_instruction_to_use = persona_content_override # Use override
-                        print(f"Using persona '{persona_name_override}' for this message.")
+                        persona_key = persona_name_override
+                        log.debug("Using persona '%s' for this message.", persona_name_override, extra=trace)
                     else:
-                        await message.channel.send(f"(Couldn't find persona '{persona_name_override}', using default.)")
-                        print(f"Persona '{persona_name_override}' not found, using default.")
-
-                # 3. Fetch history (limit adjusted slightly)
-                history_messages = []
-                async for msg in message.channel.history(limit=10, before=message): # Fetch messages *before* current one
-                    history_messages.append(msg)
-                history_messages.reverse() # Oldest first
-
-                formatted_history_lines = []
-                for msg in history_messages:
-                    # Use display_name which respects server nicknames
-                    author_name = "You" if msg.author == client.user else msg.author.display_name
-                    # Basic cleaning of mentions in history (might need refinement)
-                    # Also clean the -type argument from history messages if present
-                    cleaned_hist_content = re.sub(r'<@!?\d+>', '', msg.content).strip()
-                    cleaned_hist_content = re.sub(r'-type\s+"[^"]+"', '', cleaned_hist_content, flags=re.IGNORECASE).strip()
-                    if cleaned_hist_content: # Avoid empty history lines
-                        formatted_history_lines.append(f"{author_name}: {cleaned_hist_content}")
-                formatted_history = "\n".join(formatted_history_lines)
-
-                # 4. Check if base_content is empty after processing
+                        suggestion = persona_names.closest(persona_name_override)
+                        hint = f" Did you mean '{suggestion}'?" if suggestion else ""
+                        await message.channel.send(f"(Couldn't find persona '{persona_name_override}', using default.{hint})")
+                        log.debug("Persona '%s' not found, using default.", persona_name_override, extra=trace)
+
+                # 3. Check if base_content is empty after processing
                 if not base_content:
                     await message.channel.send("Did you mean to ask something?")
                     return
 
-                # 5. Prepare content for Gemini
-                current_query = f"{message.author.display_name}: {base_content}" # Use the processed base_content
-
-                # Persona is now handled via system_instruction
-                content_for_gemini = (
-                    f"## Message History:\n{formatted_history}\n\n"
-                    f"## Current Message (Respond to this):\n{current_query}"
-                )
-
-                print(f"--- Sending to Gemini ---")
-                print(f"Persona Used: {'Override: '+persona_name_override if persona_name_override else 'Default'}")
-                # print(f"System Instruction Used:\n{system_instruction_to_use[:100]}...") # Optional: Log instruction
-                print(f"History Length: {len(formatted_history_lines)} messages")
-                print(f"Current Query: {current_query}") # Log the final query sent
-                print(f"-------------------------")
-
-                # Determine safety settings based on channel NSFW status
-                if hasattr(message.channel, "is_nsfw") and callable(message.channel.is_nsfw) and message.channel.is_nsfw():
-                    # NSFW channel configuration
-                    safety_settings_local = [
-                        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-                        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-                        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"}, # Less restrictive
-                        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}, # Less restrictive
-                    ]
-                    print("Using NSFW safety settings.")
-                else:
-                    # Non-NSFW channel configuration (use defaults or specific non-NSFW)
-                    safety_settings_local = [
-                        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-                        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-                        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, # More restrictive
-                        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, # More restrictive
-                    ]
-                    print("Using SFW safety settings.")
-
-                # Create the model and chat locally for this specific message
-                local_model = genai.GenerativeModel(
-                    model_name="gemini-2.5-flash-preview-04-17", # Updated model name
-                    generation_config=generation_config,
-                    system_instruction=system_instruction_to_use, # Pass the determined persona here
-                    safety_settings=safety_settings_local # Pass the determined safety settings
-                )
-                # Start a fresh chat for each message to ensure context isolation and correct system instruction/safety
-                local_chat = local_model.start_chat(history=[])
-                response = await local_chat.send_message_async(content_for_gemini) # Use async version
-
-                print(f"Received from Gemini: {response.text[:100]}...") # Log truncated output
-
-                # Send Gemini's response back to Discord in chunks if needed
-                if len(response.text) == 0:
-                    await message.channel.send("I received an empty response.")
+                # 4. Merge with other mentions in this channel arriving within the coalescing window
+                batch = await mention_coalescers.get(shard_id).collect(message.channel.id, persona_key, (message, base_content))
+                if batch is None:
+                    return # An earlier mention's reply will answer this one too
+                first_message = batch[0][0]
+
+                # 5. Fetch history from the event-fed buffer (REST only on a cold channel); the
+                # prompt builder decides how much of it fits the token budget. With a channel
+                # summary, only the messages newer than the summary are sent raw.
+                with span("history"):
+                    summary = await summarizer.get(message.channel.id)
+                    summarized_until = summary.last_message_id if summary else 0
+                    formatted_history_lines = await history_cache.get_lines(first_message, client.user.id, PROMPT_MAX_HISTORY_MESSAGES,
+                                                                            after_id=summarized_until)
+                # Only channels the bot answers in are summarized; the refresh runs in the background
+                summarizer.maybe_refresh(message.channel.id, history_cache, client.user.id, summarized_until)
+                summary_text = summary.text if summary else None
+
+                # 6. Prepare content for Gemini
+                if len(batch) == 1:
+                    current_query = f"{message.author.display_name}: {base_content}" # Use the processed base_content
+                    current_section = f"## Current Message (Respond to this):\n{current_query}"
                 else:
-                    # Split into chunks of 1999 characters, trying to break at newlines when possible
-                    chunks = []
-                    text = response.text
-                    while text:
-                        if len(text) <= 1999:
-                            chunks.append(text)
-                            break
-                        
-                        # Try to find a newline to split at
-                        split_point = text[:1999].rfind('\n')
-                        if split_point == -1:  # No newline found, just split at 2000
-                            split_point = 1999
-
-                        chunks.append(text[:split_point])
-                        text = text[split_point:].lstrip()  # Remove leading whitespace from next chunk
-                    
-                    # Send each chunk
-                    for i, chunk in enumerate(chunks, 1):
-                        if len(chunks) > 1:
-                            chunk = f"[Part {i}/{len(chunks)}]\n{chunk}"
-                        await message.channel.send(chunk)
+                    current_query = "\n".join(f"{msg.author.display_name}: {content}" for msg, content in batch)
+                    current_section = (
+                        "## Current Messages (Respond to each of these in a single reply, addressing each user by name):\n"
+                        f"{current_query}"
+                    )
+
+                # Recall older messages similar to the new one(s), skipping what the raw history already has
+                memories = None
+                if memory_index.enabled:
+                    with span("memory"):
+                        memories = await memory_index.search(message.channel.id, "\n".join(content for _, content in batch), client.user.id,
+                                                             exclude=history_cache.message_ids(message.channel.id))
+
+                with span("prompt"):
+                    prompt = build_prompt(system_instruction_to_use, formatted_history_lines, current_section, summary=summary_text,
+                                          memories=memories)
+                tokens_total.inc(prompt.total_tokens, "input")
+                content_for_gemini = prompt.content
+
+                if log.isEnabledFor(logging.DEBUG): # Skip building these strings unless they'll be kept
+                    log.debug("Sending to Gemini: persona=%s, %d coalesced mention(s). %s",
+                              persona_key or "default", len(batch), prompt.log_summary(), extra=trace)
+                    log.debug("Current query: %s", current_query, extra=trace) # Log the final query sent
+
+                # Determine safety profile based on channel NSFW status
+                safety_profile = safety_profile_for(message.channel)
+                log.debug("Using %s safety settings.", safety_profile.upper(), extra=trace)
+
+                # Serve identical prompts to the same persona from the response cache
+                cache_key = None
+                if response_cache.enabled_for(message.channel.id):
+                    context = "\n".join([summary_text or "", *(memories or ()), prompt.history]) # Everything besides the query
+                    cache_key = response_cache.make_key(system_instruction_to_use, safety_profile, context, current_query)
+                    with span("response_cache"):
+                        cached_text = await response_cache.get(cache_key)
+                    if cached_text is not None:
+                        log.debug("Serving response from cache.", extra=trace)
+                        with span("send"):
+                            await send_response(message.channel, cached_text)
+                        return
+
+                generation_seconds = 0.0
+                reply_chunks = None # Already split by a generation worker
+
+                async def generate():
+                    nonlocal generation_seconds, reply_chunks
+                    stage_seconds.observe(time.perf_counter() - submitted, "queue_wait")
+                    if generation_workers.enabled:
+                        response_text, reply_chunks, generation_seconds = await generation_workers.generate(
+                            system_instruction_to_use, safety_profile, content_for_gemini)
+                        return response_text
+                    # Reuse the model configured for this persona and safety profile (built off the
+                    # loop on a miss, and only once the response cache has missed). A single-turn
+                    # generate call is equivalent to a fresh chat, without building a session per message.
+                    with span("model"):
+                        local_model = ResilientModel(generation_client, await get_model_async(system_instruction_to_use, safety_profile),
+                                                     lambda: get_fallback_model(system_instruction_to_use, safety_profile))
+                    started = time.perf_counter()
+                    try:
+                        if streaming_enabled:
+                            # Post the first chunk as soon as it arrives, then edit/extend on a schedule
+                            return await stream_response(message.channel, local_model, content_for_gemini)
+                        response = await local_model.generate_content_async(content_for_gemini)
+                        return response.text
+                    finally:
+                        generation_seconds = time.perf_counter() - started
+                        stage_seconds.observe(generation_seconds, "generation")
+
+                # Queue behind the global scheduler (concurrency cap, rate limits, per-channel fairness)
+                submitted = time.perf_counter()
+                try:
+                    position, pending = generation_scheduler.submit(message.channel.id, message.author.id, generate, prompt.total_tokens)
+                except QueueFull:
+                    errors_total.inc(1, "scheduler", "QueueFull")
+                    await message.channel.send("I'm handling too many requests right now. Please try again in a moment.")
+                    return
+                if position:
+                    await message.channel.send(f"(Queued, position {position})")
+                try:
+                    response_text = await pending
+                except RequestExpired:
+                    errors_total.inc(1, "scheduler", "RequestExpired")
+                    await message.channel.send("Sorry, your request waited too long in the queue. Please try again.")
+                    return
+                except (GenerationTimeout, CircuitOpen) as e:
+                    errors_total.inc(1, "generation", type(e).__name__)
+                    log.warning("No reply for message %s: %s", message.id, e, extra=trace)
+                    await message.channel.send("Sorry, Gemini is slow or unavailable right now. Please try again in a moment.")
+                    return
+
+                log.debug("Received from Gemini: %s...", response_text[:100], extra=trace) # Log truncated output
+                tokens_total.inc(estimate_tokens(response_text), "output")
+                with span("send"):
+                    if reply_chunks is not None:
+                        await send_chunks(message.channel, reply_chunks)
+                    elif not streaming_enabled:
+                        # Send Gemini's response back to Discord in chunks if needed
+                        await send_response(message.channel, response_text)
+                if cache_key and response_text:
+                    await response_cache.put(cache_key, response_text, generation_seconds)
 
             except discord.errors.Forbidden as e:
-                print(f"Error: Missing permissions in channel {message.channel.name}: {e}")
+                errors_total.inc(1, "on_message", type(e).__name__)
+                log.error("Missing permissions in channel %s: %s", message.channel.name, e, extra=trace)
             except Exception as e:
-                print(f"Error processing message {message.id}: {e}")
-                import traceback
-                traceback.print_exc() # Print full traceback for debugging
+                errors_total.inc(1, "on_message", type(e).__name__)
+                log.exception("Error processing message %s: %s", message.id, e, extra=trace) # Includes the traceback
                 try:
                     await message.channel.send("Sorry, I encountered an error trying to respond.")
                 except discord.errors.Forbidden:
-                    print(f"Error: Also missing send message permissions in channel {message.channel.name}")
+                    log.error("Also missing send message permissions in channel %s", message.channel.name, extra=trace)
+            finally:
+                stage_seconds.observe(time.perf_counter() - started, "total")
 
 
 # --- Run the Bot ---
-try:
-    # Initialize database before running the client
-    initialize_database()
-    client.run(DISCORD_TOKEN)
-except discord.errors.LoginFailure:
-    print("Error: Invalid Discord Token. Please check your .env file.")
-except discord.errors.PrivilegedIntentsRequired:
-     print("Error: Message Content Intent is not enabled for the bot in the Discord Developer Portal.")
-except Exception as e:
-    print(f"An unexpected error occurred while running the bot: {e}")
-    import traceback
-    traceback.print_exc()
+if __name__ == "__main__": # Importing bot (e.g. from benchmarks/e2e_bench.py) must not connect
+    try:
+        client.run(DISCORD_TOKEN, log_handler=None) # Logging is already set up (log.py)
+    except discord.errors.LoginFailure:
+        log.critical("Invalid Discord Token. Please check your .env file.")
+    except discord.errors.PrivilegedIntentsRequired:
+         log.critical("Message Content Intent is not enabled for the bot in the Discord Developer Portal.")
+    except Exception as e:
+        log.exception("An unexpected error occurred while running the bot: %s", e)
+    finally:
+        # Flush queued DB work and close the long-lived connections
+        shutdown_db()
@@ -0,0 +1,67 @@
+import asyncio
+import os
+from env import parse_id_map
+
+def _parse_channel_windows(raw: str) -> dict:
+    """Parse "channel_id:ms,channel_id:ms" into {channel_id: seconds}. A window of 0 opts a channel out."""
+    return parse_id_map(raw, lambda window_ms: int(window_ms) / 1000)
+
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', '0')) # 0 disables coalescing by default
+COALESCE_MAX_BATCH = int(os.getenv('COALESCE_MAX_BATCH', '5'))
+COALESCE_CHANNEL_WINDOWS = _parse_channel_windows(os.getenv('COALESCE_CHANNEL_WINDOWS', ''))
+COALESCE_CHANNEL_MAX_BATCH = parse_id_map(os.getenv('COALESCE_CHANNEL_MAX_BATCH', '')) # "channel_id:cap,..."; a cap of 1 opts a channel out
+
+class _Batch:
+    __slots__ = ("items", "full")
+
+    def __init__(self, item):
+        self.items = [item]
+        self.full = asyncio.Event()
+
+class MentionCoalescer:
+    """Merges mentions that arrive in the same channel within a short window into one generation.
+
+    The first mention opens a window and becomes the leader; mentions arriving before it closes
+    (and sharing the same key, e.g. persona) join its batch. The leader gets the whole batch back
+    and answers for everyone; followers get None and should not reply on their own.
+    """
+
+    def __init__(self, window_ms=COALESCE_WINDOW_MS, max_batch=COALESCE_MAX_BATCH, channel_windows=None, channel_max_batch=None):
+        self.default_window = window_ms / 1000
+        self.max_batch = max_batch
+        self.channel_windows = COALESCE_CHANNEL_WINDOWS if channel_windows is None else channel_windows
+        self.channel_max_batch = COALESCE_CHANNEL_MAX_BATCH if channel_max_batch is None else channel_max_batch
+        self._open = {}
+        self.stats = {"batches": 0, "coalesced": 0}
+
+    def window_for(self, channel_id) -> float:
+        return self.channel_windows.get(channel_id, self.default_window)
+
+    def max_batch_for(self, channel_id) -> int:
+        return self.channel_max_batch.get(channel_id, self.max_batch)
+
+    async def collect(self, channel_id, key, item):
+        """Return the list of items to answer together, or None if another mention's reply covers this one."""
+        window = self.window_for(channel_id)
+        max_batch = self.max_batch_for(channel_id)
+        if window <= 0 or max_batch <= 1:
+            return [item]
+        batch_key = (channel_id, key)
+        batch = self._open.get(batch_key)
+        if batch is not None:
+            batch.items.append(item)
+            self.stats["coalesced"] += 1
+            if len(batch.items) >= max_batch:
+                # Close early so a full batch doesn't wait out the rest of the window
+                del self._open[batch_key]
+                batch.full.set()
+            return None
+        batch = self._open[batch_key] = _Batch(item)
+        try:
+            await asyncio.wait_for(batch.full.wait(), window)
+        except asyncio.TimeoutError:
+            pass
+        if self._open.get(batch_key) is batch:
+            del self._open[batch_key]
+        self.stats["batches"] += 1
+        return batch.items
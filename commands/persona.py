@@ -1,18 +1,33 @@
+import asyncio
+import logging
 import discord
 from discord import app_commands
 import sqlite3
 import uuid # Import uuid for unique request IDs
-from shared import DB_FILE, ADMIN_USER_ID, is_admin_or_creator, get_persona
+from database import run_db, run_db_read
+from persona_index import persona_names
+from user_cache import user_cache
+from metrics import timed_command
+from approval_queue import (
+    add_approval_request, set_approval_message, get_request_id_for_message, get_approval_request, claim_approval_request, unclaim_approval_request,
+    remove_approval_request, count_approval_requests, list_approval_requests, apply_approval_batch,
+)
+from shared import (
+    ADMIN_USER_ID, is_admin, is_admin_or_creator, get_persona_meta, create_persona, update_persona_content,
+    delete_persona, set_default_persona, fetch_persona_page, count_personas, PERSONAS_PER_PAGE, append_to_default_persona,
+    revert_default_persona,
+)
+
+log = logging.getLogger(__name__)
 
 # REMOVED: Global SYSTEM_MESSAGE declaration
 generation_config = None
 safety_settings = None
 discord_client = None # Added to store the client instance
 
-# Dictionary to store pending requests: {request_id: {'type': 'create'/'modify', 'user_id': int, 'name': str, 'content': str, 'original_interaction': discord.Interaction}}
-pending_persona_requests = {}
-# Dictionary to map approval message ID to request ID: {message_id: request_id}
-approval_message_to_request = {}
+# Pending approval requests are stored in SQLite (see approval_queue.py), not in memory
+REVIEW_PAGE_SIZE = 10
+NOTIFY_CONCURRENCY = 5 # Max DMs in flight when notifying users after a bulk review
 
 # Updated: Removed system_message parameter, added client parameter
 def set_gemini_globals(gen_config, safety, client):
@@ -22,40 +37,69 @@ def set_gemini_globals(gen_config, safety, client):
     discord_client = client # Store the client instance
 
 class PersonaListView(discord.ui.View):
-    def __init__(self, personas, page=0, search=None):
+    # Holds only the current page and keyset cursors; other pages are fetched on demand
+    def __init__(self, rows, total, search=None, has_next=False):
         super().__init__(timeout=180)  # 3 minute timeout
-        self.personas = personas
-        self.page = page
+        self.rows = rows
+        self.total = total
+        self.page = 0
         self.search = search
-        self.per_page = 20
+        self.per_page = PERSONAS_PER_PAGE
+        self.has_next = has_next
         self.update_buttons() # Initial button setup
 
+    @classmethod
+    async def open(cls, search=None):
+        """Load the first page. Returns None if nothing matches."""
+        rows = await run_db_read(fetch_persona_page, search, limit=PERSONAS_PER_PAGE + 1)
+        if not rows:
+            return None
+        total = await run_db_read(count_personas, search)
+        return cls(rows[:PERSONAS_PER_PAGE], total, search, has_next=len(rows) > PERSONAS_PER_PAGE)
+
+    @staticmethod
+    def _cursor(row):
+        name, is_default, creator_id = row
+        return (is_default, name)
+
+    async def next_page(self):
+        rows = await run_db_read(fetch_persona_page, self.search, after=self._cursor(self.rows[-1]), limit=self.per_page + 1)
+        if rows:
+            self.rows = rows[:self.per_page]
+            self.has_next = len(rows) > self.per_page
+            self.page += 1
+
+    async def prev_page(self):
+        rows = await run_db_read(fetch_persona_page, self.search, before=self._cursor(self.rows[0]), limit=self.per_page)
+        if rows:
+            self.rows = rows
+            self.has_next = True
+            self.page = max(0, self.page - 1)
+
     def update_buttons(self):
         # Clear previous buttons before adding new ones
         self.clear_items()
         # Add buttons conditionally based on page number
         if self.page > 0:
             self.add_item(PrevButton()) # Add instance of the button class
-        if (self.page + 1) * self.per_page < len(self.personas):
+        if self.has_next:
             self.add_item(NextButton()) # Add instance of the button class
 
     def get_current_page_content(self):
         start = self.page * self.per_page
-        end = start + self.per_page
-        current_personas = self.personas[start:end]
-        
+
         # Format the message
         lines = []
-        for i, (name, is_default, creator_id) in enumerate(current_personas, start=start+1):
+        for i, (name, is_default, creator_id) in enumerate(self.rows, start=start+1):
             default_mark = "📌" if is_default else "  "
             lines.append(f"{default_mark} {i}. {name}")
-        
+
         # Add header
         header = "🌳 Available Personas"
         if self.search:
             header += f" (Search: '{self.search}')"
-        header += f"\nPage {self.page + 1}/{(len(self.personas) + self.per_page - 1) // self.per_page}"
-        
+        header += f"\nPage {self.page + 1}/{max(1, (self.total + self.per_page - 1) // self.per_page)}"
+
         return header + "\n```\n" + "\n".join(lines) + "\n```"
 
     # REMOVED button_callback method
@@ -76,7 +120,7 @@ class PrevButton(discord.ui.Button):
             await interaction.response.send_message("Error: View context lost.", ephemeral=True)
             return
 
-        view.page = max(0, view.page - 1)
+        await view.prev_page()
         view.update_buttons()
         await interaction.response.edit_message(content=view.get_current_page_content(), view=view)
 
@@ -91,55 +135,82 @@ class NextButton(discord.ui.Button):
             await interaction.response.send_message("Error: View context lost.", ephemeral=True)
             return
 
-        view.page = min((len(view.personas) - 1) // view.per_page, view.page + 1)
+        await view.next_page()
         view.update_buttons()
         await interaction.response.edit_message(content=view.get_current_page_content(), view=view)
 
 # --- Approval View ---
+def _approval_buttons(disabled=False):
+    """Return an ApprovalView that only carries its buttons' components.
+
+    The one persistent ApprovalView registered at startup (client.add_view) handles clicks on
+    every approval message by custom_id. discord.py keeps any unfinished view it sends or edits
+    with in its view store for good (timeout=None), so the copy is stopped before use and is
+    never stored.
+    """
+    view = ApprovalView()
+    for item in view.children:
+        item.disabled = disabled
+    view.stop()
+    return view
+
 class ApprovalView(discord.ui.View):
     # REMOVED request_id from __init__
     def __init__(self):
-        super().__init__(timeout=86400) # 24 hour timeout for approval
+        # No timeout: the view is re-registered on startup (client.add_view) and requests
+        # expire through the approval queue's sweeper instead.
+        super().__init__(timeout=None)
         # REMOVED: Explicit button additions, as decorators handle this.
         # self.add_item(discord.ui.Button(label="Approve", style=discord.ButtonStyle.success, custom_id="approve_request"))
         # self.add_item(discord.ui.Button(label="Reject", style=discord.ButtonStyle.danger, custom_id="reject_request"))
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         # Only allow the admin to interact
-        return interaction.user.id == ADMIN_USER_ID
+        return is_admin(interaction.user)
 
-    # MODIFIED: Added request_id parameter
-    async def handle_approval(self, interaction: discord.Interaction, request_id: str):
-        request_data = pending_persona_requests.get(request_id)
+    async def _claim_request(self, interaction: discord.Interaction, request_id: str):
+        """Resolve the requester, then claim the request. Returns (request_data, original_user) or None.
+
+        The requester is looked up before claiming, so a failed lookup leaves the request
+        pending and the admin can simply click again.
+        """
+        request_data = await run_db_read(get_approval_request, request_id)
         if not request_data:
-             # No need for fallback here as request_id comes from our mapping
-             print(f"Error in handle_approval: Request ID '{request_id}' (from message {interaction.message.id}) not found in pending_persona_requests.")
+             log.warning("Request ID '%s' (from message %s) not found in the approval queue.", request_id, interaction.message.id)
              await interaction.edit_original_response(content="This request is no longer valid or has already been processed.", view=None)
-             # Clean up message mapping if it exists
-             if interaction.message.id in approval_message_to_request:
-                 del approval_message_to_request[interaction.message.id]
-             return
-
-        # Log full request details
-        print("\n=== Processing Persona Request ===")
-        print(f"Request ID: {request_id}") # Log the ID being used
-        print(f"Approval Message ID: {interaction.message.id}")
-        # ... rest of handle_approval logic using request_id and request_data ...
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        original_user_id = request_data['user_id']
+             return None
         # Fetch original user - Ensure discord_client is available
         if not discord_client:
-             print("Error: discord_client is None in handle_approval")
+             log.error("discord_client is None while processing request %s", request_id)
              await interaction.edit_original_response(content="Internal error: Bot client reference lost.", view=None)
-             # Clean up pending request if possible
-             if request_id in pending_persona_requests:
-                 del pending_persona_requests[request_id]
-             # Clean up message mapping
-             if interaction.message.id in approval_message_to_request:
-                 del approval_message_to_request[interaction.message.id]
-             return
-        original_user = await discord_client.fetch_user(original_user_id)
+             return None
+        original_user_id = request_data['user_id']
+        try:
+            original_user = await user_cache.get_user(original_user_id)
+        except discord.NotFound:
+            original_user = None # The account is gone; the request can still be processed
+        except discord.HTTPException as e:
+            log.warning("Could not fetch requester %s for request %s: %s", original_user_id, request_id, e)
+            await interaction.edit_original_response(content=f"Could not look up the requester ({e}). The request is still pending; please try again.")
+            return None
+        # Claiming removes the request atomically, so a double click can't apply it twice
+        request_data = await run_db(claim_approval_request, request_id)
+        if not request_data:
+             await interaction.edit_original_response(content="This request is no longer valid or has already been processed.", view=None)
+             return None
+        return request_data, original_user
+
+    # MODIFIED: Added request_id parameter
+    async def handle_approval(self, interaction: discord.Interaction, request_id: str):
+        claimed = await self._claim_request(interaction, request_id)
+        if not claimed:
+            return
+        request_data, original_user = claimed
+
+        # Log full request details
+        log.info("Processing persona request %s (approval message %s)", request_id, interaction.message.id)
+        original_user_id = request_data['user_id']
+        requester = original_user.mention if original_user else f"user {original_user_id}"
 
         # Handle potential None for name/content if request type is append
         name = request_data.get('name', 'default') # Default to 'default' for append
@@ -151,254 +222,346 @@ class ApprovalView(discord.ui.View):
 
         try:
             if request_type == 'create':
-                cursor.execute(
-                    "INSERT INTO personas (name, content, creator_id, is_default) VALUES (?, ?, ?, ?)",
-                    (name, content, original_user_id, 0)
-                )
-                conn.commit()
+                await run_db(create_persona, name, content, original_user_id)
                 success = True
-                admin_feedback = f"✅ Approved creation of persona '{name}' by {original_user.mention}."
+                admin_feedback = f"✅ Approved creation of persona '{name}' by {requester}."
                 message_to_user = f"Your request to create persona '{name}' has been approved by the admin."
             elif request_type == 'modify':
-                cursor.execute("UPDATE personas SET content = ? WHERE name = ?", (content, name))
-                conn.commit()
-                success = True
-                admin_feedback = f"✅ Approved modification of persona '{name}' by {original_user.mention}."
-                message_to_user = f"Your request to modify persona '{name}' has been approved by the admin."
+                if await run_db(update_persona_content, name, content, original_user_id):
+                    success = True
+                    admin_feedback = f"✅ Approved modification of persona '{name}' by {requester}."
+                    message_to_user = f"Your request to modify persona '{name}' has been approved by the admin."
+                else:
+                    admin_feedback = f"⚠️ Could not approve modification: Persona '{name}' no longer exists."
+                    message_to_user = f"Your request to modify persona '{name}' could not be approved because the persona no longer exists."
             elif request_type == 'append':
                 text_to_append = request_data['text_to_append']
-                cursor.execute("SELECT content FROM personas WHERE is_default = 1")
-                current_default = cursor.fetchone()
-                if not current_default:
-                    raise Exception("Default persona not found.")
-                current_content = current_default[0]
-                # Store current content for undo support
-                from shared import store_original_content
-                store_original_content(current_content)
-                new_content = current_content + "\n\n" + text_to_append
-                cursor.execute("UPDATE personas SET content = ? WHERE is_default = 1", (new_content,))
-                conn.commit()
+                # Recorded in the default persona's version history for /undo-append
+                await run_db(append_to_default_persona, text_to_append, original_user_id)
                 success = True
-                admin_feedback = f"✅ Approved append to default persona by {original_user.mention}."
+                admin_feedback = f"✅ Approved append to default persona by {requester}."
                 message_to_user = "Your request to append to the default system message has been approved by the admin."
 
         except sqlite3.IntegrityError:
             admin_feedback = f"⚠️ Could not approve creation: Persona '{name}' already exists."
             message_to_user = f"Your request to create persona '{name}' could not be approved because a persona with that name already exists."
         except Exception as e:
-            admin_feedback = f"❌ An error occurred while approving {request_type} for '{name}': {e}"
-            message_to_user = f"An error occurred while processing the approval for your {request_type} request for persona '{name}'."
-            print(f"Error during approval: {e}")
-        finally:
-            conn.close()
+            log.error("Error during approval: %s", e)
+            # Nothing was applied; put the request back so the admin can retry
+            await run_db(unclaim_approval_request, request_data)
+            await interaction.edit_original_response(content=f"❌ An error occurred while approving {request_type} for '{name}': {e}\nThe request is still pending; please try again.")
+            return
 
         # Disable buttons and update admin message
-        for item in self.children:
-            item.disabled = True
-        # Edit the original deferred response
-        await interaction.edit_original_response(content=admin_feedback, view=self)
+        await interaction.edit_original_response(content=admin_feedback, view=_approval_buttons(disabled=True))
 
         # Notify the original user via DM
         if original_user:
             try:
-                await original_user.send(message_to_user)
+                await (await user_cache.get_dm_channel(original_user_id)).send(message_to_user)
             except discord.Forbidden:
-                print(f"Could not DM user {original_user_id}") # User might have DMs disabled
+                log.info("Could not DM user %s", original_user_id) # User might have DMs disabled
+            except discord.HTTPException as e:
+                user_cache.invalidate(original_user_id) # Don't keep reusing a stale user or DM channel
+                log.warning("Error notifying user %s: %s", original_user_id, e)
 
-        # Clean up pending request
-        if request_id in pending_persona_requests:
-            print(f"Cleaning up request ID: {request_id}")
-            del pending_persona_requests[request_id]
-        else:
-            print(f"Attempted to clean up request ID {request_id}, but it was already removed.")
-        # Clean up message mapping
-        if interaction.message.id in approval_message_to_request:
-            print(f"Cleaning up message mapping for message ID: {interaction.message.id}")
-            del approval_message_to_request[interaction.message.id]
+        log.info("Processed request ID: %s", request_id)
 
 
     # MODIFIED: Added request_id parameter
     async def handle_rejection(self, interaction: discord.Interaction, request_id: str):
-        request_data = pending_persona_requests.get(request_id)
-        if not request_data:
-             print(f"Error in handle_rejection: Request ID '{request_id}' (from message {interaction.message.id}) not found in pending_persona_requests.")
-             await interaction.edit_original_response(content="This request is no longer valid or has already been processed.", view=None)
-             # Clean up message mapping if it exists
-             if interaction.message.id in approval_message_to_request:
-                 del approval_message_to_request[interaction.message.id]
-             return
+        claimed = await self._claim_request(interaction, request_id)
+        if not claimed:
+            return
+        request_data, original_user = claimed
 
-        print(f"\n=== Rejecting Persona Request ===")
-        print(f"Request ID: {request_id}") # Log the ID being used
-        print(f"Approval Message ID: {interaction.message.id}")
+        log.info("Rejecting persona request %s (approval message %s)", request_id, interaction.message.id)
 
         original_user_id = request_data['user_id']
-         # Ensure discord_client is available
-        if not discord_client:
-             print("Error: discord_client is None in handle_rejection")
-             await interaction.edit_original_response(content="Internal error: Bot client reference lost.", view=None)
-             # Clean up pending request if possible
-             if request_id in pending_persona_requests:
-                 del pending_persona_requests[request_id]
-             # Clean up message mapping
-             if interaction.message.id in approval_message_to_request:
-                 del approval_message_to_request[interaction.message.id]
-             return
-        original_user = await discord_client.fetch_user(original_user_id)
+        requester = original_user.mention if original_user else f"user {original_user_id}"
         # Handle potential None for name if request type is append
         name = request_data.get('name', 'default') # Default to 'default' for append
         request_type = request_data['type']
-        admin_feedback = f"❌ Rejected {request_type} request for persona '{name}' by {original_user.mention}."
+        admin_feedback = f"❌ Rejected {request_type} request for persona '{name}' by {requester}."
         message_to_user = f"Your request to {request_type} persona '{name}' has been rejected by the admin."
 
         # Disable buttons and update admin message
-        for item in self.children:
-            item.disabled = True
-        # Edit the original deferred response
-        await interaction.edit_original_response(content=admin_feedback, view=self)
+        await interaction.edit_original_response(content=admin_feedback, view=_approval_buttons(disabled=True))
 
         # Notify the original user via DM
         if original_user:
             try:
-                await original_user.send(message_to_user)
+                await (await user_cache.get_dm_channel(original_user_id)).send(message_to_user)
             except discord.Forbidden:
-                 print(f"Could not DM user {original_user_id}")
+                 log.info("Could not DM user %s", original_user_id)
+            except discord.HTTPException as e:
+                user_cache.invalidate(original_user_id)
+                log.warning("Error notifying user %s: %s", original_user_id, e)
 
-        # Clean up pending request
-        if request_id in pending_persona_requests:
-            print(f"Cleaning up rejected request ID: {request_id}")
-            del pending_persona_requests[request_id]
-        else:
-             print(f"Attempted to clean up rejected request ID {request_id}, but it was already removed.")
-        # Clean up message mapping
-        if interaction.message.id in approval_message_to_request:
-            print(f"Cleaning up message mapping for message ID: {interaction.message.id}")
-            del approval_message_to_request[interaction.message.id]
+        log.info("Rejected request ID: %s", request_id)
 
 
-    # MODIFIED: Use fixed custom_id, retrieve request_id from mapping
+    # MODIFIED: Use fixed custom_id, retrieve request_id from the approval queue
     @discord.ui.button(label="Approve", style=discord.ButtonStyle.success, custom_id="approve_request")
     async def approve_button_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer() # Defer immediately
         message_id = interaction.message.id
-        request_id = approval_message_to_request.get(message_id)
+        request_id = await run_db_read(get_request_id_for_message, message_id)
 
-        print(f"--- Approve Button Clicked (Callback) ---")
-        print(f"Interaction Custom ID: {interaction.data['custom_id']}") # Should be 'approve_request'
-        print(f"Message ID: {message_id}")
+        log.debug("Approve button clicked: custom_id=%s message=%s", interaction.data['custom_id'], message_id)
 
         if request_id:
-            print(f"Found Request ID '{request_id}' for Message ID {message_id}")
+            log.debug("Found Request ID '%s' for Message ID %s", request_id, message_id)
             await self.handle_approval(interaction, request_id) # Pass request_id
         else:
-            print(f"!!! Request ID NOT FOUND for Message ID {message_id} !!!")
-            # Check if the view still has items; if not, the message might have been processed already.
-            if not self.children:
-                 await interaction.edit_original_response(content="This request has already been processed.", view=None)
-            else:
-                 await interaction.edit_original_response(content="Could not find the original request associated with this message. It might be too old or already processed.", view=None)
+            log.warning("Request ID not found for Message ID %s", message_id)
+            await interaction.edit_original_response(content="Could not find the original request associated with this message. It might be too old or already processed.", view=None)
 
 
-    # MODIFIED: Use fixed custom_id, retrieve request_id from mapping
+    # MODIFIED: Use fixed custom_id, retrieve request_id from the approval queue
     @discord.ui.button(label="Reject", style=discord.ButtonStyle.danger, custom_id="reject_request")
     async def reject_button_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer() # Defer immediately
         message_id = interaction.message.id
-        request_id = approval_message_to_request.get(message_id)
+        request_id = await run_db_read(get_request_id_for_message, message_id)
 
-        print(f"--- Reject Button Clicked (Callback) ---")
-        print(f"Interaction Custom ID: {interaction.data['custom_id']}") # Should be 'reject_request'
-        print(f"Message ID: {message_id}")
+        log.debug("Reject button clicked: custom_id=%s message=%s", interaction.data['custom_id'], message_id)
 
         if request_id:
-            print(f"Found Request ID '{request_id}' for Message ID {message_id}")
+            log.debug("Found Request ID '%s' for Message ID %s", request_id, message_id)
             await self.handle_rejection(interaction, request_id) # Pass request_id
         else:
-            print(f"!!! Request ID NOT FOUND for Message ID {message_id} !!!")
-            # Check if the view still has items; if not, the message might have been processed already.
-            if not self.children:
-                 await interaction.edit_original_response(content="This request has already been processed.", view=None)
+            log.warning("Request ID not found for Message ID %s", message_id)
+            await interaction.edit_original_response(content="Could not find the original request associated with this message. It might be too old or already processed.", view=None)
+
+
+# --- Bulk review of pending requests ---
+def _user_notification(request, approved, error=None):
+    # Same wording as the single-request Approve/Reject handlers
+    name = request.get('name', 'default')
+    request_type = request['type']
+    if not approved:
+        return f"Your request to {request_type} persona '{name}' has been rejected by the admin."
+    if error:
+        if request_type == 'create' and 'already exists' in error:
+            return f"Your request to create persona '{name}' could not be approved because a persona with that name already exists."
+        if request_type == 'modify' and 'not found' in error:
+            return f"Your request to modify persona '{name}' could not be approved because the persona no longer exists."
+        return f"An error occurred while processing the approval for your {request_type} request for persona '{name}'."
+    if request_type == 'append':
+        return "Your request to append to the default system message has been approved by the admin."
+    return f"Your request to {request_type} persona '{name}' has been approved by the admin."
+
+async def _notify_users(results, approved):
+    """DM every requester concurrently, with at most NOTIFY_CONCURRENCY sends in flight."""
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+
+    async def notify(request, error):
+        async with semaphore:
+            try:
+                channel = await user_cache.get_dm_channel(request['user_id'])
+                await channel.send(_user_notification(request, approved, error))
+            except (discord.Forbidden, discord.NotFound):
+                log.info("Could not DM user %s", request['user_id'])
+            except Exception as e:
+                user_cache.invalidate(request['user_id'])
+                log.error("Error notifying user %s: %s", request['user_id'], e)
+
+    await asyncio.gather(*(notify(request, error) for request, error in results))
+
+class ReviewPendingSelect(discord.ui.Select):
+    def __init__(self, requests):
+        options = []
+        for request in requests:
+            if request['type'] == 'append':
+                label = "append to default"
+                preview = request.get('text_to_append', '')
             else:
-                 await interaction.edit_original_response(content="Could not find the original request associated with this message. It might be too old or already processed.", view=None)
+                label = f"{request['type']} '{request.get('name', '')}'"
+                preview = request.get('content', '')
+            options.append(discord.SelectOption(
+                label=label[:100],
+                value=request['request_id'],
+                description=f"User {request['user_id']}: {preview}"[:100],
+            ))
+        super().__init__(placeholder="Select requests...", min_values=1, max_values=len(options), options=options)
+
+    async def callback(self, interaction: discord.Interaction):
+        # Just remember the selection; the Approve/Reject buttons act on it
+        self.view.selected = list(self.values)
+        await interaction.response.defer()
 
+class ReviewPendingView(discord.ui.View):
+    # Offset paging is fine here: the queue is small and expires on its own
+    def __init__(self):
+        super().__init__(timeout=600)
+        self.offset = 0
+        self.requests = []
+        self.total = 0
+        self.selected = []
+        self.last_summary = ""
+
+    async def load(self):
+        self.total = await run_db_read(count_approval_requests)
+        if self.offset >= self.total:
+            self.offset = max(0, (self.total - 1) // REVIEW_PAGE_SIZE * REVIEW_PAGE_SIZE)
+        self.requests = await run_db_read(list_approval_requests, self.offset, REVIEW_PAGE_SIZE)
+        self.selected = []
+        self.update_items()
+
+    def update_items(self):
+        self.clear_items()
+        if self.requests:
+            self.add_item(ReviewPendingSelect(self.requests))
+            self.add_item(ReviewActionButton(approve=True))
+            self.add_item(ReviewActionButton(approve=False))
+        if self.offset > 0:
+            self.add_item(ReviewPageButton(-1))
+        if self.offset + REVIEW_PAGE_SIZE < self.total:
+            self.add_item(ReviewPageButton(1))
+
+    def get_content(self):
+        lines = []
+        if self.last_summary:
+            lines.append(self.last_summary)
+        if not self.requests:
+            lines.append("No pending requests.")
+            return "\n".join(lines)
+        page_count = (self.total + REVIEW_PAGE_SIZE - 1) // REVIEW_PAGE_SIZE
+        lines.append(f"**Pending Requests** ({self.total}) - Page {self.offset // REVIEW_PAGE_SIZE + 1}/{page_count}")
+        for i, request in enumerate(self.requests, start=self.offset + 1):
+            if request['type'] == 'append':
+                preview = request.get('text_to_append', '')
+                lines.append(f"{i}. append by <@{request['user_id']}>: {preview[:80]}{'...' if len(preview) > 80 else ''}")
+            else:
+                preview = request.get('content', '')
+                lines.append(f"{i}. {request['type']} '{request.get('name', '')}' by <@{request['user_id']}>: {preview[:80]}{'...' if len(preview) > 80 else ''}")
+        return "\n".join(lines)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return is_admin(interaction.user)
+
+class ReviewPageButton(discord.ui.Button):
+    def __init__(self, direction):
+        super().__init__(label="Previous" if direction < 0 else "Next", style=discord.ButtonStyle.primary, row=2)
+        self.direction = direction
+
+    async def callback(self, interaction: discord.Interaction):
+        view: ReviewPendingView = self.view
+        view.offset = max(0, view.offset + self.direction * REVIEW_PAGE_SIZE)
+        view.last_summary = ""
+        await view.load()
+        await interaction.response.edit_message(content=view.get_content(), view=view)
+
+class ReviewActionButton(discord.ui.Button):
+    def __init__(self, approve):
+        super().__init__(
+            label="Approve selected" if approve else "Reject selected",
+            style=discord.ButtonStyle.success if approve else discord.ButtonStyle.danger,
+            row=1,
+        )
+        self.approve = approve
+
+    async def callback(self, interaction: discord.Interaction):
+        view: ReviewPendingView = self.view
+        if not view.selected:
+            await interaction.response.send_message("Select at least one request first.", ephemeral=True)
+            return
+        await interaction.response.defer()
+
+        # Every selected request is claimed (and applied) in one transaction on the DB thread
+        results = await run_db(apply_approval_batch, view.selected, self.approve)
+        failed = [(request, error) for request, error in results if error]
+        action = "Approved" if self.approve else "Rejected"
+        summary = f"{'✅' if self.approve else '❌'} {action} {len(results) - len(failed)} request(s)."
+        if failed:
+            summary += f" ⚠️ {len(failed)} failed: " + "; ".join(error for _, error in failed[:5])
+        skipped = len(view.selected) - len(results)
+        if skipped:
+            summary += f" {skipped} were already processed."
+        log.info("Bulk review: %s", summary)
+
+        view.last_summary = summary
+        await view.load()
+        await interaction.edit_original_response(content=view.get_content(), view=view)
+        await _notify_users(results, self.approve)
+
+async def _approvals_configured(interaction: discord.Interaction) -> bool:
+    """Return True if an admin is configured to approve requests; otherwise tell the user."""
+    if ADMIN_USER_ID:
+        return True
+    log.warning("Approval request from %s rejected: ADMIN_USER_ID is not set.", interaction.user.id)
+    await interaction.response.send_message("Error: No admin is configured to approve requests.", ephemeral=True)
+    return False
 
 # --- Slash Commands for Persona Management ---
 
+async def persona_name_autocomplete(interaction: discord.Interaction, current: str):
+    # Served from the in-memory name index; never touches the database
+    return [app_commands.Choice(name=name, value=name) for name in persona_names.search(current)]
+
 async def setup_persona_commands(tree, client): # Added client parameter
     global discord_client
     discord_client = client # Store client instance globally within the module
 
     @tree.command(name="create-type", description="Create a new system message persona type.")
     @app_commands.describe(name="The unique name for this persona type.", content="The system message content for the persona.")
+    @timed_command("create-type")
     async def create_type(interaction: discord.Interaction, name: str, content: str):
         # Check if user is admin
-        if interaction.user.id == ADMIN_USER_ID:
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
+        if is_admin(interaction.user):
             try:
-                cursor.execute(
-                    "INSERT INTO personas (name, content, creator_id, is_default) VALUES (?, ?, ?, ?)",
-                    (name, content, interaction.user.id, 0) # Creator is the admin
-                )
-                conn.commit()
+                await run_db(create_persona, name, content, interaction.user.id) # Creator is the admin
                 await interaction.response.send_message(f"Persona type '{name}' created successfully.", ephemeral=True)
             except sqlite3.IntegrityError:
                 await interaction.response.send_message(f"Error: A persona type named '{name}' already exists.", ephemeral=True)
             except Exception as e:
                 await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
-            finally:
-                conn.close()
         else:
             # Non-admin user: Send for approval
+            if not await _approvals_configured(interaction):
+                return
             request_id = str(uuid.uuid4())
-            pending_persona_requests[request_id] = {
-                'type': 'create',
-                'user_id': interaction.user.id,
-                'name': name,
-                'content': content,
-                'original_interaction': interaction # Store for potential future use (e.g., followup)
-            }
+            await run_db(add_approval_request, request_id, 'create', interaction.user.id, name=name, content=content)
 
             try:
-                admin_user = await discord_client.fetch_user(ADMIN_USER_ID)
-                if not admin_user:
+                admin_channel = await user_cache.get_dm_channel(ADMIN_USER_ID) # Cached; REST only on a miss
+                if not admin_channel:
                     await interaction.response.send_message("Error: Could not find the admin user to send approval request.", ephemeral=True)
-                    del pending_persona_requests[request_id] # Clean up failed request
+                    await run_db(remove_approval_request, request_id) # Clean up failed request
                     return
 
-                # Use the view without passing request_id
-                approval_view = ApprovalView()
                 # Send the message and get the message object
-                sent_message = await admin_user.send(
+                sent_message = await admin_channel.send(
                     f"**Persona Creation Request**\n"
                     f"User: {interaction.user.mention} ({interaction.user.id})\n"
                     f"Requested Name: `{name}`\n"
                     f"Content:\n```\n{content[:1500]}{'...' if len(content) > 1500 else ''}\n```",
-                    view=approval_view
+                    view=_approval_buttons()
                 )
                 # Store the mapping
-                approval_message_to_request[sent_message.id] = request_id
-                print(f"Stored mapping: Message ID {sent_message.id} -> Request ID {request_id}")
+                await run_db(set_approval_message, request_id, sent_message.id)
+                log.debug("Stored mapping: Message ID %s -> Request ID %s", sent_message.id, request_id)
 
                 await interaction.response.send_message(f"Your request to create persona '{name}' has been sent to the admin for approval.", ephemeral=True)
             except discord.Forbidden:
                  await interaction.response.send_message("Error: Could not DM the admin for approval. Please contact them directly.", ephemeral=True)
-                 del pending_persona_requests[request_id] # Clean up failed request
+                 await run_db(remove_approval_request, request_id) # Clean up failed request
             except Exception as e:
+                if ADMIN_USER_ID: # The cached admin DM channel may be stale
+                    user_cache.invalidate(ADMIN_USER_ID)
                 await interaction.response.send_message(f"An error occurred while sending the approval request: {e}", ephemeral=True)
-                print(f"Error sending approval DM: {e}")
-                if request_id in pending_persona_requests:
-                    del pending_persona_requests[request_id]
+                log.error("Error sending approval DM: %s", e)
+                await run_db(remove_approval_request, request_id)
 
 
     @tree.command(name="modify-type", description="Modify an existing system message persona type.")
     @app_commands.describe(name="The name of the persona type to modify.", new_content="The new system message content.")
+    @app_commands.autocomplete(name=persona_name_autocomplete)
+    @timed_command("modify-type")
     async def modify_type(interaction: discord.Interaction, name: str, new_content: str):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT creator_id FROM personas WHERE name = ?", (name,))
-            result = cursor.fetchone()
+            result = await run_db_read(get_persona_meta, name)
             if not result:
                 await interaction.response.send_message(f"Error: Persona type '{name}' not found.", ephemeral=True)
                 return
@@ -406,63 +569,56 @@ async def setup_persona_commands(tree, client): # Added client parameter
             creator_id = result[0]
             # Check if user is admin OR the original creator
             if is_admin_or_creator(interaction, creator_id):
-                cursor.execute("UPDATE personas SET content = ? WHERE name = ?", (new_content, name))
-                conn.commit()
+                if not await run_db(update_persona_content, name, new_content, interaction.user.id):
+                    await interaction.response.send_message(f"Error: Persona type '{name}' not found.", ephemeral=True)
+                    return
                 await interaction.response.send_message(f"Persona type '{name}' updated successfully.", ephemeral=True)
             else:
                 # Non-admin/creator user: Send for approval
+                if not await _approvals_configured(interaction):
+                    return
                 request_id = str(uuid.uuid4())
-                pending_persona_requests[request_id] = {
-                    'type': 'modify',
-                    'user_id': interaction.user.id,
-                    'name': name,
-                    'content': new_content, # Store the *new* content
-                    'original_interaction': interaction
-                }
+                await run_db(add_approval_request, request_id, 'modify', interaction.user.id, name=name, content=new_content) # Store the *new* content
 
                 try:
-                    admin_user = await discord_client.fetch_user(ADMIN_USER_ID)
-                    if not admin_user:
+                    admin_channel = await user_cache.get_dm_channel(ADMIN_USER_ID) # Cached; REST only on a miss
+                    if not admin_channel:
                         await interaction.response.send_message("Error: Could not find the admin user to send approval request.", ephemeral=True)
-                        del pending_persona_requests[request_id]
+                        await run_db(remove_approval_request, request_id)
                         return
 
-                    # Use the view without passing request_id
-                    approval_view = ApprovalView()
-                    sent_message = await admin_user.send(
+                    sent_message = await admin_channel.send(
                         f"**Persona Modification Request**\n"
                         f"User: {interaction.user.mention} ({interaction.user.id})\n"
                         f"Persona Name: `{name}`\n"
                         f"New Content:\n```\n{new_content[:1500]}{'...' if len(new_content) > 1500 else ''}\n```",
-                        view=approval_view
+                        view=_approval_buttons()
                     )
                     # Store the mapping
-                    approval_message_to_request[sent_message.id] = request_id
-                    print(f"Stored mapping: Message ID {sent_message.id} -> Request ID {request_id}")
+                    await run_db(set_approval_message, request_id, sent_message.id)
+                    log.debug("Stored mapping: Message ID %s -> Request ID %s", sent_message.id, request_id)
 
                     await interaction.response.send_message(f"Your request to modify persona '{name}' has been sent to the admin for approval.", ephemeral=True)
                 except discord.Forbidden:
                     await interaction.response.send_message("Error: Could not DM the admin for approval. Please contact them directly.", ephemeral=True)
-                    del pending_persona_requests[request_id]
+                    await run_db(remove_approval_request, request_id)
                 except Exception as e:
+                    if ADMIN_USER_ID:
+                        user_cache.invalidate(ADMIN_USER_ID)
                     await interaction.response.send_message(f"An error occurred while sending the approval request: {e}", ephemeral=True)
-                    print(f"Error sending approval DM: {e}")
-                    if request_id in pending_persona_requests:
-                        del pending_persona_requests[request_id]
+                    log.error("Error sending approval DM: %s", e)
+                    await run_db(remove_approval_request, request_id)
 
         except Exception as e:
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
-        finally:
-            conn.close()
 
     @tree.command(name="delete-type", description="Delete a system message persona type.")
     @app_commands.describe(name="The name of the persona type to delete.")
+    @app_commands.autocomplete(name=persona_name_autocomplete)
+    @timed_command("delete-type")
     async def delete_type(interaction: discord.Interaction, name: str):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT creator_id, is_default FROM personas WHERE name = ?", (name,))
-            result = cursor.fetchone()
+            result = await run_db_read(get_persona_meta, name)
             if not result:
                 await interaction.response.send_message(f"Error: Persona type '{name}' not found.", ephemeral=True)
                 return
@@ -476,66 +632,44 @@ async def setup_persona_commands(tree, client): # Added client parameter
                 await interaction.response.send_message("Error: Cannot delete the default persona type. Change the default first.", ephemeral=True)
                 return
 
-            cursor.execute("DELETE FROM personas WHERE name = ?", (name,))
-            conn.commit()
+            await run_db(delete_persona, name)
             await interaction.response.send_message(f"Persona type '{name}' deleted successfully.", ephemeral=True)
 
         except Exception as e:
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
-        finally:
-            conn.close()
 
     @tree.command(name="change-default-type", description="Change the default system message persona type.")
     @app_commands.describe(name="The name of the persona type to set as default.")
+    @app_commands.autocomplete(name=persona_name_autocomplete)
+    @timed_command("change-default-type")
     async def change_default_type(interaction: discord.Interaction, name: str):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
         try:
-            cursor.execute("SELECT content FROM personas WHERE name = ?", (name,))
-            result = cursor.fetchone()
-            if not result:
+            if not await run_db(set_default_persona, name):
                 await interaction.response.send_message(f"Error: Persona type '{name}' not found.", ephemeral=True)
                 return
 
-            cursor.execute("UPDATE personas SET is_default = 0 WHERE is_default = 1")
-            cursor.execute("UPDATE personas SET is_default = 1 WHERE name = ?", (name,))
-            conn.commit()
-            print(f"Default persona changed to '{name}' in database.")
+            log.info("Default persona changed to '%s' in database.", name)
             await interaction.response.send_message(f"Default persona type changed to '{name}'.", ephemeral=False)
 
         except Exception as e:
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
-            print(f"Error changing default persona: {e}")
-        finally:
-            conn.close()
+            log.error("Error changing default persona: %s", e)
 
     @tree.command(name="list-personas", description="List all available personas")
     @app_commands.describe(search="Optional search term to filter personas")
+    @timed_command("list-personas")
     async def list_personas(interaction: discord.Interaction, search: str = None):
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
         try:
-            if (search):
-                cursor.execute(
-                    "SELECT name, is_default, creator_id FROM personas WHERE name LIKE ? ORDER BY is_default DESC, name ASC",
-                    (f"%{search}%",)
-                )
-            else:
-                cursor.execute(
-                    "SELECT name, is_default, creator_id FROM personas ORDER BY is_default DESC, name ASC"
-                )
-            
-            personas = cursor.fetchall()
-            
-            if not personas:
+            # Create the view instance - it loads only the first page; buttons are handled by the class itself
+            view = await PersonaListView.open(search)
+
+            if view is None:
                 msg = "No personas found."
                 if search:
                     msg += f" (Search: '{search}')"
                 await interaction.response.send_message(msg, ephemeral=True)
                 return
 
-            # Create the view instance - buttons are now handled by the class itself
-            view = PersonaListView(personas, search=search)
             await interaction.response.send_message(
                 content=view.get_current_page_content(),
                 view=view
@@ -547,65 +681,68 @@ async def setup_persona_commands(tree, client): # Added client parameter
 
         except Exception as e:
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
-            print(f"Error listing personas: {e}")
-        finally:
-            conn.close()
+            log.error("Error listing personas: %s", e)
 
     @tree.command(name="append-system-message", description="Append text to the default system message.")
     @app_commands.describe(text_to_append="Text to append to the default system message.")
+    @timed_command("append-system-message")
     async def append_system_message(interaction: discord.Interaction, text_to_append: str):
+        if not await _approvals_configured(interaction):
+            return
         request_id = str(uuid.uuid4())
-        pending_persona_requests[request_id] = {
-            'type': 'append',
-            'user_id': interaction.user.id,
-            'text_to_append': text_to_append,
-            'original_interaction': interaction
-        }
+        await run_db(add_approval_request, request_id, 'append', interaction.user.id, text_to_append=text_to_append)
         try:
-            admin_user = await discord_client.fetch_user(ADMIN_USER_ID)
-            if not admin_user:
+            admin_channel = await user_cache.get_dm_channel(ADMIN_USER_ID) # Cached; REST only on a miss
+            if not admin_channel:
                 await interaction.response.send_message("Error: Admin user not found.", ephemeral=True)
-                del pending_persona_requests[request_id]
+                await run_db(remove_approval_request, request_id)
                 return
-            # Use the view without passing request_id
-            approval_view = ApprovalView()
-            sent_message = await admin_user.send(
+            sent_message = await admin_channel.send(
                 f"**System Message Append Request**\n"
                 f"User: {interaction.user.mention} ({interaction.user.id})\n"
                 f"Text to Append:\n```\n{text_to_append[:1500]}{'...' if len(text_to_append) > 1500 else ''}\n```",
-                view=approval_view
+                view=_approval_buttons()
             )
             # Store the mapping
-            approval_message_to_request[sent_message.id] = request_id
-            print(f"Stored mapping: Message ID {sent_message.id} -> Request ID {request_id}")
+            await run_db(set_approval_message, request_id, sent_message.id)
+            log.debug("Stored mapping: Message ID %s -> Request ID %s", sent_message.id, request_id)
 
             await interaction.response.send_message("Your request to append to the default system message has been sent for admin approval.", ephemeral=True)
         except discord.Forbidden:
             await interaction.response.send_message("Error: Could not DM the admin.", ephemeral=True)
-            del pending_persona_requests[request_id]
+            await run_db(remove_approval_request, request_id)
         except Exception as e:
+            if ADMIN_USER_ID:
+                user_cache.invalidate(ADMIN_USER_ID)
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
-            if request_id in pending_persona_requests:
-                del pending_persona_requests[request_id]
+            await run_db(remove_approval_request, request_id)
 
-    @tree.command(name="undo-append", description="Undo the last append operation on the default system message (Admin only).")
-    async def undo_append(interaction: discord.Interaction):
-        if interaction.user.id != ADMIN_USER_ID:
-            await interaction.response.send_message("Error: Only the admin can perform undo.", ephemeral=True)
+    @tree.command(name="review-pending", description="Review pending persona requests in bulk (Admin only).")
+    @timed_command("review-pending")
+    async def review_pending(interaction: discord.Interaction):
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("Error: Only the admin can review pending requests.", ephemeral=True)
             return
-        from shared import get_last_original_content, clear_last_original_content
-        original_content = get_last_original_content()
-        if original_content is None:
-            await interaction.response.send_message("There is no append operation to undo.", ephemeral=True)
+        try:
+            view = ReviewPendingView()
+            await view.load()
+            await interaction.response.send_message(content=view.get_content(), view=view, ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
+            log.error("Error reviewing pending requests: %s", e)
+
+    @tree.command(name="undo-append", description="Revert the last changes to the default system message (Admin only).")
+    @app_commands.describe(steps="How many changes to undo (default 1).")
+    @timed_command("undo-append")
+    async def undo_append(interaction: discord.Interaction, steps: app_commands.Range[int, 1, 1000] = 1):
+        if not is_admin(interaction.user):
+            await interaction.response.send_message("Error: Only the admin can perform undo.", ephemeral=True)
             return
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
         try:
-            cursor.execute("UPDATE personas SET content = ? WHERE is_default = 1", (original_content,))
-            conn.commit()
-            clear_last_original_content()
-            await interaction.response.send_message("Successfully reverted the default system message to the state before the last append.", ephemeral=False)
+            version = await run_db(revert_default_persona, steps, interaction.user.id)
+            if version is None:
+                await interaction.response.send_message(f"The default system message doesn't have {steps} change(s) to undo.", ephemeral=True)
+                return
+            await interaction.response.send_message(f"Successfully reverted the last {steps} change(s) to the default system message (now version {version}).", ephemeral=False)
         except Exception as e:
             await interaction.response.send_message(f"An error occurred while undoing the append: {e}", ephemeral=True)
-        finally:
-            conn.close()
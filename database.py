@@ -0,0 +1,260 @@
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+DB_FILE = "personas.db"
+DB_READ_THREADS = int(os.getenv('DB_READ_THREADS', '2'))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5')) # Seconds to wait for another process's write lock
+
+# Writes are funnelled through a single thread so they never contend with each other, while
+# reads get a small pool of their own. With WAL enabled, readers are not blocked by the writer.
+# Neither pool runs on the discord.py event loop (heartbeats, other in-flight replies).
+_db_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+_db_read_executor = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="db-read")
+
+# Each thread keeps one long-lived connection, so the pool size is the number of DB threads
+# (plus the main thread during startup). Connections are never closed per operation.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+def _open_connection():
+    # sqlite3 keeps a per-connection LRU of compiled statements; with long-lived connections
+    # every hot query is prepared once and reused.
+    # Several shard processes may share the file; WAL lets their readers run alongside one
+    # writer and the busy timeout makes writers queue for the lock instead of failing.
+    conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def connect():
+    """Return this thread's long-lived connection to the persona database. Do not close it."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database function on the DB write thread and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_write_executor, functools.partial(func, *args, **kwargs))
+
+async def run_db_read(func, *args, **kwargs):
+    """Run a read-only database function on the reader pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_read_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown_db():
+    """Wait for queued database work to finish, stop the DB threads and close all connections."""
+    _db_write_executor.shutdown(wait=True)
+    _db_read_executor.shutdown(wait=True)
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass # Closing from another thread; the process is exiting anyway
+        _connections.clear()
+
+# --- Schema migrations ---
+# Each migration runs once, in order, inside a transaction. PRAGMA user_version records how many
+# have been applied. Append new migrations to the end of MIGRATIONS; never reorder or edit old ones.
+
+def _migration_create_personas(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS personas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            content TEXT NOT NULL,
+            creator_id INTEGER NOT NULL,
+            is_default BOOLEAN DEFAULT 0,
+            original_content_before_last_append TEXT DEFAULT NULL
+        )
+    ''')
+
+def _migration_add_undo_column(conn):
+    # Databases created before undo support lack this column
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(personas)")]
+    if "original_content_before_last_append" not in columns:
+        conn.execute("ALTER TABLE personas ADD COLUMN original_content_before_last_append TEXT DEFAULT NULL")
+        log.info("Added 'original_content_before_last_append' column to personas table.")
+
+def _migration_create_response_cache(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            generation_seconds REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)")
+
+def _migration_create_persona_search_index(conn):
+    # Keyset pagination walks personas in (is_default DESC, name) order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_personas_default_name ON personas (is_default DESC, name)")
+    try:
+        # Trigram tokenizer so MATCH handles the same substring searches LIKE '%term%' did
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS personas_fts USING fts5(name, content='personas', content_rowid='id', tokenize='trigram')")
+    except sqlite3.OperationalError as e:
+        log.warning("FTS5 trigram index unavailable, persona search will scan the table: %s", e)
+        return
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS personas_fts_insert AFTER INSERT ON personas BEGIN
+            INSERT INTO personas_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS personas_fts_delete AFTER DELETE ON personas BEGIN
+            INSERT INTO personas_fts (personas_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS personas_fts_update AFTER UPDATE OF name ON personas BEGIN
+            INSERT INTO personas_fts (personas_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO personas_fts (rowid, name) VALUES (new.id, new.name);
+        END
+    ''')
+    conn.execute("INSERT INTO personas_fts (personas_fts) VALUES ('rebuild')")
+
+def _migration_create_approval_requests(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS approval_requests (
+            request_id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT,
+            content TEXT,
+            text_to_append TEXT,
+            approval_message_id INTEGER,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_approval_requests_message ON approval_requests (approval_message_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_approval_requests_expires ON approval_requests (expires_at)")
+
+def _migration_track_persona_changes(conn):
+    # A counter bumped on every persona write, so processes sharing the database can tell
+    # when their in-memory persona caches are stale (see shared.sync_persona_cache)
+    conn.execute("CREATE TABLE IF NOT EXISTS persona_generation (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO persona_generation (id, generation) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS personas_generation_{event.lower()} AFTER {event} ON personas BEGIN
+                UPDATE persona_generation SET generation = generation + 1 WHERE id = 1;
+            END
+        ''')
+
+def _migration_create_bot_state(conn):
+    # Small key/value facts the bot remembers across restarts (e.g. the last synced command schema)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+def _migration_create_channel_summaries(conn):
+    # last_message_id is the newest message folded into the summary; newer ones are sent raw
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_summaries (
+            channel_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_create_memory_snippets(conn):
+    # Text for the vectors in MEMORY_DIR (memory.py): row_id is the vector's row in the channel's
+    # file for that embedding space
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS memory_snippets (
+            channel_id INTEGER NOT NULL,
+            space TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            author_name TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (channel_id, space, row_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_snippets_message ON memory_snippets (channel_id, message_id)")
+
+def _migration_create_persona_versions(conn):
+    # Content history per persona as compressed deltas with periodic snapshots (persona_versions.py).
+    # Existing personas start from a snapshot of their current content; a pending single-step undo
+    # becomes the version before it.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS persona_versions (
+            persona_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            parent INTEGER NOT NULL,
+            is_snapshot INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            user_id INTEGER,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (persona_id, version)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_persona_versions_snapshots ON persona_versions (persona_id, is_snapshot, version)")
+    now = time.time()
+    for persona_id, content, before_append in conn.execute("SELECT id, content, original_content_before_last_append FROM personas").fetchall():
+        rows = [("initial", content)] if before_append is None else [("initial", before_append), ("append", content)]
+        for version, (kind, text) in enumerate(rows, start=1):
+            conn.execute(
+                "INSERT INTO persona_versions (persona_id, version, kind, parent, is_snapshot, data, user_id, created_at) "
+                "VALUES (?, ?, ?, ?, 1, ?, NULL, ?)",
+                (persona_id, version, kind, version - 1, zlib.compress(text.encode("utf-8"), 9), now)
+            )
+
+MIGRATIONS = [
+    _migration_create_personas,
+    _migration_add_undo_column,
+    _migration_create_response_cache,
+    _migration_create_persona_search_index,
+    _migration_create_approval_requests,
+    _migration_track_persona_changes,
+    _migration_create_bot_state,
+    _migration_create_channel_summaries,
+    _migration_create_memory_snippets,
+    _migration_create_persona_versions,
+]
+
+def migrate(conn):
+    """Apply any migrations newer than the database's user_version.
+
+    Each migration takes the write lock before re-reading user_version, so shard processes
+    starting at the same time apply every migration exactly once.
+    """
+    while True:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return
+            migration = MIGRATIONS[version]
+            migration(conn)
+            # PRAGMA doesn't accept bound parameters; version is always an int
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+        log.info("Applied database migration %d: %s", version + 1, migration.__name__)
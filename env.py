@@ -0,0 +1,31 @@
+"""Parsers for the comma-separated lists used in environment settings.
+
+Blank entries and whitespace around entries are ignored, so "1, 2,," is the same as "1,2".
+Malformed entries raise ValueError at import time rather than being skipped.
+"""
+
+def _entries(raw: str):
+    return (part for part in (part.strip() for part in raw.split(",")) if part)
+
+def parse_id_set(raw: str) -> set:
+    """Parse "id,id,..." into a set of ints."""
+    return {int(entry) for entry in _entries(raw)}
+
+def parse_id_ranges(raw: str) -> list:
+    """Parse "0,1,4-7" into a sorted list of ints."""
+    ids = set()
+    for entry in _entries(raw):
+        if "-" in entry:
+            start, end = entry.split("-", 1)
+            ids.update(range(int(start), int(end) + 1))
+        else:
+            ids.add(int(entry))
+    return sorted(ids)
+
+def parse_id_map(raw: str, convert=int) -> dict:
+    """Parse "id:value,id:value" into {int(id): convert(value)}."""
+    settings = {}
+    for entry in _entries(raw):
+        key, _, value = entry.partition(":")
+        settings[int(key)] = convert(value.strip())
+    return settings
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+MODEL_NAME = "gemini-2.5-flash-preview-04-17"
+FALLBACK_MODEL_NAME = os.getenv('GEMINI_FALLBACK_MODEL', '') # Lighter model used while the circuit breaker is open; '' = fail fast
+MODEL_CACHE_SIZE = int(os.getenv('MODEL_CACHE_SIZE', '32'))
+
+generation_config = {
+  "temperature": 0.9,
+  "top_p": 1,
+  "top_k": 1,
+  "max_output_tokens": 2048,
+}
+
+# Default safety settings (the per-channel profiles below are what messages actually use)
+default_safety_settings = [
+  {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+  {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+  {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"}, # Base default
+  {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}, # Base default
+]
+
+# Built once; selected per message based on the channel's NSFW flag
+SAFETY_PROFILES = {
+    "nsfw": [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"}, # Less restrictive
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}, # Less restrictive
+    ],
+    "sfw": [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, # More restrictive
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, # More restrictive
+    ],
+}
+
+# --- SDK loading ---
+# google.generativeai takes around a second to import, so it is only loaded when the first model
+# is built (or when bot.py warms it in the background after connecting), not at startup.
+_api_key = None
+_genai = None
+_genai_lock = threading.Lock()
+
+def configure(api_key: str):
+    """Remember the API key to configure the SDK with once it is loaded."""
+    global _api_key
+    _api_key = api_key
+
+def load_sdk():
+    """Import and configure google.generativeai on first use. Safe to call from any thread."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=_api_key)
+                _genai = genai
+    return _genai
+
+def safety_profile_for(channel) -> str:
+    """Return the name of the safety profile to use for a channel."""
+    if hasattr(channel, "is_nsfw") and callable(channel.is_nsfw) and channel.is_nsfw():
+        return "nsfw"
+    return "sfw"
+
+# --- Model cache ---
+# GenerativeModel objects are immutable once configured, so one instance per
+# (persona content, safety profile, generation config) is shared by every message using it.
+# The lock matters because persona writes invalidate the cache from the DB thread.
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+_model_cache_stats = {"hits": 0, "misses": 0}
+
+def _config_key(config):
+    return tuple(sorted(config.items()))
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _cached_model(key):
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            _model_cache.move_to_end(key)
+            _model_cache_stats["hits"] += 1
+            return model
+        _model_cache_stats["misses"] += 1
+        return None
+
+def get_model(system_instruction: str, safety_profile: str, config=None, model_name=MODEL_NAME):
+    """Return a cached GenerativeModel for this persona and safety profile, building it on a miss."""
+    config = config or generation_config
+    key = (content_hash(system_instruction), safety_profile, _config_key(config), model_name)
+    return _cached_model(key) or _build_model(key, system_instruction, safety_profile, config, model_name)
+
+async def get_model_async(system_instruction: str, safety_profile: str, config=None, model_name=MODEL_NAME):
+    """Like get_model(), but a miss (which may have to import the SDK) is built on a worker thread."""
+    config = config or generation_config
+    key = (content_hash(system_instruction), safety_profile, _config_key(config), model_name)
+    return _cached_model(key) or await asyncio.to_thread(_build_model, key, system_instruction, safety_profile, config, model_name)
+
+def _build_model(key, system_instruction, safety_profile, config, model_name):
+    model = load_sdk().GenerativeModel(
+        model_name=model_name,
+        generation_config=config,
+        system_instruction=system_instruction,
+        safety_settings=SAFETY_PROFILES[safety_profile],
+    )
+    with _model_cache_lock:
+        _model_cache[key] = model
+        if len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return model
+
+def get_fallback_model(system_instruction: str, safety_profile: str):
+    """The same persona on FALLBACK_MODEL_NAME, or None when no fallback is configured."""
+    if not FALLBACK_MODEL_NAME:
+        return None
+    return get_model(system_instruction, safety_profile, model_name=FALLBACK_MODEL_NAME)
+
+def invalidate_model_cache():
+    """Drop all cached models. Called whenever a persona changes."""
+    with _model_cache_lock:
+        _model_cache.clear()
+
+def get_model_cache_stats() -> dict:
+    with _model_cache_lock:
+        return {**_model_cache_stats, "size": len(_model_cache)}
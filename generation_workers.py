@@ -0,0 +1,172 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from replies import prepare_chunks
+from resilience import CircuitOpen, GenerationTimeout, ResilientGenerator, ResilientModel
+
+log = logging.getLogger(__name__)
+
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '0')) # 0 = generate inside the gateway process
+GEMINI_FAKE_MODEL = os.getenv('GEMINI_FAKE_MODEL', '0') == '1' # Workers answer with benchmarks.fakes.FakeModel
+GEMINI_FAKE_LATENCY = float(os.getenv('GEMINI_FAKE_LATENCY', '0.5'))
+WORKER_RESTART_DELAY = 1.0 # Seconds before replacing a worker that exited
+_LINE_LIMIT = 16 * 1024 * 1024 # Jobs carry the whole prompt; allow long lines
+
+# The gateway process (bot.py) keeps the Discord connection, persona lookups, history and the
+# scheduler. Gemini calls and reply chunking run in GENERATION_WORKERS child processes, each with
+# its own event loop, fed with one JSON job per line on stdin and answering on stdout.
+
+class GenerationWorkerError(Exception):
+    """A worker failed the job, or exited before answering it."""
+
+# Errors re-raised as themselves in the gateway, so on_message can answer them specifically
+_PASSED_ERRORS = {"GenerationTimeout": GenerationTimeout, "CircuitOpen": CircuitOpen}
+
+class _WorkerProcess:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.pending = {} # job id -> future
+        self.reader_task = None
+
+class GenerationWorkerPool:
+    """Sends generation jobs to the least busy worker process and awaits their replies."""
+
+    def __init__(self, workers=GENERATION_WORKERS):
+        self.enabled = workers > 0
+        self._workers = [_WorkerProcess(index) for index in range(workers)]
+        self._job_ids = itertools.count(1)
+        self._started = False
+        self.stats = {"jobs": 0, "failed": 0, "restarts": 0}
+
+    async def start(self):
+        if self._started or not self.enabled:
+            return
+        self._started = True
+        for worker in self._workers:
+            await self._spawn(worker)
+        log.info("Started %d generation worker process(es).", len(self._workers))
+
+    async def _spawn(self, worker):
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "generation_workers",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, # stderr stays shared for logs
+            cwd=os.path.dirname(os.path.abspath(__file__)), limit=_LINE_LIMIT,
+        )
+        worker.reader_task = asyncio.create_task(self._read_results(worker))
+
+    async def _read_results(self, worker):
+        process = worker.process
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            result = json.loads(line)
+            future = worker.pending.pop(result["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in result:
+                error_class = _PASSED_ERRORS.get(result.get("error_type"), GenerationWorkerError)
+                future.set_exception(error_class(result["error"]))
+            else:
+                future.set_result((result["text"], result["chunks"], result["seconds"]))
+        # The worker exited: fail whatever it still owed us and replace it
+        await process.wait()
+        log.warning("Generation worker %d exited with code %s.", worker.index, process.returncode)
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(GenerationWorkerError("Generation worker exited before replying."))
+        worker.pending.clear()
+        self.stats["restarts"] += 1
+        await asyncio.sleep(WORKER_RESTART_DELAY)
+        await self._spawn(worker)
+
+    async def generate(self, system_instruction, safety_profile, content):
+        """Run one generation in a worker. Returns (text, reply chunks, generation seconds)."""
+        worker = min(self._workers, key=lambda worker: len(worker.pending))
+        job_id = next(self._job_ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[job_id] = future
+        self.stats["jobs"] += 1
+        job = {"id": job_id, "system_instruction": system_instruction, "safety_profile": safety_profile, "content": content}
+        try:
+            worker.process.stdin.write(json.dumps(job).encode("utf-8") + b"\n")
+            await worker.process.stdin.drain()
+            return await future
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            worker.pending.pop(job_id, None)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "workers": len(self._workers), "in_flight": sum(len(worker.pending) for worker in self._workers)}
+
+# --- Worker process side (python -m generation_workers) ---
+
+async def _handle_job(job, model_for, write_result):
+    try:
+        model = model_for(job["system_instruction"], job["safety_profile"])
+        started = time.perf_counter()
+        response = await model.generate_content_async(job["content"])
+        text = response.text
+        result = {"id": job["id"], "text": text, "chunks": prepare_chunks(text), "seconds": time.perf_counter() - started}
+    except Exception as e:
+        log.error("Generation worker error: %s", e)
+        result = {"id": job["id"], "error": str(e), "error_type": type(e).__name__}
+    await write_result(result)
+
+async def _serve(output):
+    generator = ResilientGenerator() # Each worker keeps its own retry stats, latencies and breaker
+    if GEMINI_FAKE_MODEL:
+        from benchmarks.fakes import FakeModel
+        fake_model = ResilientModel(generator, FakeModel(latency=GEMINI_FAKE_LATENCY))
+        model_for = lambda system_instruction, safety_profile: fake_model
+    else:
+        from gemini import configure, get_fallback_model, get_model, load_sdk
+        configure(os.getenv('GEMINI_API_KEY')) # Inherited from the gateway, which loaded .env
+        load_sdk() # Workers exist to generate; pay the import before the first job
+
+        def model_for(system_instruction, safety_profile):
+            return ResilientModel(generator, get_model(system_instruction, safety_profile),
+                                  lambda: get_fallback_model(system_instruction, safety_profile))
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=_LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    write_lock = asyncio.Lock()
+
+    async def write_result(result):
+        data = json.dumps(result).encode("utf-8") + b"\n"
+        async with write_lock:
+            await loop.run_in_executor(None, _write_line, output, data)
+
+    tasks = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break # The gateway closed our stdin (or exited)
+        task = asyncio.create_task(_handle_job(json.loads(line), model_for, write_result))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+def _write_line(output, data):
+    output.write(data)
+    output.flush()
+
+if __name__ == "__main__":
+    # stdout carries results; point fd 1 at stderr so print() anywhere can't corrupt the protocol
+    result_output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    from log import setup_logging
+    setup_logging(stream=sys.stderr)
+    try:
+        asyncio.run(_serve(result_output))
+    except KeyboardInterrupt:
+        pass # Ctrl+C reaches the whole process group; the gateway restarts or stops us
@@ -0,0 +1,146 @@
+import os
+import re
+from collections import OrderedDict, deque
+
+HISTORY_LIMIT = 10 # Messages of context sent with each reply
+HISTORY_BUFFER_SIZE = int(os.getenv('HISTORY_BUFFER_SIZE', '50')) # Messages kept per channel
+HISTORY_MAX_CHANNELS = int(os.getenv('HISTORY_MAX_CHANNELS', '500')) # Idle channels beyond this are evicted
+HISTORY_MAX_LINE_CHARS = 2000
+
+MENTION_RE = re.compile(r'<@!?\d+>')
+TYPE_ARG_RE = re.compile(r'-type\s+"[^"]+"', re.IGNORECASE)
+
+def clean_history_content(content: str) -> str:
+    """Strip mentions and -type arguments from a message so it can be used as history."""
+    cleaned = MENTION_RE.sub('', content).strip()
+    return TYPE_ARG_RE.sub('', cleaned).strip()
+
+class HistoryEntry:
+    __slots__ = ("message_id", "author_id", "author_name", "text")
+
+    def __init__(self, message_id, author_id, author_name, text):
+        self.message_id = message_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.text = text
+
+    def line(self, self_user_id) -> str:
+        author_name = "You" if self.author_id == self_user_id else self.author_name
+        return f"{author_name}: {self.text}"
+
+def _entry_from_message(msg):
+    # Use display_name which respects server nicknames
+    return HistoryEntry(msg.id, msg.author.id, msg.author.display_name, clean_history_content(msg.content)[:HISTORY_MAX_LINE_CHARS])
+
+class _ChannelBuffer:
+    __slots__ = ("entries", "warm")
+
+    def __init__(self):
+        self.entries = deque(maxlen=HISTORY_BUFFER_SIZE)
+        # A buffer is warm once it has been backfilled from REST; from then on gateway
+        # events alone keep it complete.
+        self.warm = False
+
+class ChannelHistoryCache:
+    """Per-channel ring buffers of cleaned history, fed by gateway events.
+
+    Messages are cleaned once when they arrive. Replies read from the buffer and only fall
+    back to a REST history fetch the first time a channel is seen (or after it was evicted).
+    """
+
+    def __init__(self, max_channels=HISTORY_MAX_CHANNELS):
+        self.max_channels = max_channels
+        self._channels = OrderedDict()
+        self.stats = {"hits": 0, "backfills": 0, "evictions": 0}
+
+    def _buffer(self, channel_id, create=True):
+        buffer = self._channels.get(channel_id)
+        if buffer is not None:
+            self._channels.move_to_end(channel_id)
+        elif create:
+            buffer = self._channels[channel_id] = _ChannelBuffer()
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False) # Least recently active channel
+                self.stats["evictions"] += 1
+        return buffer
+
+    def record(self, message):
+        """Add a newly created message (including the bot's own replies) to its channel's buffer."""
+        self._buffer(message.channel.id).entries.append(_entry_from_message(message))
+
+    def edit(self, channel_id, message_id, new_content):
+        buffer = self._buffer(channel_id, create=False)
+        if buffer is None:
+            return
+        for entry in buffer.entries:
+            if entry.message_id == message_id:
+                entry.text = clean_history_content(new_content)[:HISTORY_MAX_LINE_CHARS]
+                return
+
+    def delete(self, channel_id, message_ids):
+        buffer = self._buffer(channel_id, create=False)
+        if buffer is None:
+            return
+        message_ids = set(message_ids)
+        kept = [entry for entry in buffer.entries if entry.message_id not in message_ids]
+        if len(kept) != len(buffer.entries):
+            buffer.entries = deque(kept, maxlen=HISTORY_BUFFER_SIZE)
+
+    async def _backfill(self, channel, before, buffer):
+        fetched = [_entry_from_message(msg) async for msg in channel.history(limit=HISTORY_BUFFER_SIZE, before=before)]
+        # Merge with anything recorded from events while the channel was cold
+        merged = {entry.message_id: entry for entry in fetched}
+        for entry in buffer.entries:
+            merged[entry.message_id] = entry
+        buffer.entries = deque(sorted(merged.values(), key=lambda entry: entry.message_id), maxlen=HISTORY_BUFFER_SIZE)
+        buffer.warm = True
+        self.stats["backfills"] += 1
+
+    async def get_lines(self, message, self_user_id, limit=HISTORY_LIMIT, after_id=0):
+        """Return up to `limit` formatted history lines before `message` (and after `after_id`), oldest first."""
+        buffer = self._buffer(message.channel.id)
+        if buffer.warm:
+            self.stats["hits"] += 1
+        else:
+            await self._backfill(message.channel, message, buffer)
+        lines = []
+        seen = 0
+        for entry in reversed(buffer.entries):
+            if entry.message_id >= message.id: # Only messages *before* the current one
+                continue
+            if entry.message_id <= after_id: # Already covered by the channel summary
+                break
+            if entry.text: # Avoid empty history lines
+                lines.append(entry.line(self_user_id))
+            seen += 1
+            if seen >= limit:
+                break
+        lines.reverse() # Oldest first
+        return lines
+
+    def message_ids(self, channel_id) -> set:
+        """IDs of the messages currently buffered for a channel."""
+        buffer = self._buffer(channel_id, create=False)
+        return {entry.message_id for entry in buffer.entries} if buffer is not None else set()
+
+    def count_after(self, channel_id, after_id) -> int:
+        """Number of buffered messages newer than `after_id`."""
+        buffer = self._buffer(channel_id, create=False)
+        return sum(1 for entry in buffer.entries if entry.message_id > after_id) if buffer is not None else 0
+
+    def summary_lines(self, channel_id, self_user_id, after_id, keep_newest):
+        """Formatted lines for buffered messages newer than `after_id`, leaving out the newest `keep_newest`.
+
+        Returns (lines, ID of the newest message included), or ([], after_id) if there is nothing new.
+        """
+        buffer = self._buffer(channel_id, create=False)
+        if buffer is None:
+            return [], after_id
+        entries = [entry for entry in buffer.entries if entry.message_id > after_id]
+        entries = entries[:max(0, len(entries) - keep_newest)]
+        if not entries:
+            return [], after_id
+        return [entry.line(self_user_id) for entry in entries if entry.text], entries[-1].message_id
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "channels": len(self._channels)}
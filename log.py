@@ -0,0 +1,144 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from env import parse_id_map
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text') # "text" or "json"
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000')) # Records beyond this are dropped, never waited on
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0')) # Share of messages whose debug lines are kept
+LOG_DEBUG_CHANNEL_RATES = parse_id_map(os.getenv('LOG_DEBUG_CHANNEL_RATES', ''), float) # Per-channel overrides
+LOG_ERROR_BURST = int(os.getenv('LOG_ERROR_BURST', '10')) # Identical errors logged per interval before suppressing
+LOG_ERROR_INTERVAL = float(os.getenv('LOG_ERROR_INTERVAL', '60'))
+
+# Log calls only format the record and put it on a queue; a QueueListener thread does the actual
+# writing, so a slow stdout pipe can never stall the event loop. Pass channel_id/message_id via
+# `extra` on per-message debug lines so they can be sampled and show up as JSON fields.
+
+_EXTRA_FIELDS = ("channel_id", "message_id", "user_id", "request_id", "shard_id")
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in _EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class ChannelSampler(logging.Filter):
+    """Keep DEBUG lines for a sampled share of messages; other levels always pass.
+
+    The decision is made per message ID, so a sampled message keeps its whole trace.
+    """
+
+    def __init__(self, default_rate=LOG_DEBUG_SAMPLE_RATE, channel_rates=None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.channel_rates = LOG_DEBUG_CHANNEL_RATES if channel_rates is None else channel_rates
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self.channel_rates.get(getattr(record, "channel_id", None), self.default_rate)
+        if rate >= 1.0:
+            return True
+        message_id = getattr(record, "message_id", None)
+        if message_id is None:
+            return rate > 0
+        return (message_id >> 22) % 1000 < rate * 1000 # The timestamp part of the snowflake
+
+class ErrorRateLimiter(logging.Filter):
+    """Let at most `burst` identical ERROR records through per `interval`; report how many were dropped."""
+
+    def __init__(self, burst=LOG_ERROR_BURST, interval=LOG_ERROR_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {} # (logger, template) -> [window start, count, suppressed]
+        self._lock = threading.Lock() # DB threads log too
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if len(self._windows) > 1000:
+                    self._windows.clear() # Bound memory if messages aren't templated
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar suppressed)"
+                return True
+            window[1] += 1
+            if window[1] <= self.burst:
+                return True
+            window[2] += 1
+            return False
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Render the message and traceback now (the objects they refer to may change later), but
+        # leave the layout to the listener's formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass # Dropping a log line beats blocking the event loop
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Route all logging through a background writer thread. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+
+    handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ChannelSampler())
+    handler.addFilter(ErrorRateLimiter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    logging.getLogger("discord").setLevel(max(logging.INFO, root.level)) # discord.py's DEBUG is gateway traffic
+
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
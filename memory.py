@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from database import connect, run_db, run_db_read
+from history import HISTORY_MAX_LINE_CHARS, clean_history_content
+from prompt import estimate_tokens
+
+try:
+    import numpy as np
+except ImportError: # Optional: only needed with MEMORY_ENABLED=1
+    np = None
+
+log = logging.getLogger(__name__)
+
+MEMORY_ENABLED = os.getenv('MEMORY_ENABLED', '0') == '1'
+MEMORY_DIR = os.getenv('MEMORY_DIR', 'memory') # One vector file per channel; relative to the working directory like DB_FILE
+MEMORY_EMBEDDER = os.getenv('MEMORY_EMBEDDER', 'local') # "local" (offline feature hashing) or "gemini"
+MEMORY_DIM = int(os.getenv('MEMORY_DIM', '256')) # Local embedder only
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '3'))
+MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '300')) # Prompt tokens for recalled messages
+MEMORY_MIN_SCORE = float(os.getenv('MEMORY_MIN_SCORE', '0.3')) # Cosine similarity below this is not recalled
+MEMORY_MIN_CHARS = int(os.getenv('MEMORY_MIN_CHARS', '20')) # Shorter messages aren't worth indexing
+MEMORY_MAX_ROWS = int(os.getenv('MEMORY_MAX_ROWS', '50000')) # Per channel; the oldest vectors are overwritten after that
+MEMORY_MAX_CHANNELS = int(os.getenv('MEMORY_MAX_CHANNELS', '200')) # Vector files kept; the least recently written channel's memory is deleted past this
+MEMORY_OPEN_CHANNELS = 256 # Memory-mapped files kept open
+MEMORY_BATCH_SIZE = 32
+MEMORY_FLUSH_INTERVAL = 2.0 # Seconds a message may wait before it is embedded
+MEMORY_MAX_PENDING = 5000 # Messages waiting to be embedded beyond this are dropped
+MEMORY_SEARCH_THREADS = 2
+MEMORY_GEMINI_MODEL = "models/text-embedding-004"
+_INITIAL_ROWS = 64 # A new channel's file starts at 64 KiB (256 dims) and doubles as it fills
+
+# Messages the bot sees in channels it replies in are embedded in batches on a background thread
+# and appended to a per-channel float32 matrix memory-mapped from MEMORY_DIR; the text lives in
+# SQLite (memory_snippets), keyed by the vector's row. on_message embeds the new mention, scores it
+# against every row of the channel (brute-force cosine: the vectors are L2-normalized, so it is
+# one matrix-vector product) and adds the best matches to the prompt within MEMORY_TOKEN_BUDGET.
+# Disk use is bounded by MEMORY_MAX_CHANNELS files of at most MEMORY_MAX_ROWS rows each.
+
+_WORD_RE = re.compile(r"\w+")
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+class HashingEmbedder:
+    """Deterministic offline embedder: signed feature hashing of words and word pairs.
+
+    No network and no model, so it is what tests and benchmarks use; it matches on shared
+    vocabulary rather than meaning.
+    """
+    name = "hash"
+
+    def __init__(self, dim=MEMORY_DIM):
+        self.dim = dim
+
+    def embed(self, texts, query=False):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = zlib.crc32(feature.encode("utf-8")) # Stable across runs, unlike hash()
+                vectors[i, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        return _normalize(vectors)
+
+class GeminiEmbedder:
+    """Gemini text embeddings (one API call per batch)."""
+    name = "gemini"
+    dim = 768
+
+    def __init__(self, model=MEMORY_GEMINI_MODEL):
+        self.model = model
+
+    def embed(self, texts, query=False):
+        from gemini import load_sdk
+        result = load_sdk().embed_content(model=self.model, content=list(texts),
+                                          task_type="retrieval_query" if query else "retrieval_document")
+        return _normalize(np.asarray(result["embedding"], dtype=np.float32))
+
+EMBEDDERS = {"local": HashingEmbedder, "gemini": GeminiEmbedder}
+
+# --- SQLite side (blocking; called through run_db/run_db_read or from the memory thread) ---
+def _load_channel_state(channel_id, space):
+    """Return (rows in use, row of the newest vector) for a channel's vector file."""
+    row = connect().execute(
+        "SELECT MAX(row_id), (SELECT row_id FROM memory_snippets WHERE channel_id = ? AND space = ? ORDER BY created_at DESC LIMIT 1) "
+        "FROM memory_snippets WHERE channel_id = ? AND space = ?",
+        (channel_id, space, channel_id, space)
+    ).fetchone()
+    return (row[0] + 1 if row[0] is not None else 0), row[1]
+
+def _store_snippets(space, snippets):
+    conn = connect()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO memory_snippets (channel_id, space, row_id, message_id, author_id, author_name, text, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((channel_id, space, row_id, message_id, author_id, author_name, text, created_at)
+             for channel_id, row_id, message_id, author_id, author_name, text, created_at in snippets)
+        )
+
+def _load_snippets(channel_id, space, row_ids):
+    placeholders = ",".join("?" * len(row_ids))
+    rows = connect().execute(
+        f"SELECT row_id, message_id, author_id, author_name, text FROM memory_snippets "
+        f"WHERE channel_id = ? AND space = ? AND row_id IN ({placeholders})",
+        (channel_id, space, *row_ids)
+    ).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+def _delete_channels(space, channel_ids):
+    conn = connect()
+    with conn:
+        conn.executemany("DELETE FROM memory_snippets WHERE channel_id = ? AND space = ?",
+                         ((channel_id, space) for channel_id in channel_ids))
+
+def _delete_snippets(channel_id, message_ids):
+    conn = connect()
+    with conn:
+        conn.executemany("DELETE FROM memory_snippets WHERE channel_id = ? AND message_id = ?",
+                         ((channel_id, message_id) for message_id in message_ids))
+
+class _ChannelVectors:
+    """One channel's vectors: a float32 memmap, grown by doubling up to MEMORY_MAX_ROWS rows."""
+
+    def __init__(self, path, dim, count, newest_row, max_rows):
+        self.path = path
+        self.dim = dim
+        self.max_rows = max_rows
+        self.next_row = (newest_row + 1) % max_rows if newest_row is not None else 0
+        rows_on_disk = os.path.getsize(path) // (dim * 4) if os.path.exists(path) else 0
+        if rows_on_disk < max(count, 1):
+            self._resize(max(count, min(_INITIAL_ROWS, max_rows)))
+        else:
+            self.vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(rows_on_disk, dim))
+        self.view = (self.vectors, min(count, len(self.vectors))) # Swapped in whole, so searches see a consistent pair
+
+    def _resize(self, rows):
+        with open(self.path, "ab") as f:
+            f.truncate(rows * self.dim * 4) # Zero-filled; the new rows are past `count` until written
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def append(self, vectors):
+        """Write vectors at the next rows (wrapping over the oldest when full). Returns their row IDs."""
+        rows = []
+        count = self.view[1]
+        for vector in vectors:
+            row = self.next_row
+            if row >= len(self.vectors):
+                self._resize(min(self.max_rows, len(self.vectors) * 2))
+            self.vectors[row] = vector
+            rows.append(row)
+            count = max(count, row + 1)
+            self.next_row = (row + 1) % self.max_rows
+        self.vectors.flush()
+        self.view = (self.vectors, count)
+        return rows
+
+    def search(self, query, k):
+        """Return up to k (row, cosine score) pairs, best first."""
+        vectors, count = self.view
+        if count == 0:
+            return []
+        scores = vectors[:count] @ query
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+class MemoryIndex:
+    """Per-channel vector memory of past messages, searched for snippets relevant to a new mention."""
+
+    def __init__(self, enabled=MEMORY_ENABLED, embedder=None, directory=MEMORY_DIR, max_rows=MEMORY_MAX_ROWS,
+                 max_channels=MEMORY_MAX_CHANNELS):
+        if enabled and np is None:
+            log.warning("MEMORY_ENABLED is set but numpy is not installed; message memory is disabled.")
+            enabled = False
+        self.enabled = enabled
+        self.embedder = embedder or (EMBEDDERS[MEMORY_EMBEDDER]() if enabled else None)
+        self.space = f"{self.embedder.name}{self.embedder.dim}" if self.embedder else None # Vectors from different embedders never mix
+        self.directory = directory
+        self.max_rows = max_rows
+        self.max_channels = max_channels
+        self._replied = OrderedDict() # Channels the bot replied in, least recent first; only these are indexed
+        self._files = None # channel_id -> None for every vector file, least recently written first (memory thread only)
+        self._channels = OrderedDict() # channel_id -> _ChannelVectors, least recently used first
+        self._channels_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory") # The only writer of vector files
+        self._search_executor = ThreadPoolExecutor(max_workers=MEMORY_SEARCH_THREADS, thread_name_prefix="memory-search")
+        self._pending = [] # (channel_id, message_id, author_id, author_name, text, created_at)
+        self._wake = asyncio.Event()
+        self._flusher = None
+        self.stats = {"indexed": 0, "dropped": 0, "searches": 0, "recalled": 0}
+
+    def _path(self, channel_id):
+        return os.path.join(self.directory, f"{channel_id}.{self.space}.f32")
+
+    def _channel(self, channel_id, state=None, create=True):
+        """Return the open vectors of a channel, opening its file on a miss.
+
+        `state` is the channel's _load_channel_state() result when the caller already read it;
+        otherwise it is read on this thread. With create=False, returns None instead of creating
+        a missing file.
+        """
+        with self._channels_lock:
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                if not create and (state is None or not os.path.exists(self._path(channel_id))):
+                    return None
+                os.makedirs(self.directory, exist_ok=True)
+                count, newest_row = state or _load_channel_state(channel_id, self.space)
+                channel = self._channels[channel_id] = _ChannelVectors(self._path(channel_id), self.embedder.dim, count, newest_row, self.max_rows)
+                if len(self._channels) > MEMORY_OPEN_CHANNELS:
+                    self._channels.popitem(last=False) # Unmapped once no search still holds it
+            else:
+                self._channels.move_to_end(channel_id)
+            return channel
+
+    def note_reply(self, channel_id):
+        """Start (or keep) indexing a channel because the bot is replying in it."""
+        if not self.enabled:
+            return
+        self._replied[channel_id] = None
+        self._replied.move_to_end(channel_id)
+        if len(self._replied) > self.max_channels:
+            self._replied.popitem(last=False) # Its file stays until the memory thread needs the slot
+
+    def add(self, message):
+        """Queue a message for embedding; it becomes searchable within MEMORY_FLUSH_INTERVAL.
+
+        Only messages in channels passed to note_reply() are indexed.
+        """
+        if not self.enabled or message.channel.id not in self._replied:
+            return
+        text = clean_history_content(message.content)[:HISTORY_MAX_LINE_CHARS]
+        if len(text) < MEMORY_MIN_CHARS:
+            return
+        if len(self._pending) >= MEMORY_MAX_PENDING:
+            self.stats["dropped"] += 1
+            return
+        self._pending.append((message.channel.id, message.id, message.author.id, message.author.display_name, text, time.time()))
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._run_flusher())
+        if len(self._pending) >= MEMORY_BATCH_SIZE:
+            self._wake.set()
+
+    async def _run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), MEMORY_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._pending:
+                await self.flush()
+
+    async def flush(self):
+        """Embed and store up to one batch of queued messages."""
+        batch, self._pending = self._pending[:MEMORY_BATCH_SIZE], self._pending[MEMORY_BATCH_SIZE:]
+        if not batch:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            snippets, evicted = await loop.run_in_executor(self._executor, self._index_batch, batch)
+            if evicted:
+                await run_db(_delete_channels, self.space, evicted)
+                log.info("Deleted the memory of %d channel(s) to stay within MEMORY_MAX_CHANNELS.", len(evicted))
+            await run_db(_store_snippets, self.space, snippets)
+            self.stats["indexed"] += len(snippets)
+        except Exception as e:
+            self.stats["dropped"] += len(batch)
+            log.error("Could not index %d message(s) into memory: %s", len(batch), e)
+
+    def _load_files(self):
+        """List this space's vector files on disk, least recently written first."""
+        suffix = f".{self.space}.f32"
+        files = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(suffix) and entry.name[:-len(suffix)].isdigit():
+                    files.append((entry.stat().st_mtime, int(entry.name[:-len(suffix)])))
+        return OrderedDict((channel_id, None) for _, channel_id in sorted(files))
+
+    def _evict_files(self):
+        """Delete the least recently written vector files beyond max_channels. Returns their channel IDs."""
+        evicted = []
+        while len(self._files) > self.max_channels:
+            channel_id, _ = self._files.popitem(last=False)
+            with self._channels_lock: # Held while deleting, so a search can't reopen the file halfway
+                self._channels.pop(channel_id, None) # Unmapped once no search still holds it
+                try:
+                    os.remove(self._path(channel_id))
+                except FileNotFoundError:
+                    pass
+            evicted.append(channel_id)
+        return evicted
+
+    def _index_batch(self, batch):
+        """Embed and append a batch. Returns (snippets to store, channel IDs whose memory was deleted)."""
+        if self._files is None:
+            self._files = self._load_files()
+        vectors = self.embedder.embed([item[4] for item in batch])
+        by_channel = OrderedDict()
+        for item, vector in zip(batch, vectors):
+            by_channel.setdefault(item[0], []).append((item, vector))
+        snippets = []
+        for channel_id, items in by_channel.items():
+            rows = self._channel(channel_id).append([vector for _, vector in items])
+            snippets.extend((channel_id, row, *item[1:]) for row, (item, _) in zip(rows, items))
+            self._files[channel_id] = None
+            self._files.move_to_end(channel_id)
+        evicted = self._evict_files()
+        return [snippet for snippet in snippets if snippet[0] not in evicted], evicted
+
+    def _search(self, channel_id, query, k, state):
+        # Never creates a file, and never reads SQLite: a channel closed since search() checked is skipped
+        channel = self._channel(channel_id, state, create=False)
+        if channel is None:
+            return []
+        vector = self.embedder.embed([query], query=True)[0]
+        return channel.search(vector, k)
+
+    async def search(self, channel_id, query, self_user_id, exclude=(), k=MEMORY_TOP_K, budget=MEMORY_TOKEN_BUDGET):
+        """Return up to k formatted lines of earlier messages relevant to `query`, oldest first.
+
+        Messages in `exclude` (e.g. the IDs already in the raw history) are skipped, and the
+        lines together stay within `budget` estimated tokens.
+        """
+        if not self.enabled or not query.strip():
+            return []
+        self.stats["searches"] += 1
+        loop = asyncio.get_running_loop()
+        # The search threads only embed and score; opening a channel's file needs its row count from SQLite
+        state = None if channel_id in self._channels else await run_db_read(_load_channel_state, channel_id, self.space)
+        # Over-fetch: some candidates are excluded, deleted or below MEMORY_MIN_SCORE
+        candidates = await loop.run_in_executor(self._search_executor, self._search, channel_id, query, k * 4, state)
+        candidates = [(row, score) for row, score in candidates if score >= MEMORY_MIN_SCORE]
+        if not candidates:
+            return []
+        snippets = await run_db_read(_load_snippets, channel_id, self.space, [row for row, _ in candidates])
+        chosen = []
+        remaining = budget
+        for row, _ in candidates:
+            snippet = snippets.get(row)
+            if snippet is None or snippet[0] in exclude:
+                continue
+            message_id, author_id, author_name, text = snippet
+            line = f"{'You' if author_id == self_user_id else author_name}: {text}"
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                continue
+            chosen.append((message_id, line))
+            remaining -= cost
+            if len(chosen) >= k:
+                break
+        self.stats["recalled"] += len(chosen)
+        return [line for _, line in sorted(chosen)]
+
+    async def forget(self, channel_id, message_ids):
+        """Drop deleted messages; their vectors stay until overwritten but are never returned again."""
+        if not self.enabled:
+            return
+        message_ids = set(message_ids)
+        self._pending = [item for item in self._pending if not (item[0] == channel_id and item[1] in message_ids)]
+        await run_db(_delete_snippets, channel_id, message_ids)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self._pending), "open_channels": len(self._channels),
+                "replied_channels": len(self._replied), "channel_files": len(self._files or ())}
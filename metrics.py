@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) # 0 = no metrics endpoint
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1') # Local only unless explicitly opened up
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Minimal Prometheus-style registry. Metrics are only updated from the event loop, so there is
+# no locking; an observation is a perf_counter() call, a bisect and a few dict lookups.
+
+_metrics = []
+_collectors = [] # (prefix, get_stats) pairs rendered as gauges at scrape time
+
+def _format_labels(labelnames, values, extra=""):
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, *labelvalues):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labelvalues, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+
+class Gauge:
+    """A gauge whose value is read from `function` at scrape time."""
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        _metrics.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.function()}"
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # labelvalues -> [bucket counts..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labelvalues, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+stage_seconds = Histogram("bot_stage_seconds", "Time spent in each on_message stage.", ("stage",))
+command_seconds = Histogram("bot_command_seconds", "Slash command handling time.", ("command",))
+requests_total = Counter("bot_requests_total", "Messages and commands handled.", ("kind",))
+errors_total = Counter("bot_errors_total", "Unhandled errors by stage and exception type.", ("stage", "type"))
+tokens_total = Counter("bot_tokens_total", "Estimated Gemini tokens.", ("direction",))
+
+class span:
+    """Time a block into bot_stage_seconds{stage}; exceptions are counted in bot_errors_total.
+
+    Works across awaits: `with span("history"): lines = await ...`
+    """
+    __slots__ = ("stage", "histogram", "started")
+
+    def __init__(self, stage, histogram=stage_seconds):
+        self.stage = stage
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, self.stage)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            errors_total.inc(1, self.stage, exc_type.__name__)
+        return False
+
+def timed_command(name):
+    """Decorator for slash command callbacks; put it below @tree.command and the describe decorators."""
+    def decorator(func):
+        @functools.wraps(func) # discord.py reads the parameters through __wrapped__
+        async def wrapper(interaction, *args, **kwargs):
+            requests_total.inc(1, "command")
+            with span(name, command_seconds):
+                return await func(interaction, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_stats_collector(prefix, get_stats):
+    """Expose the numeric values of an existing get_stats() dict as gauges named {prefix}_{key}."""
+    _collectors.append((prefix, get_stats))
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, get_stats in _collectors:
+        try:
+            stats = get_stats()
+        except Exception as e:
+            log.error("Metrics collector %s failed: %s", prefix, e)
+            continue
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass # Skip headers
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = render_metrics().encode("utf-8")
+            status = "200 OK"
+        else:
+            body = b"Not found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve GET /metrics in Prometheus text format. Returns the asyncio server, or None if disabled."""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    log.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
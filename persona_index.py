@@ -0,0 +1,110 @@
+import bisect
+import difflib
+import threading
+from collections import Counter, defaultdict
+
+AUTOCOMPLETE_LIMIT = 25 # Discord shows at most 25 choices
+
+def _trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class PersonaNameIndex:
+    """In-memory prefix + trigram index of persona names for autocomplete and typo suggestions.
+
+    Kept in sync by the persona write helpers in shared.py (which run on the DB thread, hence
+    the lock). Lookups never touch the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sorted = [] # (lowercase name, name), sorted for prefix bisection
+        self._trigrams = defaultdict(set) # trigram -> names containing it (lowercased)
+
+    def load(self, names):
+        with self._lock:
+            self._sorted = sorted((name.lower(), name) for name in names)
+            self._trigrams = defaultdict(set)
+            for lower, name in self._sorted:
+                for trigram in _trigrams(lower):
+                    self._trigrams[trigram].add(name)
+
+    def add(self, name):
+        lower = name.lower()
+        with self._lock:
+            entry = (lower, name)
+            position = bisect.bisect_left(self._sorted, entry)
+            if position < len(self._sorted) and self._sorted[position] == entry:
+                return
+            self._sorted.insert(position, entry)
+            for trigram in _trigrams(lower):
+                self._trigrams[trigram].add(name)
+
+    def remove(self, name):
+        lower = name.lower()
+        with self._lock:
+            entry = (lower, name)
+            position = bisect.bisect_left(self._sorted, entry)
+            if position < len(self._sorted) and self._sorted[position] == entry:
+                del self._sorted[position]
+            for trigram in _trigrams(lower):
+                names = self._trigrams.get(trigram)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self._trigrams[trigram]
+
+    def _substring_candidates(self, query):
+        # Intersect from the rarest trigram up so the working set shrinks as fast as possible
+        sets = sorted((self._trigrams.get(trigram, set()) for trigram in _trigrams(query)), key=len)
+        if not sets or not sets[0]:
+            return set()
+        candidates = set(sets[0])
+        for names in sets[1:]:
+            candidates &= names
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query: str, limit=AUTOCOMPLETE_LIMIT):
+        """Return up to `limit` names: prefix matches first, then other names containing the query."""
+        query = query.strip().lower()
+        with self._lock:
+            if not query:
+                return [name for _, name in self._sorted[:limit]]
+            results = []
+            position = bisect.bisect_left(self._sorted, (query, ""))
+            while position < len(self._sorted) and len(results) < limit:
+                lower, name = self._sorted[position]
+                if not lower.startswith(query):
+                    break
+                results.append(name)
+                position += 1
+            if len(results) < limit and len(query) >= 3:
+                seen = set(results)
+                substring_matches = sorted(
+                    name for name in self._substring_candidates(query)
+                    if name not in seen and query in name.lower()
+                )
+                results.extend(substring_matches[:limit - len(results)])
+            return results
+
+    def closest(self, name: str):
+        """Return the most similar existing name (for "did you mean" hints), or None."""
+        lower = name.strip().lower()
+        with self._lock:
+            # Rank names by shared trigrams, then let difflib pick among the best few
+            shared = Counter()
+            for trigram in _trigrams(lower):
+                shared.update(self._trigrams.get(trigram, ()))
+            candidates = [candidate for candidate, _ in shared.most_common(20)]
+            if not candidates:
+                candidates = [candidate for _, candidate in self._sorted[:1000]] # Very short names share no trigrams
+        matches = difflib.get_close_matches(lower, [candidate.lower() for candidate in candidates], n=1, cutoff=0.6)
+        if not matches:
+            return None
+        return next(candidate for candidate in candidates if candidate.lower() == matches[0])
+
+    def __len__(self):
+        return len(self._sorted)
+
+persona_names = PersonaNameIndex()
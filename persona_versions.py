@@ -0,0 +1,177 @@
+import json
+import os
+import time
+import zlib
+from difflib import SequenceMatcher
+
+PERSONA_SNAPSHOT_EVERY = int(os.getenv('PERSONA_SNAPSHOT_EVERY', '32')) # Max versions between full snapshots (bounds reconstruction work)
+
+# Every change to a persona's content is appended to persona_versions. Most rows hold a
+# zlib-compressed delta against the previous version; a full compressed snapshot is stored for a
+# persona's first version, at least every PERSONA_SNAPSHOT_EVERY versions, and whenever the
+# delta would be no smaller than the snapshot. Reading any version therefore costs one snapshot
+# plus fewer than PERSONA_SNAPSHOT_EVERY deltas, found with two index range scans.
+#
+# `parent` is the version whose content an edit replaced (0 for none). A revert copies its
+# target's parent, so reverting one step at a time keeps walking back instead of toggling
+# between the last two states.
+#
+# All helpers here are blocking and run inside the caller's transaction on its connection.
+
+def _common_affixes(old, new):
+    """Return the lengths of the common prefix and (non-overlapping) common suffix of two strings."""
+    # Binary searches over slice comparisons, which run in C, instead of a per-character loop
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[:middle] == new[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    prefix = low
+    low, high = 0, min(len(old), len(new)) - prefix
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[len(old) - middle:] == new[len(new) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return prefix, low
+
+def _make_delta(old, new):
+    """Return ops rebuilding `new` from `old`: [start, end] copies old[start:end], a string is inserted."""
+    ops = []
+
+    def copy(start, end):
+        if start == end:
+            return
+        if ops and isinstance(ops[-1], list) and ops[-1][1] == start:
+            ops[-1][1] = end
+        else:
+            ops.append([start, end])
+
+    def insert(text):
+        if not text:
+            return
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += text
+        else:
+            ops.append(text)
+
+    # Appends and single edits only change the middle, so the line diff (quadratic in the worst
+    # case) only ever sees the changed region
+    prefix, suffix = _common_affixes(old, new)
+    copy(0, prefix)
+    old_lines = old[prefix:len(old) - suffix].splitlines(keepends=True)
+    new_lines = new[prefix:len(new) - suffix].splitlines(keepends=True)
+    offsets = [prefix]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+    matcher = SequenceMatcher(None, old_lines, new_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        start, end = offsets[i1], offsets[i2]
+        if tag == 'equal':
+            copy(start, end)
+            continue
+        # Keep the unchanged start and end of a rewritten block, so editing a word in a long
+        # paragraph doesn't store the whole paragraph again
+        removed, added = old[start:end], "".join(new_lines[j1:j2])
+        head, tail = _common_affixes(removed, added)
+        copy(start, start + head)
+        insert(added[head:len(added) - tail])
+        copy(end - tail, end)
+    copy(len(old) - suffix, len(old))
+    return ops
+
+def _apply_delta(old, ops):
+    return "".join(old[op[0]:op[1]] if isinstance(op, list) else op for op in ops)
+
+def _compress_snapshot(content):
+    return zlib.compress(content.encode("utf-8"), 9)
+
+def _compress_delta(ops):
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode("utf-8"), 9)
+
+def _head(conn, persona_id):
+    """Return (version, parent) of the persona's newest version, or None."""
+    return conn.execute(
+        "SELECT version, parent FROM persona_versions WHERE persona_id = ? ORDER BY version DESC LIMIT 1", (persona_id,)
+    ).fetchone()
+
+def _last_snapshot(conn, persona_id, version):
+    return conn.execute(
+        "SELECT MAX(version) FROM persona_versions WHERE persona_id = ? AND is_snapshot = 1 AND version <= ?",
+        (persona_id, version)
+    ).fetchone()[0]
+
+def get_version_content(conn, persona_id, version):
+    """Rebuild a persona's content as of `version`, or return None if there is no such version."""
+    snapshot = _last_snapshot(conn, persona_id, version)
+    if snapshot is None:
+        return None
+    rows = conn.execute(
+        "SELECT version, data FROM persona_versions WHERE persona_id = ? AND version BETWEEN ? AND ? ORDER BY version",
+        (persona_id, snapshot, version)
+    ).fetchall()
+    if not rows or rows[-1][0] != version:
+        return None
+    content = zlib.decompress(rows[0][1]).decode("utf-8")
+    for _, data in rows[1:]:
+        content = _apply_delta(content, json.loads(zlib.decompress(data)))
+    return content
+
+def record_version(conn, persona_id, old_content, new_content, kind, user_id=None, parent=None):
+    """Append a version for a content change from `old_content` to `new_content`; returns its number.
+
+    `old_content` is None for a new persona. A persona with content but no history yet (created
+    before versioning, or written around these helpers) first gets its old content as a snapshot.
+    """
+    head = _head(conn, persona_id)
+    if head is None and old_content is not None:
+        conn.execute(
+            "INSERT INTO persona_versions (persona_id, version, kind, parent, is_snapshot, data, user_id, created_at) "
+            "VALUES (?, 1, 'initial', 0, 1, ?, NULL, ?)",
+            (persona_id, _compress_snapshot(old_content), time.time())
+        )
+        head = (1, 0)
+    version = head[0] + 1 if head else 1
+    if parent is None:
+        parent = head[0] if head else 0
+    data = None
+    if head and version - _last_snapshot(conn, persona_id, head[0]) < PERSONA_SNAPSHOT_EVERY:
+        delta = _compress_delta(_make_delta(old_content, new_content))
+        # Prose rarely compresses 10x, so a delta that small wins without compressing the snapshot
+        if len(delta) * 10 < len(new_content) or len(delta) < len(_compress_snapshot(new_content)):
+            data, is_snapshot = delta, 0
+    if data is None:
+        data, is_snapshot = _compress_snapshot(new_content), 1
+    conn.execute(
+        "INSERT INTO persona_versions (persona_id, version, kind, parent, is_snapshot, data, user_id, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (persona_id, version, kind, parent, is_snapshot, data, user_id, time.time())
+    )
+    return version
+
+def revert_steps(conn, persona_id, current_content, steps, user_id=None):
+    """Record a version restoring the content from `steps` edits ago.
+
+    Returns (version, content), or None if the history is shorter than `steps`. Only the
+    (version, parent) of each step back and the target's reconstruction are read.
+    """
+    head = _head(conn, persona_id)
+    if head is None:
+        return None
+    target, target_parent = head
+    for _ in range(steps):
+        if target_parent == 0:
+            return None
+        target = target_parent
+        target_parent = conn.execute(
+            "SELECT parent FROM persona_versions WHERE persona_id = ? AND version = ?", (persona_id, target)
+        ).fetchone()[0]
+    content = get_version_content(conn, persona_id, target)
+    version = record_version(conn, persona_id, current_content, content, "revert", user_id, parent=target_parent)
+    return version, content
+
+def delete_versions(conn, persona_id):
+    conn.execute("DELETE FROM persona_versions WHERE persona_id = ?", (persona_id,))
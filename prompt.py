@@ -0,0 +1,75 @@
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '4000')) # Input tokens, including the system instruction
+PROMPT_MAX_MESSAGE_TOKENS = int(os.getenv('PROMPT_MAX_MESSAGE_TOKENS', '400')) # Longer history messages are truncated
+PROMPT_MAX_HISTORY_MESSAGES = int(os.getenv('PROMPT_MAX_HISTORY_MESSAGES', '50'))
+
+HISTORY_HEADER = "## Message History:\n"
+SUMMARY_HEADER = "## Conversation Summary (earlier messages):\n"
+MEMORY_HEADER = "## Possibly Relevant Earlier Messages:\n"
+TRUNCATION_MARKER = " […]"
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: ~4 characters per token for ASCII, ~3 UTF-8 bytes otherwise."""
+    if text.isascii():
+        return (len(text) + 3) // 4
+    return (len(text.encode("utf-8")) + 2) // 3
+
+def _truncate(line: str, max_tokens: int) -> str:
+    if estimate_tokens(line) <= max_tokens:
+        return line
+    # Shrink by the ratio of allowed to estimated tokens; the estimate is linear in length
+    keep = max(1, len(line) * max_tokens // estimate_tokens(line) - len(TRUNCATION_MARKER))
+    return line[:keep] + TRUNCATION_MARKER
+
+class Prompt:
+    __slots__ = ("content", "history", "history_used", "history_available", "budget",
+                 "system_tokens", "memory_tokens", "summary_tokens", "history_tokens", "query_tokens")
+
+    @property
+    def total_tokens(self):
+        return self.system_tokens + self.memory_tokens + self.summary_tokens + self.history_tokens + self.query_tokens
+
+    def log_summary(self) -> str:
+        return (f"Prompt tokens (est.): system={self.system_tokens} memory={self.memory_tokens} summary={self.summary_tokens} "
+                f"history={self.history_tokens} "
+                f"({self.history_used}/{self.history_available} messages) query={self.query_tokens} "
+                f"total={self.total_tokens}/{self.budget}")
+
+def build_prompt(system_instruction: str, history_lines, current_section: str, budget=PROMPT_TOKEN_BUDGET, summary=None,
+                 memories=None) -> Prompt:
+    """Assemble the Gemini prompt, filling what's left of the budget with the newest history first.
+
+    The system instruction, recalled messages and channel summary (if any) and the current
+    message(s) are always included; history lines are added newest to oldest, each capped at
+    PROMPT_MAX_MESSAGE_TOKENS, until the budget runs out.
+    """
+    prompt = Prompt()
+    prompt.budget = budget
+    prompt.system_tokens = estimate_tokens(system_instruction)
+    memory_section = MEMORY_HEADER + "\n".join(memories) + "\n\n" if memories else "" # Already within MEMORY_TOKEN_BUDGET
+    prompt.memory_tokens = estimate_tokens(memory_section) if memory_section else 0
+    summary_section = f"{SUMMARY_HEADER}{summary}\n\n" if summary else ""
+    prompt.summary_tokens = estimate_tokens(summary_section) if summary_section else 0
+    prompt.query_tokens = estimate_tokens(current_section) + estimate_tokens(HISTORY_HEADER)
+    remaining = budget - prompt.system_tokens - prompt.memory_tokens - prompt.summary_tokens - prompt.query_tokens
+
+    selected = []
+    history_tokens = 0
+    for line in reversed(history_lines):
+        line = _truncate(line, PROMPT_MAX_MESSAGE_TOKENS)
+        cost = estimate_tokens(line) + 1 # +1 for the joining newline
+        if cost > remaining:
+            break
+        selected.append(line)
+        remaining -= cost
+        history_tokens += cost
+    selected.reverse() # Oldest first
+
+    prompt.history = "\n".join(selected)
+    prompt.history_used = len(selected)
+    prompt.history_available = len(history_lines)
+    prompt.history_tokens = history_tokens
+    # Persona is handled via system_instruction, so it isn't part of the content
+    prompt.content = f"{memory_section}{summary_section}{HISTORY_HEADER}{prompt.history}\n\n{current_section}"
+    return prompt
@@ -0,0 +1,118 @@
+import os
+import logging
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+DISCORD_CHUNK_CHARS = 1999
+STREAMING_ENABLED = os.getenv('GEMINI_STREAMING', '0') == '1'
+STREAM_FIRST_CHUNK_CHARS = int(os.getenv('STREAM_FIRST_CHUNK_CHARS', '200')) # Post once this much text has arrived
+# Discord allows roughly 5 edits per 5 seconds per channel; stay comfortably under that
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.5'))
+
+def split_into_chunks(text: str, limit=DISCORD_CHUNK_CHARS):
+    """Split text into Discord-sized chunks, trying to break at newlines when possible."""
+    chunks = []
+    while text:
+        if len(text) <= limit:
+            chunks.append(text)
+            break
+
+        # Try to find a newline to split at
+        split_point = text[:limit].rfind('\n')
+        if split_point == -1:  # No newline found, just split at the limit
+            split_point = limit
+
+        chunks.append(text[:split_point])
+        text = text[split_point:].lstrip()  # Remove leading whitespace from next chunk
+    return chunks
+
+def _label_chunks(chunks):
+    if len(chunks) > 1:
+        return [f"[Part {i}/{len(chunks)}]\n{chunk}" for i, chunk in enumerate(chunks, 1)]
+    return chunks
+
+def prepare_chunks(text: str):
+    """Split a complete response into the labelled messages send_chunks() will post."""
+    return _label_chunks(split_into_chunks(text))
+
+async def send_chunks(channel, chunks):
+    if not chunks:
+        await channel.send("I received an empty response.")
+        return
+    for chunk in chunks:
+        await channel.send(chunk)
+
+async def send_response(channel, text: str):
+    """Send a complete Gemini response back to Discord in chunks if needed."""
+    await send_chunks(channel, prepare_chunks(text))
+
+# --- Streaming ---
+# Time from starting generation to the first visible message, in seconds (most recent samples)
+_ttft_samples = deque(maxlen=1000)
+
+def get_streaming_stats() -> dict:
+    samples = sorted(_ttft_samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "ttft_p50": samples[len(samples) // 2],
+        "ttft_p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+class _StreamingReply:
+    """Discord messages mirroring a response as it streams in."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.messages = [] # Sent discord.Message objects, one per chunk
+        self.contents = [] # What each message currently shows
+
+    async def sync(self, text: str, final: bool):
+        chunks = split_into_chunks(text)
+        # Part labels are only known once the full text is in. Chunks are re-split from the full
+        # text each time (a boundary can move back to a newline once a chunk fills up), and only
+        # messages whose content actually changed are edited.
+        if final:
+            chunks = _label_chunks(chunks)
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self.contents[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self.contents[i] = chunk
+            else:
+                self.messages.append(await self.channel.send(chunk))
+                self.contents.append(chunk)
+
+async def stream_response(channel, model, content) -> str:
+    """Generate with streaming and progressively post/edit the reply. Returns the full text."""
+    started = time.perf_counter()
+    reply = _StreamingReply(channel)
+    response = await model.generate_content_async(content, stream=True)
+    text = ""
+    last_sync = 0.0
+    async for chunk in response:
+        text += chunk.text
+        if not reply.messages and len(text) < STREAM_FIRST_CHUNK_CHARS:
+            continue
+        now = time.perf_counter()
+        if now - last_sync >= STREAM_EDIT_INTERVAL:
+            first = not reply.messages
+            await reply.sync(text, final=False)
+            last_sync = now
+            if first:
+                _record_ttft(time.perf_counter() - started)
+    if not text:
+        await channel.send("I received an empty response.")
+        return text
+    first = not reply.messages
+    await reply.sync(text, final=True)
+    if first:
+        _record_ttft(time.perf_counter() - started)
+    return text
+
+def _record_ttft(seconds: float):
+    _ttft_samples.append(seconds)
+    log.debug("Time to first visible token: %.0f ms", seconds * 1000)
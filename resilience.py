@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '2')) # Extra attempts after a retryable error
+GEMINI_RETRY_BASE_DELAY = float(os.getenv('GEMINI_RETRY_BASE_DELAY', '0.5')) # Seconds; doubles per attempt
+GEMINI_RETRY_MAX_DELAY = float(os.getenv('GEMINI_RETRY_MAX_DELAY', '8'))
+GEMINI_REQUEST_DEADLINE = float(os.getenv('GEMINI_REQUEST_DEADLINE', '60')) # Seconds for all attempts together
+GEMINI_HEDGE = os.getenv('GEMINI_HEDGE', '0') == '1' # Costs an extra request for the slowest ~5%
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv('GEMINI_HEDGE_MIN_DELAY', '1.0')) # Never hedge sooner than this
+GEMINI_HEDGE_MIN_SAMPLES = 20 # Successful calls observed before the p95 is trusted
+GEMINI_BREAKER_ERROR_RATE = float(os.getenv('GEMINI_BREAKER_ERROR_RATE', '0.5')) # Failure share that opens the breaker
+GEMINI_BREAKER_MIN_REQUESTS = int(os.getenv('GEMINI_BREAKER_MIN_REQUESTS', '10')) # Within the window
+GEMINI_BREAKER_WINDOW = float(os.getenv('GEMINI_BREAKER_WINDOW', '60'))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv('GEMINI_BREAKER_COOLDOWN', '30')) # Seconds open before a probe request
+
+# HTTP statuses worth another attempt. google.api_core exceptions carry theirs in .code; matching
+# on that keeps the SDK out of this module's imports (see gemini.load_sdk).
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class GenerationTimeout(Exception):
+    """No attempt produced a response within GEMINI_REQUEST_DEADLINE."""
+
+class CircuitOpen(Exception):
+    """The circuit breaker is open and no fallback model is configured."""
+
+def is_retryable(error) -> bool:
+    if isinstance(error, (ConnectionError, asyncio.TimeoutError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+class CircuitBreaker:
+    """Opens when the recent failure rate is too high; after a cooldown lets one probe through.
+
+    closed -> open when at least `min_requests` outcomes in the last `window` seconds include
+    `error_rate` failures; open -> half_open after `cooldown`; half_open -> closed when the probe
+    succeeds, back to open when it fails.
+    """
+
+    def __init__(self, error_rate=GEMINI_BREAKER_ERROR_RATE, min_requests=GEMINI_BREAKER_MIN_REQUESTS,
+                 window=GEMINI_BREAKER_WINDOW, cooldown=GEMINI_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_started = None # Set while the half-open probe is in flight
+        self._outcomes = deque() # (timestamp, succeeded)
+
+    def allow(self) -> bool:
+        """Whether a request may go to the primary model now."""
+        if self.state == "closed":
+            return True
+        now = self.clock()
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self.probe_started = None
+        # A probe that never reported back (e.g. it was cancelled) is replaced after a cooldown
+        if self.state == "half_open" and (self.probe_started is None or now - self.probe_started >= self.cooldown):
+            self.probe_started = now
+            return True
+        return False
+
+    def record(self, succeeded: bool):
+        now = self.clock()
+        if self.state == "half_open":
+            if succeeded:
+                self.state = "closed"
+                self._outcomes.clear()
+                log.info("Gemini circuit breaker closed.")
+            else:
+                self._open(now)
+            return
+        self._outcomes.append((now, succeeded))
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+        if self.state == "closed" and len(self._outcomes) >= self.min_requests:
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if failures / len(self._outcomes) >= self.error_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = "open"
+        self.opened_at = now
+        log.warning("Gemini circuit breaker opened; retrying the primary model in %.0fs.", self.cooldown)
+
+class ResilientGenerator:
+    """Retries, deadlines, hedging and a circuit breaker around Gemini calls.
+
+    `generate(request, model, fallback)` awaits `request(model)`: retryable errors are retried
+    with full-jitter exponential backoff, everything is bounded by `deadline`, and once
+    `hedge_min_samples` latencies are known a second request is raced against any call slower
+    than the observed p95. While the breaker is open, requests go to `fallback()` (a lighter
+    model) or fail fast with CircuitOpen.
+    """
+
+    def __init__(self, max_retries=GEMINI_MAX_RETRIES, base_delay=GEMINI_RETRY_BASE_DELAY, max_delay=GEMINI_RETRY_MAX_DELAY,
+                 deadline=GEMINI_REQUEST_DEADLINE, hedge=GEMINI_HEDGE, hedge_min_delay=GEMINI_HEDGE_MIN_DELAY,
+                 hedge_min_samples=GEMINI_HEDGE_MIN_SAMPLES, breaker=None, seed=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.random = random.Random(seed)
+        self._latencies = deque(maxlen=200) # Recent successful primary call durations
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0, "fallbacks": 0, "rejected": 0}
+
+    async def generate(self, request, model, fallback=None, hedge=True):
+        self.stats["calls"] += 1
+        primary = self.breaker.allow()
+        if not primary:
+            fallback_model = fallback() if fallback else None
+            if fallback_model is None:
+                self.stats["rejected"] += 1
+                raise CircuitOpen("Gemini is failing right now; not sending more requests for a moment.")
+            self.stats["fallbacks"] += 1
+            model = fallback_model
+        try:
+            return await asyncio.wait_for(self._attempts(request, model, primary, hedge and self.hedge), self.deadline)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            if primary:
+                self.breaker.record(False)
+            raise GenerationTimeout(f"No response from Gemini within {self.deadline:.0f}s.") from None
+
+    async def _attempts(self, request, model, primary, hedge):
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                result = await (self._hedged(request, model) if hedge else request(model))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if primary:
+                    self.breaker.record(not retryable) # A rejected prompt still means the service is up
+                if attempt == self.max_retries or not retryable or (primary and self.breaker.state == "open"):
+                    raise
+                delay = self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                self.stats["retries"] += 1
+                log.warning("Gemini call failed (%s: %s); retry %d in %.2fs.", type(e).__name__, e, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+            if primary:
+                self.breaker.record(True)
+                self._latencies.append(time.perf_counter() - started)
+            return result
+
+    def hedge_delay(self):
+        """Seconds after which a second request is sent, or None while there isn't enough data."""
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95)])
+
+    async def _hedged(self, request, model):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await request(model)
+        first = asyncio.ensure_future(request(model))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        self.stats["hedges"] += 1
+        second = asyncio.ensure_future(request(model))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error # Both failed; the retry loop decides what happens next
+        finally:
+            for task in (first, second):
+                task.cancel() # No-op for finished tasks
+
+    def get_stats(self) -> dict:
+        delay = self.hedge_delay()
+        return {**self.stats, "breaker_open": int(self.breaker.state != "closed"),
+                "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else 0}
+
+class ResilientModel:
+    """Looks like a GenerativeModel; generate_content_async goes through a ResilientGenerator.
+
+    Streams are retried only while opening; once chunks are being posted a failure is final,
+    and they are never hedged.
+    """
+
+    def __init__(self, generator, model, fallback=None):
+        self.generator = generator
+        self.model = model
+        self.fallback = fallback
+
+    async def generate_content_async(self, content, stream=False):
+        return await self.generator.generate(
+            lambda model: model.generate_content_async(content, stream=stream), self.model, self.fallback, hedge=not stream)
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from database import connect, run_db, run_db_read
+from env import parse_id_set
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '0') == '1'
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600')) # Seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000')) # In memory
+RESPONSE_CACHE_MAX_ROWS = int(os.getenv('RESPONSE_CACHE_MAX_ROWS', '20000')) # In SQLite
+RESPONSE_CACHE_PRUNE_EVERY = int(os.getenv('RESPONSE_CACHE_PRUNE_EVERY', '100')) # Stored responses between prunes of the SQLite table
+RESPONSE_CACHE_BYPASS_CHANNELS = parse_id_set(os.getenv('RESPONSE_CACHE_BYPASS_CHANNELS', ''))
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(' ', text).strip().lower()
+
+# --- SQLite side table (blocking; called through run_db/run_db_read) ---
+def _load_entry(key, now):
+    row = connect().execute(
+        "SELECT response, created_at, generation_seconds FROM response_cache WHERE key = ? AND created_at > ?",
+        (key, now - RESPONSE_CACHE_TTL)
+    ).fetchone()
+    return row
+
+def _store_entry(key, response, created_at, generation_seconds):
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, response, created_at, last_used, generation_seconds) VALUES (?, ?, ?, ?, ?)",
+            (key, response, created_at, created_at, generation_seconds)
+        )
+
+def _touch_entry(key, now):
+    conn = connect()
+    with conn:
+        conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+
+def prune_response_cache():
+    """Delete expired rows and trim the table to RESPONSE_CACHE_MAX_ROWS, least recently used first."""
+    conn = connect()
+    with conn:
+        conn.execute("DELETE FROM response_cache WHERE created_at <= ?", (time.time() - RESPONSE_CACHE_TTL,))
+        conn.execute(
+            "DELETE FROM response_cache WHERE key NOT IN (SELECT key FROM response_cache ORDER BY last_used DESC LIMIT ?)",
+            (RESPONSE_CACHE_MAX_ROWS,)
+        )
+
+class ResponseCache:
+    """Caches Gemini responses for identical prompts to the same persona.
+
+    Lookups hit an in-memory LRU first and then the SQLite side table, so entries survive
+    restarts. Writes to SQLite happen on the DB thread and never delay the reply; every
+    `prune_every` stored responses the table is pruned the same way.
+    """
+
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, bypass_channels=None, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 prune_every=RESPONSE_CACHE_PRUNE_EVERY):
+        self.enabled = enabled
+        self.bypass_channels = RESPONSE_CACHE_BYPASS_CHANNELS if bypass_channels is None else bypass_channels
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._puts_since_prune = 0
+        self._entries = OrderedDict() # key -> (response, created_at, generation_seconds)
+        self.stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+        self._pending_writes = set() # Keeps fire-and-forget DB tasks alive until they finish
+
+    def enabled_for(self, channel_id) -> bool:
+        return self.enabled and channel_id not in self.bypass_channels
+
+    @staticmethod
+    def make_key(system_instruction, safety_profile, history, query) -> str:
+        digest = hashlib.sha256()
+        for part in (system_instruction, safety_profile, _normalize(history), _normalize(query)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key):
+        """Return the cached response text, or None on a miss."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= now - RESPONSE_CACHE_TTL:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            entry = await run_db_read(_load_entry, key, now)
+            if entry is not None:
+                self._remember(key, entry)
+        else:
+            self._entries.move_to_end(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["saved_seconds"] += entry[2]
+        task = asyncio.get_running_loop().create_task(run_db(_touch_entry, key, now))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+        return entry[0]
+
+    async def put(self, key, response, generation_seconds):
+        entry = (response, time.time(), generation_seconds)
+        self._remember(key, entry)
+        await run_db(_store_entry, key, *entry)
+        # Enforce the TTL and RESPONSE_CACHE_MAX_ROWS while running, not just at startup
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= self.prune_every:
+            self._puts_since_prune = 0
+            await run_db(prune_response_cache)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
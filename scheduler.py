@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+GEMINI_MAX_IN_FLIGHT = int(os.getenv('GEMINI_MAX_IN_FLIGHT', '4'))
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '60')) # Requests per minute
+GEMINI_TPM = int(os.getenv('GEMINI_TPM', '1000000')) # Estimated input tokens per minute
+GEMINI_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', '100'))
+GEMINI_QUEUE_DEADLINE = float(os.getenv('GEMINI_QUEUE_DEADLINE', '60')) # Seconds a request may wait before it's dropped
+
+class QueueFull(Exception):
+    """The scheduler already holds GEMINI_MAX_QUEUE waiting requests."""
+
+class RequestExpired(Exception):
+    """A request waited past its deadline and was dropped without calling Gemini."""
+
+class TokenBucket:
+    """Refills `rate_per_minute` tokens per minute, holding at most one minute's worth."""
+
+    def __init__(self, rate_per_minute, clock=time.monotonic):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount) -> float:
+        """Seconds until `amount` tokens will be available, without taking them."""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def try_acquire(self, amount) -> float:
+        """Take `amount` tokens if available and return 0, otherwise return seconds until they will be."""
+        amount = min(amount, self.capacity) # An oversized request must still be able to run eventually
+        wait = self.wait_time(amount)
+        if wait <= 0:
+            self.tokens -= amount
+        return wait
+
+    async def acquire(self, amount=1):
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+class _Job:
+    __slots__ = ("channel_id", "user_id", "factory", "tokens", "deadline", "enqueued_at", "future")
+
+    def __init__(self, channel_id, user_id, factory, tokens, deadline, future):
+        self.channel_id = channel_id
+        self.user_id = user_id
+        self.factory = factory
+        self.tokens = tokens
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+class GenerationScheduler:
+    """Sits between on_message and Gemini.
+
+    Caps concurrent requests, enforces request/token-per-minute budgets and serves waiting
+    requests round-robin across channels, then across users within a channel, so one busy
+    channel (or one user spamming mentions) can't starve everyone else.
+    """
+
+    def __init__(self, max_in_flight=GEMINI_MAX_IN_FLIGHT, requests_per_minute=GEMINI_RPM,
+                 tokens_per_minute=GEMINI_TPM, max_queue=GEMINI_MAX_QUEUE, deadline=GEMINI_QUEUE_DEADLINE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        # channel_id -> user_id -> deque of jobs; both levels rotate for round-robin
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._queued_tokens = 0
+        self._in_flight = 0
+        self._slots = None
+        self._work = None
+        self._dispatcher = None
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "expired": 0, "rejected": 0}
+        self._wait_samples = deque(maxlen=1000)
+
+    def _ensure_started(self):
+        # Created lazily so the scheduler can be constructed before the event loop exists
+        if self._dispatcher is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._work = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def submit(self, channel_id, user_id, factory, tokens=1):
+        """Queue `factory` (a zero-argument coroutine function) for execution.
+
+        Returns (position, future). Position is 0 when the request can start right away, otherwise
+        its place in the queue (1 = next), counting requests held by the concurrency cap or the
+        RPM/TPM budgets. Raises QueueFull when saturated.
+        """
+        self._ensure_started()
+        if self._queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise QueueFull()
+        # Requests submitted ahead of this one (but not dispatched yet) take their slot and budget first
+        starts_now = (self._in_flight + self._queued < self.max_in_flight
+                      and self.request_bucket.wait_time(self._queued + 1) <= 0
+                      and self.token_bucket.wait_time(self._queued_tokens + min(tokens, self.token_bucket.capacity)) <= 0)
+        position = 0 if starts_now else self._queued + 1
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(channel_id, user_id, factory, tokens, time.monotonic() + self.deadline, future)
+        self._queues.setdefault(channel_id, OrderedDict()).setdefault(user_id, deque()).append(job)
+        self._queued += 1
+        self._queued_tokens += min(tokens, self.token_bucket.capacity)
+        self.stats["submitted"] += 1
+        self._work.set()
+        return position, future
+
+    async def run(self, channel_id, user_id, factory, tokens=1):
+        """Submit and wait for the result."""
+        _, future = self.submit(channel_id, user_id, factory, tokens)
+        return await future
+
+    def _next_job(self):
+        while self._queues:
+            channel_id, users = next(iter(self._queues.items()))
+            user_id, jobs = next(iter(users.items()))
+            job = jobs.popleft()
+            if jobs:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            if users:
+                self._queues.move_to_end(channel_id)
+            else:
+                del self._queues[channel_id]
+            self._queued -= 1
+            self._queued_tokens -= min(job.tokens, self.token_bucket.capacity)
+            if not job.future.done(): # Skip requests whose caller already gave up
+                return job
+        return None
+
+    def _expire(self, job):
+        self.stats["expired"] += 1
+        if not job.future.done():
+            job.future.set_exception(RequestExpired())
+
+    async def _dispatch(self):
+        while True:
+            await self._work.wait()
+            await self._slots.acquire()
+            job = self._next_job()
+            if job is None:
+                self._slots.release()
+                self._work.clear()
+                continue
+            if time.monotonic() > job.deadline:
+                self._slots.release()
+                self._expire(job)
+                continue
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(job.tokens)
+            if time.monotonic() > job.deadline: # Rate limiting may have held it past its deadline
+                self._slots.release()
+                self._expire(job)
+                continue
+            self._wait_samples.append(time.monotonic() - job.enqueued_at)
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._execute(job))
+
+    async def _execute(self, job):
+        try:
+            result = await job.factory()
+        except Exception as e:
+            self.stats["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats["completed"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def get_stats(self) -> dict:
+        waits = sorted(self._wait_samples)
+        return {
+            **self.stats,
+            "queued": self._queued,
+            "in_flight": self._in_flight,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+import discord
+from env import parse_id_ranges
+
+log = logging.getLogger(__name__)
+
+# Sharding is off unless SHARDING_ENABLED=1 or SHARD_COUNT is set. SHARD_IDS picks the shards this
+# process runs, so several processes on one host can split the gateway (they share personas.db).
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) # 0 = let Discord recommend a count
+SHARD_IDS = parse_id_ranges(os.getenv('SHARD_IDS', ''))
+SHARDING_ENABLED = os.getenv('SHARDING_ENABLED', '0') == '1' or SHARD_COUNT > 0
+SHARD_STATS_INTERVAL = float(os.getenv('SHARD_STATS_INTERVAL', '300')) # Seconds between stats log lines; 0 = off
+SHARD_EVENT_WINDOW = 60.0 # Seconds of events used for the per-shard event rate
+
+def create_client(intents):
+    """Return a plain Client, or an AutoShardedClient when sharding is enabled."""
+    if not SHARDING_ENABLED:
+        return discord.Client(intents=intents)
+    if SHARD_IDS and not SHARD_COUNT:
+        raise ValueError("SHARD_IDS requires SHARD_COUNT to be set.")
+    return discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT or None, shard_ids=SHARD_IDS or None)
+
+def shard_for_guild(guild_id, shard_count):
+    """Discord's shard formula; DMs (no guild) always arrive on shard 0."""
+    if not guild_id or not shard_count:
+        return 0
+    return (guild_id >> 22) % shard_count
+
+class ShardPartitioned:
+    """One instance of some per-channel state object per shard, created on first use.
+
+    A channel only ever receives events through its guild's shard, so each shard's history
+    and coalescing state can be sized, inspected and dropped independently.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._parts = {}
+
+    def get(self, shard_id):
+        part = self._parts.get(shard_id)
+        if part is None:
+            part = self._parts[shard_id] = self.factory()
+        return part
+
+    def drop(self, shard_id):
+        self._parts.pop(shard_id, None)
+
+    def clear(self):
+        self._parts.clear()
+
+    def items(self):
+        return self._parts.items()
+
+class ShardStats:
+    """Per-shard event counters and event rates; latency comes from the client itself."""
+
+    def __init__(self, window=SHARD_EVENT_WINDOW):
+        self.window = window
+        self._events = {} # shard_id -> deque of event timestamps within the window
+        self._totals = {}
+        self._status = {} # shard_id -> "ready" / "disconnected" / "resumed"
+
+    def record_event(self, shard_id):
+        now = time.monotonic()
+        events = self._events.setdefault(shard_id, deque())
+        events.append(now)
+        while events and events[0] < now - self.window:
+            events.popleft()
+        self._totals[shard_id] = self._totals.get(shard_id, 0) + 1
+
+    def set_status(self, shard_id, status):
+        self._status[shard_id] = status
+
+    def get_stats(self, client) -> dict:
+        now = time.monotonic()
+        latencies = dict(getattr(client, "latencies", None) or [(0, client.latency)])
+        stats = {}
+        for shard_id in sorted(set(latencies) | set(self._totals)):
+            events = self._events.get(shard_id, ())
+            recent = sum(1 for timestamp in events if timestamp >= now - self.window)
+            latency = latencies.get(shard_id)
+            stats[shard_id] = {
+                "status": self._status.get(shard_id, "unknown"),
+                "latency_ms": round(latency * 1000, 1) if latency is not None and latency == latency else None, # NaN before the first heartbeat
+                "events_total": self._totals.get(shard_id, 0),
+                "events_per_second": recent / self.window,
+            }
+        return stats
+
+async def run_shard_stats_logger(client, shard_stats, interval=SHARD_STATS_INTERVAL):
+    """Background task: periodically log one line of stats per shard."""
+    while True:
+        await asyncio.sleep(interval)
+        for shard_id, stats in shard_stats.get_stats(client).items():
+            log.info("Shard %s: %s latency=%sms events=%d (%.2f/s)", shard_id, stats["status"], stats["latency_ms"],
+                     stats["events_total"], stats["events_per_second"], extra={"shard_id": shard_id})
@@ -1,37 +1,30 @@
-import sqlite3
+import logging
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
+import threading
+import time
+from gemini import invalidate_model_cache
+from persona_index import persona_names
+from database import connect, migrate, run_db_read
+from persona_versions import delete_versions, record_version, revert_steps
 
-# Load environment variables from .env file
-load_dotenv()
+log = logging.getLogger(__name__)
+
+# .env is loaded by bot.py before any module reads its settings
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 ADMIN_USER_ID = os.getenv('ADMIN_USER_ID')
-DB_FILE = "personas.db"
 DEFAULT_PERSONA_NAME = "default" # Changed from "wise-tree-default"
 
+_database_initialized = False
+
 def initialize_database():
-    conn = sqlite3.connect(DB_FILE)
+    """Migrate the schema and make sure a default persona exists. Only the first call does any work."""
+    global _database_initialized
+    if _database_initialized:
+        return
+    conn = connect()
     cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS personas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            content TEXT NOT NULL,
-            creator_id INTEGER NOT NULL,
-            is_default BOOLEAN DEFAULT 0,
-            original_content_before_last_append TEXT DEFAULT NULL
-        )
-    ''')
-    try:
-        cursor.execute("ALTER TABLE personas ADD COLUMN original_content_before_last_append TEXT DEFAULT NULL")
-        print("Added 'original_content_before_last_append' column to personas table.")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass
-        else:
-            raise
+    migrate(conn)
     cursor.execute("SELECT COUNT(*) FROM personas WHERE is_default = 1")
     if cursor.fetchone()[0] == 0:
         try:
@@ -41,7 +34,7 @@ def initialize_database():
 
             if not default_exists:
                 # If 'default' persona doesn't exist, create it from the file
-                print(f"Persona '{DEFAULT_PERSONA_NAME}' not found. Creating from system_message.txt...")
+                log.info("Persona '%s' not found. Creating from system_message.txt...", DEFAULT_PERSONA_NAME)
                 with open("system_message.txt", "r", encoding="utf-8") as f:
                     default_content = f.read().strip()
                 # Insert 'default' persona, but don't set it as default yet
@@ -49,85 +42,296 @@ def initialize_database():
                     "INSERT OR IGNORE INTO personas (name, content, creator_id, is_default) VALUES (?, ?, ?, ?)",
                     (DEFAULT_PERSONA_NAME, default_content, ADMIN_USER_ID, 0) # Insert with is_default = 0 initially
                 )
+                if cursor.rowcount:
+                    record_version(conn, cursor.lastrowid, None, default_content, "create", ADMIN_USER_ID)
             else:
-                 print(f"Persona '{DEFAULT_PERSONA_NAME}' found.")
+                 log.info("Persona '%s' found.", DEFAULT_PERSONA_NAME)
 
             # Now, ensure *a* default exists. If none was marked (e.g., clean DB), mark 'default' as the default.
             cursor.execute("SELECT COUNT(*) FROM personas WHERE is_default = 1")
             if cursor.fetchone()[0] == 0:
-                print(f"No default persona set. Setting '{DEFAULT_PERSONA_NAME}' as default.")
+                log.info("No default persona set. Setting '%s' as default.", DEFAULT_PERSONA_NAME)
                 cursor.execute("UPDATE personas SET is_default = 0") # Clear any potential stray defaults first
                 cursor.execute("UPDATE personas SET is_default = 1 WHERE name = ?", (DEFAULT_PERSONA_NAME,))
             else:
-                print("A default persona already exists.")
+                log.info("A default persona already exists.")
 
         except FileNotFoundError:
-            print(f"CRITICAL ERROR: system_message.txt not found. Cannot create default persona '{DEFAULT_PERSONA_NAME}'.")
-            conn.close()
+            log.critical("system_message.txt not found. Cannot create default persona '%s'.", DEFAULT_PERSONA_NAME)
+            conn.rollback()
             exit()
         except Exception as e:
-            print(f"Error initializing default persona '{DEFAULT_PERSONA_NAME}': {e}")
-            conn.close()
+            log.critical("Error initializing default persona '%s': %s", DEFAULT_PERSONA_NAME, e)
+            conn.rollback()
             exit()
     else:
-        print("Default persona check: A default persona already exists in the database.")
+        log.info("Default persona check: A default persona already exists in the database.")
     conn.commit()
-    conn.close()
+    invalidate_persona_cache()
+    persona_names.load(name for (name,) in conn.execute("SELECT name FROM personas"))
+    sync_persona_cache() # Record the current generation
+    _database_initialized = True
 
-# --- Helper functions for append/undo ---
-def store_original_content(original_content: str):
-    """Store the current default content for potential undo."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "UPDATE personas SET original_content_before_last_append = ? WHERE is_default = 1",
-            (original_content,)
-        )
-        conn.commit()
-        print("Stored original content for undo.")
-    except Exception as e:
-        print(f"Error storing original content: {e}")
-    finally:
-        conn.close()
-
-def get_last_original_content() -> str:
-    """Retrieve the stored original content from the default persona."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT original_content_before_last_append FROM personas WHERE is_default = 1")
-        result = cursor.fetchone()
-        return result[0] if result else ''
-    except Exception as e:
-        print(f"Error retrieving original content: {e}")
-        return ''
-    finally:
-        conn.close()
-
-def clear_last_original_content():
-    """Clear the stored original content after an undo."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE personas SET original_content_before_last_append = NULL WHERE is_default = 1")
-        conn.commit()
-        print("Cleared stored original content.")
-    except Exception as e:
-        print(f"Error clearing stored original content: {e}")
-    finally:
-        conn.close()
-
-def get_persona(name=None):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+def get_bot_state(key: str):
+    """Return a value stored with set_bot_state(), or None."""
+    row = connect().execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_bot_state(key: str, value: str):
+    conn = connect()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, value))
+
+# --- In-memory persona cache ---
+# Maps persona name -> (content, creator_id). The default persona is stored under None.
+# Every write to the personas table must call invalidate_persona_cache() after committing.
+PERSONA_SYNC_INTERVAL = float(os.getenv('PERSONA_SYNC_INTERVAL', '2')) # Seconds between checks for writes by other processes
+
+_persona_cache = {}
+_persona_cache_lock = threading.Lock()
+_persona_cache_stats = {"hits": 0, "misses": 0}
+_persona_generation = None # Last seen persona_generation counter
+_persona_last_sync = 0.0
+
+def invalidate_persona_cache():
+    """Drop all cached personas (and the models built from them) so the next lookup reloads them from the database."""
+    with _persona_cache_lock:
+        _persona_cache.clear()
+    invalidate_model_cache()
+
+def get_persona_cache_stats() -> dict:
+    """Return hit/miss counters and the current size of the persona cache."""
+    with _persona_cache_lock:
+        return {**_persona_cache_stats, "size": len(_persona_cache)}
+
+def _lookup_cached_persona(name):
+    with _persona_cache_lock:
+        if name in _persona_cache:
+            _persona_cache_stats["hits"] += 1
+            return True, _persona_cache[name]
+        _persona_cache_stats["misses"] += 1
+        return False, None
+
+def _load_persona(name):
+    conn = connect()
     if name:
-        cursor.execute("SELECT content, creator_id FROM personas WHERE name = ?", (name,))
+        result = conn.execute("SELECT content, creator_id FROM personas WHERE name = ?", (name,)).fetchone()
     else:
-        cursor.execute("SELECT content, creator_id FROM personas WHERE is_default = 1")
-    result = cursor.fetchone()
-    conn.close()
+        result = conn.execute("SELECT content, creator_id FROM personas WHERE is_default = 1").fetchone()
+    # Unknown names are not cached so typo'd -type overrides can't grow the cache without bound
+    if result:
+        with _persona_cache_lock:
+            _persona_cache[name] = result
     return result
 
+async def get_persona_async(name=None):
+    """Return (content, creator_id) for a persona (the default when `name` is None), or None.
+
+    Checks for writes by other processes at most every PERSONA_SYNC_INTERVAL seconds; a cache
+    miss is loaded on a DB reader thread instead of the event loop.
+    """
+    global _persona_last_sync
+    now = time.monotonic()
+    if now - _persona_last_sync >= PERSONA_SYNC_INTERVAL:
+        _persona_last_sync = now
+        await run_db_read(sync_persona_cache)
+    hit, result = _lookup_cached_persona(name)
+    return result if hit else await run_db_read(_load_persona, name)
+
+def sync_persona_cache():
+    """Drop cached personas and reload the name index if personas changed since the last check.
+
+    Catches writes made by other processes sharing the database (e.g. other shards). Blocking;
+    call through run_db_read.
+    """
+    global _persona_generation
+    conn = connect()
+    generation = conn.execute("SELECT generation FROM persona_generation WHERE id = 1").fetchone()[0]
+    if generation == _persona_generation:
+        return
+    if _persona_generation is not None:
+        invalidate_persona_cache()
+        persona_names.load(name for (name,) in conn.execute("SELECT name FROM personas"))
+    _persona_generation = generation
+
+# --- Persona read/write helpers (blocking; call through run_db_read/run_db from async code) ---
+def get_persona_meta(name):
+    """Return (creator_id, is_default) for a persona, or None if it doesn't exist."""
+    return connect().execute("SELECT creator_id, is_default FROM personas WHERE name = ?", (name,)).fetchone()
+
+def create_persona(name, content, creator_id):
+    """Insert a new persona. Raises sqlite3.IntegrityError if the name is taken."""
+    conn = connect()
+    with conn:
+        _insert_persona(conn, name, content, creator_id)
+    invalidate_persona_cache()
+    persona_names.add(name)
+
+def _insert_persona(conn, name, content, creator_id):
+    cursor = conn.execute(
+        "INSERT INTO personas (name, content, creator_id, is_default) VALUES (?, ?, ?, ?)",
+        (name, content, creator_id, 0)
+    )
+    record_version(conn, cursor.lastrowid, None, content, "create", creator_id)
+
+def update_persona_content(name, content, user_id=None) -> bool:
+    """Replace a persona's content. Returns False if it doesn't exist."""
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE") # The version delta is computed against the content read here
+        updated = _update_persona(conn, name, content, user_id)
+    invalidate_persona_cache()
+    return updated
+
+def _update_persona(conn, name, content, user_id) -> bool:
+    row = conn.execute("SELECT id, content FROM personas WHERE name = ?", (name,)).fetchone()
+    if not row:
+        return False
+    _set_content(conn, row[0], row[1], content, "modify", user_id)
+    return True
+
+def _set_content(conn, persona_id, old_content, new_content, kind, user_id):
+    conn.execute("UPDATE personas SET content = ? WHERE id = ?", (new_content, persona_id))
+    return record_version(conn, persona_id, old_content, new_content, kind, user_id)
+
+def delete_persona(name):
+    conn = connect()
+    with conn:
+        row = conn.execute("SELECT id FROM personas WHERE name = ?", (name,)).fetchone()
+        if row:
+            conn.execute("DELETE FROM personas WHERE id = ?", (row[0],))
+            delete_versions(conn, row[0])
+    invalidate_persona_cache()
+    persona_names.remove(name)
+
+def set_default_persona(name) -> bool:
+    """Mark a persona as the default. Returns False if it doesn't exist."""
+    conn = connect()
+    with conn:
+        if not conn.execute("SELECT 1 FROM personas WHERE name = ?", (name,)).fetchone():
+            return False
+        conn.execute("UPDATE personas SET is_default = 0 WHERE is_default = 1")
+        conn.execute("UPDATE personas SET is_default = 1 WHERE name = ?", (name,))
+    invalidate_persona_cache()
+    return True
+
+PERSONAS_PER_PAGE = 20
+FTS_MIN_SEARCH_CHARS = 3 # The trigram tokenizer can't match shorter terms
+
+_has_fts_index = None
+
+def _persona_search_clause(conn, search):
+    """Return (sql, params) restricting personas to names containing `search`."""
+    global _has_fts_index
+    if _has_fts_index is None:
+        _has_fts_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'personas_fts'").fetchone() is not None
+    if _has_fts_index and len(search) >= FTS_MIN_SEARCH_CHARS:
+        phrase = '"' + search.replace('"', '""') + '"'
+        return "id IN (SELECT rowid FROM personas_fts WHERE personas_fts MATCH ?)", [phrase]
+    return "name LIKE ?", [f"%{search}%"]
+
+def count_personas(search=None) -> int:
+    conn = connect()
+    if search:
+        clause, params = _persona_search_clause(conn, search)
+        return conn.execute(f"SELECT COUNT(*) FROM personas WHERE {clause}", params).fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM personas").fetchone()[0]
+
+def fetch_persona_page(search=None, after=None, before=None, limit=PERSONAS_PER_PAGE):
+    """Return up to `limit` (name, is_default, creator_id) rows, default first, then by name.
+
+    Uses keyset pagination: pass the (is_default, name) of the last row of the current page as
+    `after` for the next page, or of the first row as `before` for the previous one. Only one
+    page is ever read, regardless of table size.
+    """
+    conn = connect()
+    search_sql, search_params = "", []
+    if search:
+        clause, search_params = _persona_search_clause(conn, search)
+        search_sql = f" AND {clause}"
+    columns = "SELECT name, is_default, creator_id FROM personas"
+    if after is None and before is None:
+        where = f"WHERE 1{search_sql}"
+        return conn.execute(f"{columns} {where} ORDER BY is_default DESC, name ASC LIMIT ?", search_params + [limit]).fetchall()
+
+    # Mixed sort directions rule out a single row-value comparison, so read the rest of the
+    # cursor's is_default group and the following group as two index range scans.
+    if after is not None:
+        is_default, name = after
+        name_op, default_op, name_order, default_order = ">", "<", "ASC", "DESC"
+    else:
+        is_default, name = before
+        name_op, default_op, name_order, default_order = "<", ">", "DESC", "ASC" # Walk backwards, then flip below
+    rows = conn.execute(
+        f"""
+        SELECT * FROM ({columns} WHERE is_default = ? AND name {name_op} ?{search_sql} ORDER BY name {name_order} LIMIT ?)
+        UNION ALL
+        SELECT * FROM ({columns} WHERE is_default {default_op} ?{search_sql} ORDER BY is_default {default_order}, name {name_order} LIMIT ?)
+        ORDER BY is_default {default_order}, name {name_order} LIMIT ?
+        """,
+        [is_default, name, *search_params, limit, is_default, *search_params, limit, limit]
+    ).fetchall()
+    if before is not None:
+        rows.reverse()
+    return rows
+
+def append_to_default_persona(text_to_append, user_id=None):
+    """Append text to the default persona, recording the change in its version history."""
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE") # Read-modify-write; don't interleave with another process
+        _append_to_default(conn, text_to_append, user_id)
+    invalidate_persona_cache()
+
+def _append_to_default(conn, text_to_append, user_id=None):
+    current_default = conn.execute("SELECT id, content FROM personas WHERE is_default = 1").fetchone()
+    if not current_default:
+        raise Exception("Default persona not found.")
+    persona_id, current_content = current_default
+    _set_content(conn, persona_id, current_content, current_content + "\n\n" + text_to_append, "append", user_id)
+
+def revert_default_persona(steps=1, user_id=None):
+    """Undo the last `steps` changes to the default persona, recorded as a new version.
+
+    Returns the new version number, or None if the default persona has fewer than `steps`
+    changes to undo.
+    """
+    conn = connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        current_default = conn.execute("SELECT id, content FROM personas WHERE is_default = 1").fetchone()
+        if not current_default:
+            return None
+        persona_id, current_content = current_default
+        result = revert_steps(conn, persona_id, current_content, steps, user_id)
+        if result is None:
+            return None
+        version, content = result
+        conn.execute("UPDATE personas SET content = ? WHERE id = ?", (content, persona_id))
+    invalidate_persona_cache()
+    return version
+
+def apply_persona_request(conn, request):
+    """Apply an approved create/modify/append request inside the caller's transaction.
+
+    Does not commit or touch the caches; the caller must call invalidate_persona_cache() (and
+    update persona_names for creates) once the transaction commits. Raises sqlite3.IntegrityError
+    when creating a persona whose name is taken, and ValueError when modifying one that doesn't exist.
+    """
+    request_type = request['type']
+    if request_type == 'create':
+        _insert_persona(conn, request['name'], request.get('content', ''), request['user_id'])
+    elif request_type == 'modify':
+        if not _update_persona(conn, request['name'], request.get('content', ''), request['user_id']):
+            raise ValueError(f"Persona '{request['name']}' not found.")
+    elif request_type == 'append':
+        _append_to_default(conn, request['text_to_append'], request['user_id'])
+    else:
+        raise ValueError(f"Unknown request type '{request_type}'")
+
+def is_admin(user) -> bool:
+    # ADMIN_USER_ID is the raw env string; Discord user IDs are ints
+    return bool(ADMIN_USER_ID) and user.id == int(ADMIN_USER_ID)
+
 def is_admin_or_creator(interaction, creator_id):
-    return interaction.user.id == ADMIN_USER_ID or interaction.user.id == creator_id
+    return is_admin(interaction.user) or interaction.user.id == creator_id
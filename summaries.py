@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from database import connect, run_db, run_db_read
+from prompt import estimate_tokens
+
+log = logging.getLogger(__name__)
+
+SUMMARY_ENABLED = os.getenv('SUMMARY_ENABLED', '0') == '1'
+SUMMARY_EVERY = int(os.getenv('SUMMARY_EVERY', '20')) # Unsummarized messages beyond the raw tail that trigger a refresh
+SUMMARY_TAIL_MESSAGES = int(os.getenv('SUMMARY_TAIL_MESSAGES', '10')) # Newest messages always sent raw, never summarized
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))
+SUMMARY_MAX_CHANNELS = int(os.getenv('SUMMARY_MAX_CHANNELS', '500')) # Summaries kept in memory
+
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of a Discord conversation for a chat assistant. Merge the new messages "
+    "into the existing summary. Keep who said what when it matters, facts, decisions, open questions and the "
+    "current topic; drop greetings and small talk. Messages from \"You\" are the assistant's own replies. "
+    f"Write plain prose of at most {SUMMARY_MAX_TOKENS * 3 // 4} words and reply with the summary only."
+)
+
+# Long conversations keep their early context as a compact per-channel summary instead of an
+# ever longer raw history. The prompt gets the summary plus the raw messages newer than it
+# (at least SUMMARY_TAIL_MESSAGES). When a reply prompt is built and SUMMARY_EVERY messages beyond
+# that tail are waiting, a background task folds them into the summary, so no reply ever waits
+# for summarization and channels the bot never answers in are never summarized.
+
+class ChannelSummary:
+    __slots__ = ("text", "last_message_id")
+
+    def __init__(self, text, last_message_id):
+        self.text = text
+        self.last_message_id = last_message_id
+
+# --- SQLite side (blocking; called through run_db/run_db_read) ---
+def _load_summary(channel_id):
+    row = connect().execute(
+        "SELECT summary, last_message_id FROM channel_summaries WHERE channel_id = ?", (channel_id,)
+    ).fetchone()
+    return ChannelSummary(*row) if row else None
+
+def _store_summary(channel_id, summary):
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO channel_summaries (channel_id, summary, last_message_id, updated_at) VALUES (?, ?, ?, ?)",
+            (channel_id, summary.text, summary.last_message_id, time.time())
+        )
+
+class ChannelSummarizer:
+    """Keeps a rolling summary per channel/DM and refreshes it in the background.
+
+    `generate(channel_id, system_instruction, content)` is the coroutine that asks Gemini for
+    the new summary text; bot.py routes it through the generation scheduler like any reply.
+    """
+
+    def __init__(self, generate, enabled=SUMMARY_ENABLED, every=SUMMARY_EVERY, tail=SUMMARY_TAIL_MESSAGES,
+                 max_channels=SUMMARY_MAX_CHANNELS):
+        self.generate = generate
+        self.enabled = enabled
+        self.every = every
+        self.tail = tail
+        self.max_channels = max_channels
+        self._summaries = OrderedDict() # channel_id -> ChannelSummary, or None when there is none yet
+        self._refreshing = set()
+        self._tasks = set() # Keeps background refreshes alive until they finish
+        self.stats = {"refreshes": 0, "failed": 0, "summarized_messages": 0}
+
+    def _remember(self, channel_id, summary):
+        self._summaries[channel_id] = summary
+        self._summaries.move_to_end(channel_id)
+        if len(self._summaries) > self.max_channels:
+            self._summaries.popitem(last=False)
+
+    async def get(self, channel_id):
+        """Return the channel's ChannelSummary, or None."""
+        if not self.enabled:
+            return None
+        if channel_id in self._summaries:
+            self._summaries.move_to_end(channel_id)
+            return self._summaries[channel_id]
+        summary = await run_db_read(_load_summary, channel_id)
+        self._remember(channel_id, summary)
+        return summary
+
+    def maybe_refresh(self, channel_id, history_cache, self_user_id, after_id):
+        """Start a background refresh if `every` messages beyond the raw tail are newer than `after_id`.
+
+        Call when building a reply prompt for the channel, with the current summary's last_message_id.
+        """
+        if not self.enabled or channel_id in self._refreshing:
+            return
+        if history_cache.count_after(channel_id, after_id) < self.tail + self.every:
+            return
+        self._refreshing.add(channel_id)
+        task = asyncio.get_running_loop().create_task(self._refresh(channel_id, history_cache, self_user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, channel_id, history_cache, self_user_id):
+        try:
+            previous = await self.get(channel_id)
+            after_id = previous.last_message_id if previous else 0
+            lines, last_message_id = history_cache.summary_lines(channel_id, self_user_id, after_id, self.tail)
+            if not lines:
+                return
+            content = (
+                f"## Existing Summary:\n{previous.text if previous else '(none yet)'}\n\n"
+                "## New Messages:\n" + "\n".join(lines)
+            )
+            text = (await self.generate(channel_id, SUMMARY_INSTRUCTION, content)).strip()
+            if not text:
+                return
+            if estimate_tokens(text) > SUMMARY_MAX_TOKENS * 2: # The model ignored the length limit
+                text = text[:SUMMARY_MAX_TOKENS * 2 * 4] # ~4 characters per token
+            summary = ChannelSummary(text, last_message_id)
+            self._remember(channel_id, summary)
+            await run_db(_store_summary, channel_id, summary)
+            self.stats["refreshes"] += 1
+            self.stats["summarized_messages"] += len(lines)
+            log.debug("Summarized %d message(s); summary is ~%d tokens.", len(lines), estimate_tokens(text),
+                      extra={"channel_id": channel_id})
+        except Exception as e:
+            self.stats["failed"] += 1
+            log.warning("Summary refresh failed: %s", e, extra={"channel_id": channel_id})
+        finally:
+            self._refreshing.discard(channel_id)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "channels": len(self._summaries), "refreshing": len(self._refreshing)}
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+WRITE_SECONDS = 0.5
+TICK_SECONDS = 0.01
+MAX_LOOP_LAG = 0.1
+
+def _slow_write():
+    conn = database.connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS slow_write (id INTEGER PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50000) "
+            "INSERT INTO slow_write (value) SELECT hex(randomblob(32)) FROM n"
+        )
+        time.sleep(WRITE_SECONDS) # Hold the write transaction open like a long migration would
+    return conn.execute("SELECT COUNT(*) FROM slow_write").fetchone()[0]
+
+async def _measure():
+    lags = []
+
+    async def ticker():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK_SECONDS * 3) # Let the ticker get going
+    started = time.perf_counter()
+    rows = await database.run_db(_slow_write)
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    return rows, elapsed, lags
+
+def test_event_loop_stays_responsive_during_long_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "personas.db"))
+    rows, elapsed, lags = asyncio.run(_measure())
+
+    assert rows == 50000
+    assert elapsed >= WRITE_SECONDS
+    # The ticker kept running while the write was in progress, and never fell far behind
+    assert len(lags) >= WRITE_SECONDS / TICK_SECONDS / 2
+    assert max(lags) < MAX_LOOP_LAG
@@ -0,0 +1,83 @@
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import persona_versions
+from database import migrate
+from persona_versions import get_version_content, record_version, revert_steps
+
+PERSONA_ID = 1
+
+def _connect(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "personas.db"))
+    migrate(conn)
+    return conn
+
+def _edit(rng, content):
+    roll = rng.random()
+    if roll < 0.6:
+        return content + f"\n\nRule {rng.randint(0, 999)}: be {rng.choice(['kind', 'brief', 'precise'])}."
+    if roll < 0.9 and content:
+        start = rng.randrange(len(content))
+        return content[:start] + rng.choice(["polite", "", "terse and"]) + content[start + rng.randint(0, 10):]
+    return f"You are assistant number {rng.randint(0, 99)}."
+
+def test_every_version_rebuilds_exactly(tmp_path, monkeypatch):
+    monkeypatch.setattr(persona_versions, "PERSONA_SNAPSHOT_EVERY", 5) # Cross several snapshots
+    conn = _connect(tmp_path)
+    rng = random.Random(1)
+    content = "You are a helpful assistant."
+    expected = {record_version(conn, PERSONA_ID, None, content, "create"): content}
+    for _ in range(40):
+        new_content = _edit(rng, content)
+        expected[record_version(conn, PERSONA_ID, content, new_content, "modify")] = new_content
+        content = new_content
+
+    assert list(expected) == list(range(1, 42))
+    for version, content in expected.items():
+        assert get_version_content(conn, PERSONA_ID, version) == content
+    assert get_version_content(conn, PERSONA_ID, 42) is None
+    snapshots = conn.execute("SELECT COUNT(*) FROM persona_versions WHERE is_snapshot = 1").fetchone()[0]
+    assert 1 < snapshots < 41 # Mostly deltas, with periodic snapshots
+
+def test_revert_walks_back_one_step_at_a_time(tmp_path):
+    conn = _connect(tmp_path)
+    contents = ["base", "base\n\none", "base\n\none\n\ntwo", "base\n\none\n\ntwo\n\nthree"]
+    record_version(conn, PERSONA_ID, None, contents[0], "create")
+    for old, new in zip(contents, contents[1:]):
+        record_version(conn, PERSONA_ID, old, new, "append")
+
+    current = contents[-1]
+    for expected in reversed(contents[:-1]):
+        version, current = revert_steps(conn, PERSONA_ID, current, 1)
+        assert current == expected
+        assert get_version_content(conn, PERSONA_ID, version) == expected
+    # Nothing is older than the first version
+    assert revert_steps(conn, PERSONA_ID, current, 1) is None
+
+def test_multi_step_revert_and_history_too_short(tmp_path):
+    conn = _connect(tmp_path)
+    contents = ["a", "a b", "a b c", "a b c d"]
+    record_version(conn, PERSONA_ID, None, contents[0], "create")
+    for old, new in zip(contents, contents[1:]):
+        record_version(conn, PERSONA_ID, old, new, "modify")
+
+    assert revert_steps(conn, PERSONA_ID, contents[-1], 4) is None
+    version, content = revert_steps(conn, PERSONA_ID, contents[-1], 3)
+    assert (version, content) == (5, "a")
+    # The revert is itself a version, and a later edit still builds on it
+    record_version(conn, PERSONA_ID, content, "a z", "modify")
+    assert get_version_content(conn, PERSONA_ID, 6) == "a z"
+    assert get_version_content(conn, PERSONA_ID, 4) == "a b c d"
+
+def test_content_without_history_gets_an_initial_snapshot(tmp_path):
+    conn = _connect(tmp_path)
+    # A persona written before versioning existed only has its current content
+    version = record_version(conn, PERSONA_ID, "legacy content", "legacy content, edited", "modify")
+
+    assert version == 2
+    assert get_version_content(conn, PERSONA_ID, 1) == "legacy content"
+    assert revert_steps(conn, PERSONA_ID, "legacy content, edited", 1) == (3, "legacy content")
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resilience import CircuitBreaker, CircuitOpen, ResilientGenerator
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def _breaker(clock):
+    return CircuitBreaker(error_rate=0.5, min_requests=4, window=60, cooldown=30, clock=clock)
+
+def test_breaker_opens_on_error_rate_and_probes_after_cooldown():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    for succeeded in (True, False, True):
+        breaker.record(succeeded)
+    assert breaker.state == "closed" # Too few outcomes to judge yet
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow() # The single half-open probe
+    assert breaker.state == "half_open"
+    assert not breaker.allow() # Everything else waits for the probe's outcome
+
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+def test_failed_probe_reopens_and_lost_probe_is_replaced():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    for _ in range(4):
+        breaker.record(False)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    # The probe never reports back (e.g. it was cancelled); another is let through after a cooldown
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+def test_old_outcomes_leave_the_window():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    for _ in range(3):
+        breaker.record(False)
+    clock.now += 61
+    breaker.record(True)
+    assert breaker.state == "closed" # The three failures are outside the window
+
+def test_open_breaker_uses_fallback_or_fails_fast():
+    clock = FakeClock()
+    breaker = _breaker(clock)
+    for _ in range(4):
+        breaker.record(False)
+    generator = ResilientGenerator(max_retries=0, breaker=breaker)
+
+    async def request(model):
+        return f"reply from {model}"
+
+    assert asyncio.run(generator.generate(request, "primary", lambda: "fallback")) == "reply from fallback"
+    with pytest.raises(CircuitOpen):
+        asyncio.run(generator.generate(request, "primary"))
+    assert generator.stats["fallbacks"] == 1
+    assert generator.stats["rejected"] == 1
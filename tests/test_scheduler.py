@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import GenerationScheduler, QueueFull, RequestExpired
+
+def _scheduler(**kwargs):
+    settings = {"max_in_flight": 1, "requests_per_minute": 6000, "tokens_per_minute": 10 ** 6, "max_queue": 100, "deadline": 60}
+    settings.update(kwargs)
+    return GenerationScheduler(**settings)
+
+def test_round_robin_across_channels_then_users():
+    order = []
+
+    def job(label):
+        async def factory():
+            order.append(label)
+            return label
+        return factory
+
+    async def main():
+        scheduler = _scheduler()
+        # Channel 1 has a user with three requests and a user with one; channel 2 has two
+        submitted = [("a1", 1, 10), ("a2", 1, 10), ("a3", 1, 10), ("b1", 1, 11), ("c1", 2, 20), ("c2", 2, 20)]
+        futures = [scheduler.submit(channel_id, user_id, job(label))[1] for label, channel_id, user_id in submitted]
+        return await asyncio.gather(*futures)
+
+    results = asyncio.run(main())
+
+    assert results == ["a1", "a2", "a3", "b1", "c1", "c2"] # Each caller gets its own result
+    assert order == ["a1", "c1", "b1", "c2", "a2", "a3"]
+
+def test_request_waiting_past_its_deadline_expires_without_running():
+    ran = []
+
+    async def main():
+        scheduler = _scheduler(deadline=0.05)
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            ran.append("slow")
+
+        async def waiting():
+            ran.append("waiting")
+
+        _, first = scheduler.submit(1, 10, slow)
+        position, second = scheduler.submit(2, 20, waiting)
+        await first
+        with pytest.raises(RequestExpired):
+            await second
+        return position, scheduler.get_stats()
+
+    position, stats = asyncio.run(main())
+
+    assert position == 2 # Held behind the request using the only slot
+    assert ran == ["slow"]
+    assert stats["expired"] == 1
+    assert stats["completed"] == 1
+
+def test_position_counts_requests_held_by_the_rate_limit():
+    async def main():
+        scheduler = _scheduler(max_in_flight=10, requests_per_minute=2, max_queue=3)
+
+        async def factory():
+            return None
+
+        positions = [scheduler.submit(1, 10, factory)[0] for _ in range(3)]
+        with pytest.raises(QueueFull):
+            scheduler.submit(1, 10, factory)
+        scheduler._dispatcher.cancel()
+        return positions
+
+    # The third request exceeds the two-per-minute budget, even though a slot is free
+    assert asyncio.run(main()) == [0, 0, 3]
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '3600')) # Seconds before a resolved user is fetched again
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '1000')) # Users (and DM channels) kept; least recently used go first
+
+class UserCache:
+    """TTL cache of resolved Discord users and their DM channels.
+
+    Checks the gateway's member cache first, then our own entries, and only falls back to
+    a REST fetch_user/create_dm on a miss. Concurrent misses for the same user share one
+    REST request, so a burst of persona requests costs one round trip, not one each.
+    Both maps are LRUs bounded by `max_entries`.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.client = None
+        self._users = OrderedDict() # user_id -> (user, expires_at)
+        self._dm_channels = OrderedDict() # user_id -> (channel, expires_at)
+        self._inflight = {} # (kind, user_id) -> asyncio.Task
+        self.stats = {"hits": 0, "misses": 0}
+
+    def bind(self, client):
+        self.client = client
+
+    def _cached(self, entries, user_id):
+        entry = entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del entries[user_id]
+            return None
+        entries.move_to_end(user_id)
+        return entry[0]
+
+    def _store(self, entries, user_id, value):
+        entries[user_id] = (value, time.monotonic() + self.ttl)
+        entries.move_to_end(user_id)
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    async def _once(self, kind, user_id, fetch):
+        # Share one in-flight REST call between concurrent callers
+        key = (kind, user_id)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def get_user(self, user_id):
+        user_id = int(user_id)
+        user = self._cached(self._users, user_id) or self.client.get_user(user_id)
+        if user is not None:
+            self.stats["hits"] += 1
+            return user
+        self.stats["misses"] += 1
+        user = await self._once("user", user_id, lambda: self.client.fetch_user(user_id))
+        self._store(self._users, user_id, user)
+        return user
+
+    async def get_dm_channel(self, user_id):
+        """Return the DM channel for a user, opening it over REST only if it isn't cached."""
+        user_id = int(user_id)
+        channel = self._cached(self._dm_channels, user_id)
+        if channel is not None:
+            self.stats["hits"] += 1
+            return channel
+        user = await self.get_user(user_id)
+        channel = user.dm_channel or await self._once("dm", user_id, user.create_dm)
+        self._store(self._dm_channels, user_id, channel)
+        return channel
+
+    async def warm(self, user_id):
+        """Resolve a user and their DM channel ahead of time (e.g. the admin in on_ready)."""
+        await self.get_dm_channel(user_id)
+
+    def invalidate(self, user_id):
+        """Forget a user and their DM channel, e.g. after a send to them failed."""
+        user_id = int(user_id)
+        self._users.pop(user_id, None)
+        self._dm_channels.pop(user_id, None)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "users": len(self._users), "dm_channels": len(self._dm_channels)}
+
+user_cache = UserCache()